@@ -13,264 +13,41 @@ This program is free software: you can redistribute it and/or modify
     along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
-import sys, os, csv
+import sys, os, logging
 from datetime import datetime
 
+from startupTiming import startupTimer
+
 from PySide6.QtWidgets import (
     QWidget, QMainWindow, QMenuBar, QMenu, QPushButton, QDoubleSpinBox, 
     QVBoxLayout, QHBoxLayout, QLabel, QGridLayout, QComboBox, QLineEdit, 
     QGroupBox, QSpinBox, QApplication, QSlider, QFileDialog, QLayout, QCheckBox, QProgressBar
 )
-from PySide6.QtCore import Qt, QUrl, Signal, QEventLoop, Slot
+from PySide6.QtCore import Qt, QUrl, Signal, QEventLoop, Slot, QTimer
 from PySide6.QtGui import QDesktopServices, QIcon, QAction
+startupTimer.mark('import PySide6')
 
 import numpy as np
-from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
-from matplotlib.figure import Figure
-from matplotlib.widgets import SpanSelector
+startupTimer.mark('import numpy')
+# matplotlib is imported with the plots, once the window is shown
 
 sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
 
-from colorhandling import ColorHandler
 from lpmInterface import VirtualDevice, SensorDevice, PowerMeter, MeasurementManager
-from lpmParser import DataObject
+from lpmParser import DataObject, DataSignature, PulseAssignment, PulseTracker, SignatureAlignment, SortedData, ThresholdEstimator
 from customGUI import Aesthetics, ListSelect, PushPopList, InputBox, FileAccessWidgt
-from fileInterface import TSVAccess
+from fileInterface import TSVAccess, LightSourceFiles, BinaryDataFile
+from acquisitionEngine import SampleBuffer
+from lpmLogging import setupLogging, defaultLogFile
+startupTimer.mark('import SmartLPM modules')
+
+log = logging.getLogger(__name__)
 
 if not os.path.exists("c:/ProgramData/SmartLPM/Config/defaultProcess.tsv"):
     os.mkdir("c:/ProgramData/SmartLPM")
     os.mkdir("c:/ProgramData/SmartLPM/Config")
     shutil.copyfile(os.path.join(os.path.dirname(os.path.abspath(__file__)),"Config","defaultProcess.tsv"),r"C:\ProgramData\SmartLPM\Config\defaultProcess.tsv")
 
-class DataCanvas(FigureCanvasQTAgg):
-    newThresholdByClick = Signal(float)
-
-    def __init__(self, reactToScroll, parent=None, width=5, height=4, dpi=100):
-        fig = Figure(figsize=(width, height), dpi=dpi, layout='constrained')
-        self.axes = fig.add_subplot(111, facecolor='black')        
-        super(DataCanvas, self).__init__(fig)
-        self.dataMax = []
-        self.dataMin = []
-        self.reactToScroll = reactToScroll
-
-        print(self.reactToScroll)
-
-        if self.reactToScroll:
-            # Some mouse magic here on the plot
-            # we will connect mouse events for the data plot only
-            self.scroll_cid = self.mpl_connect('scroll_event', self.onScroll)
-            self.click_cid = self.mpl_connect('button_press_event', self.onClick)
-        else:
-            self.scroll_cid = None
-            self.click_cid = None
-
-
-    def linkSlider(self, sliderHandle):
-        self.slider = sliderHandle
-        
-    def redraw(self,xData,yData, clearBefore):
-        if clearBefore:
-            self.axes.clear()
-        for ind in range(len(yData)):
-            if ind == 0:
-                self.axes.plot(xData,yData[ind],'white')
-            else:
-                self.axes.plot(xData,yData[ind],color='gray', linestyle='dashed')
-        self.dataMax = max(yData[0][:])
-        self.dataMin = min(yData[0][:])
-        self.draw()
-
-    def drawOnTop(self,xData,yData, plotColor, connectedLines):
-        wavelengthCount = len(yData)
-        for wavelength in range(wavelengthCount):
-            if connectedLines:
-                self.axes.plot(xData,yData[wavelength],color=plotColor)
-            else:
-                self.axes.plot(xData,yData[wavelength],color=plotColor, marker='.')
-                #self.axes.plot(xData,yData[wavelength],color=plotColor, marker='.', linestyle='')
-
-        self.dataMax = max(yData)
-        self.dataMin = min(yData)            
-
-    def addSinglePlot(self,xData,yData, plotColor):
-        self.axes.plot(xData,yData,color=plotColor)        
-        self.draw()
-
-    def onScroll(self, event):
-        # Get current Y limits
-        currentYlim = self.axes.get_ylim()
-        lowerLimit, upperLimit = currentYlim
-
-        zoomFactor = 0.1 
-
-        # Check the direction of the scroll
-        if event.button == 'down':
-            # Zoom in
-            y_value = event.ydata
-            newLowerLimit = y_value - (y_value - lowerLimit) * (1 - zoomFactor)
-            newUpperLimit = y_value + (upperLimit - y_value) * (1 - zoomFactor)
-
-        elif event.button == 'up':
-            # Zoom out
-            y_value = event.ydata
-            newLowerLimit = y_value - (y_value - lowerLimit) * (1 + zoomFactor)
-            newUpperLimit = y_value + (upperLimit - y_value) * (1 + zoomFactor)
-
-        # Set new Y limits
-        self.axes.set_ylim(newLowerLimit, newUpperLimit)        
-        self.draw()
-
-    def onClick(self, event):
-        # Check if the click is within the axes        
-
-        if event.inaxes is not None:
-
-            if event.button == 1:  # Left mouse button
-                # Get the Y value at the clicked position
-                clickedValue = event.ydata
-                print(f"Power value at clicked position: {clickedValue}")
-                
-                self.newThresholdByClick.emit(clickedValue)
-
-            elif event.button == 3:  # Right mouse button
-                # Reset zoom
-                print(self.dataMax)
-                if self.dataMax.size > 0:
-                    self.axes.set_ylim(0, self.dataMax)
-                    self.draw()
-        else:
-            print("Clicked outside the axes.")
-
-class DataSignature():
-
-    def __init__(self):        
-        self.signature = []
-        self.signatureString = []
-        
-    def calculateColors(self, wavelengths):
-        # To define how wavelengths will be represented later
-        self.Red   = []
-        self.Green = []
-        self.Blue  = []
-        for wavelength in wavelengths:        
-            RL, GL, BL = ColorHandler.waveLengthToRGB(wavelength)            
-            self.Red.append(RL)
-            self.Green.append(GL)
-            self.Blue.append(BL)
-    
-    @staticmethod
-    def stringOrList2Array(inputData):
-        
-        if isinstance(inputData, str):
-            inputData = inputData.strip('[]')
-            array = [elem.strip() for elem in inputData.split(',') if elem]
-            return array
-        if isinstance(inputData, list):
-            if len(inputData) == 1:        
-                return [int(inputData[0])]  # Convert the single element to a string in a list
-            elif len(inputData) > 1:                            
-                return [int(elem) for elem in inputData]  # Convert each element to a string
-
-    def calculateSignature(self):
-        # The full signature consists in power setting blocks concatenated
-
-        self.calculateColors(self.wavelengths)
-        
-        setPowerArray = self.stringOrList2Array(self.setPowers)
-        wavelengthArray = self.stringOrList2Array(self.wavelengths)
-
-        self.powerSettingCount = len(setPowerArray)
-        self.wavelengthCount   = len(wavelengthArray)
-
-        pulsesPerBlock = self.powerSettingCount * self.wavelengthCount
-
-        duration = self.duration-self.signaturePause # We want to prepend one section of zeros atr the beggining
-        self.readoutCount = int((duration / self.readoutInterval) + 1)
-
-        # The signature initialization works equally for both cases:
-        self.signature  = np.zeros((self.wavelengthCount,self.readoutCount))
-
-        self.runingTimePerPulse = int(self.measurementInterval/pulsesPerBlock)
-        dataPointsPerPulse = int((self.runingTimePerPulse - self.signaturePause) / self.readoutInterval)
-        idlePointsPerPulse = int(self.signaturePause / self.readoutInterval)
-
-        PulselLen = dataPointsPerPulse + idlePointsPerPulse
-
-        overallPulseShift = idlePointsPerPulse  # Start after one idle cycle
-
-        # a block consits in the set of pulses and pauses covering all the 
-        # desired cases once. Blocks can be repeated it duration allows        
-        blocks = int(duration/self.measurementInterval)
-
-        if self.order == 'LP':
-            # Powers first
-            
-            placeholder = []
-            
-            # the placeholder defines the signature to repeat for every
-            for setPowerInd in range(self.powerSettingCount):
-
-                for readout in range(dataPointsPerPulse):
-                    placeholder.append(setPowerArray[setPowerInd])
-                    
-                for readout in range(idlePointsPerPulse):
-                    placeholder.append(0)
-
-            lblk = self.wavelengthCount*len(placeholder)
-            blockSignature = np.zeros((self.wavelengthCount, lblk))
-            # For each wavelegth indices start with an offset
-            for wavelengthInd in range(self.wavelengthCount):
-                indexZero = wavelengthInd * len(placeholder)
-                blockSignature[wavelengthInd, indexZero:indexZero+len(placeholder)] = placeholder
-
-            # repeat the full process for evey block
-            for block in range(blocks):
-                for wavelengthInd in range(self.wavelengthCount):
-                    
-                    self.signature[wavelengthInd, block*lblk+overallPulseShift:(block+1)*lblk+overallPulseShift] = blockSignature[wavelengthInd, :]
-            
-            self.signatureString = str(dataPointsPerPulse)+'T'+str(self.powerSettingCount)+'P'+str(self.wavelengthCount)+'L'
-
-        if self.order == 'PL':
-            # Wavelengths first
-            
-            # Each pulse:
-            PulselLen = dataPointsPerPulse + idlePointsPerPulse
-            # One pulse per wavelength
-            wavelengthSetLen = self.wavelengthCount*PulselLen
-            miniblockSignature = np.zeros((self.wavelengthCount, wavelengthSetLen))
-
-            for wavelengthInd in range(self.wavelengthCount):
-                start = wavelengthInd * PulselLen
-                end   = (wavelengthInd+1) * PulselLen
-                for readout in range(start,end):
-                    if readout - start < dataPointsPerPulse:
-                        miniblockSignature[wavelengthInd,readout] = 1
-                        
-            lblk = wavelengthSetLen * self.powerSettingCount
-            for setPowerInd in range(self.powerSettingCount):
-                startP = overallPulseShift  + setPowerInd       * wavelengthSetLen 
-                endP   = overallPulseShift  + (setPowerInd + 1) * wavelengthSetLen                
-                self.signature[:, startP:endP] = self.setPowers[setPowerInd]*miniblockSignature
-                
-            for block in range(blocks):
-                start = block * lblk
-                end   = (block+1) * lblk
-                if (end < self.readoutCount):
-                    self.signature[:, start:end] = self.signature[:, 0:lblk]
-            
-            self.signatureString = str(dataPointsPerPulse)+'T'+str(self.wavelengthCount)+'L'+str(self.powerSettingCount)+'P'
-            self.structuredData = np.zeros((self.readoutCount, self.wavelengthCount,  self.powerSettingCount))
-
-    def setParameters(self, wavelengths, setPowers, measurementInterval, readoutInterval, duration, signaturePause, order):
-        self.wavelengths = wavelengths
-        self.setPowers   = setPowers
-        self.measurementInterval = measurementInterval
-        self.readoutInterval = readoutInterval     
-        self.duration = duration
-        self.signaturePause = signaturePause
-        self.order = order
-
 class CalibrationWindow(QWidget):
     # Accessory window for the interactive calibration of the measurements
 
@@ -313,7 +90,7 @@ class CalibrationWindow(QWidget):
         return self.setWavelength, self.calibrationFactors
 
     def setCentralWavelength(self):        
-        print(self.setWavelengthSel.currChoice)
+        log.debug("central wavelength: %s", self.setWavelengthSel.currChoice)
         self.setWavelength = self.setWavelengthSel.currChoice
 
     def updateList(self):
@@ -324,7 +101,6 @@ class CalibrationWindow(QWidget):
         items = []
         for element in self.calibrationWavelengths:
             items.append(str(element))
-            print(items)
         self.setWavelengthSel.listDisplay.addItems(items)
         self.setWavelengthSel.listDisplay.setCurrentIndex(len(self.setWavelengthSel.choices)-1)
 
@@ -420,12 +196,29 @@ class programGUI(QMainWindow):
         # reassignment and correction 
         self.dynReassignment = False
         self.dynCorrection   = False
+        # Reassign pulses by their aligned position in the signature
+        # instead of counting them
+        self.alignToSignature = False
+        # Threshold estimated from the histogram of the acquired powers
+        self.autoThreshold = False
+        self.thresholdEstimator = None
         
         self.dataWasReassigned   = False
         self.dataWasRecalibrated = False
 
         self.policy = 'blind'       
         self.signature = DataSignature()
+        self.pulseTracker = None
+        # Readouts sorted by pulse, see SortedData
+        self.sortedData = None
+        # Live samples, written by the worker and read here by index
+        self.samples = None
+        self.sampleCount = 0
+
+        # How the power meter is read within each readout interval
+        self.averaging = 'software'
+        # Acquired data as tab separated text or compact binary records
+        self.binaryData = False
 
         # Looking good is important!
         self.setWindowIcon(QIcon(os.path.dirname(__file__)+"/Resource/logo.png"))
@@ -506,9 +299,10 @@ class programGUI(QMainWindow):
         self.metadataFieldLayout.addWidget(self.metadataBox,0,1)
 
 
-        # Figure placeholder for signature schemes:        
-        reactToScroll = False
-        self.SignatureCanvas = DataCanvas(reactToScroll)
+        # Figure placeholder for signature schemes, the plots 
+        # are created once the window is shown (createPlots)
+        self.SignatureCanvas = None
+        self.SignaturePlaceholder = QWidget(self)
 
         # To initialize the widgets and data ignature from a file
         self.setupFromFile(self.configFile)
@@ -536,7 +330,7 @@ class programGUI(QMainWindow):
         self.SetupPanelLayout.addLayout(self.selectorLayout,1,0,4,1)
         self.SetupPanelLayout.addLayout(self.inputBoxesLayout,1,1,4,1)
         self.SetupPanelLayout.addLayout(self.metadataFieldLayout,5,0,4,2)
-        self.SetupPanelLayout.addWidget(self.SignatureCanvas,1,2,graphRowSpan,graphColSpan)
+        self.SetupPanelLayout.addWidget(self.SignaturePlaceholder,1,2,graphRowSpan,graphColSpan)
         self.SetupPanelLayout.addWidget(self.setupFileWdgt,5,2,graphRowSpan,graphColSpan)
 
         # Data panel .......................................................
@@ -554,16 +348,14 @@ class programGUI(QMainWindow):
         self.DataPanelTitle.setStyleSheet(Aesthetics.titleBar)
         
         # Figure placeholder for data:
-        reactToScroll = True
-        self.DataCanvas = DataCanvas(reactToScroll, width=5, height=4, dpi=100)
-        # The line below connects the two mechanisms to set the threshold
-        self.DataCanvas.newThresholdByClick.connect(self.thresholdAdjustedByClick)
+        self.DataCanvas = None
+        self.DataPlaceholder = QWidget(self)
 
         # Data files
         self.dataFileWdgt = FileAccessWidgt(
             'Data file', 
             self.defaultDataPath, 
-            "Data files (*.csv *tsv *.txt)", 
+            "Data files (*.csv *tsv *.txt *.lpmb)", 
             self.selectDataFile, 
             self.saveAndUpdatePath,
             "select_folders"
@@ -616,6 +408,16 @@ class programGUI(QMainWindow):
 
         self.dynReasChk.stateChanged.connect(self.toggleDynamicReassignment)
 
+        # Alignment to the signature .....................................        
+        self.alignChk = QCheckBox("align to signature")
+        self.alignChk.setChecked(self.alignToSignature)
+        self.alignChk.stateChanged.connect(self.toggleAlignment)
+
+        # Automatic threshold .....................................        
+        self.autoThresholdChk = QCheckBox("automatic threshold")
+        self.autoThresholdChk.setChecked(self.autoThreshold)
+        self.autoThresholdChk.stateChanged.connect(self.toggleAutoThreshold)
+
         # Dynamic calibration .....................................        
         self.dynCalChk = QCheckBox("apply corrections")
         if self.dynCorrection == True:
@@ -644,15 +446,17 @@ class programGUI(QMainWindow):
         self.DataControlsLayout.addWidget(self.reassignmentTitle, 0,0,1,2)
         self.DataControlsLayout.addWidget(self.reassignBtn,1,0)
         self.DataControlsLayout.addWidget(self.dynReasChk,1,1)
+        self.DataControlsLayout.addWidget(self.autoThresholdChk,2,0)
+        self.DataControlsLayout.addWidget(self.alignChk,2,1)
 
-        self.DataControlsLayout.addWidget(self.calibrationTitle, 2,0,1,2)
-        self.DataControlsLayout.addWidget(self.startCalibrationBtn,3,0)
-        self.DataControlsLayout.addWidget(self.dynCalChk,3,1)
+        self.DataControlsLayout.addWidget(self.calibrationTitle, 3,0,1,2)
+        self.DataControlsLayout.addWidget(self.startCalibrationBtn,4,0)
+        self.DataControlsLayout.addWidget(self.dynCalChk,4,1)
 
-        self.DataControlsLayout.addWidget(self.wavelengthTag, 4,0)
-        self.DataControlsLayout.addWidget(self.displayCalibWvlts,4,1)
-        self.DataControlsLayout.addWidget(self.correctionTag,5,0)                
-        self.DataControlsLayout.addWidget(self.displayCalibCoefs,5,1)
+        self.DataControlsLayout.addWidget(self.wavelengthTag, 5,0)
+        self.DataControlsLayout.addWidget(self.displayCalibWvlts,5,1)
+        self.DataControlsLayout.addWidget(self.correctionTag,6,0)                
+        self.DataControlsLayout.addWidget(self.displayCalibCoefs,6,1)
         
         titleSpanV = 2
         dataplotSpanH = 3
@@ -660,11 +464,9 @@ class programGUI(QMainWindow):
         self.DataPanelLayout.addWidget(self.DataPanelTitle, 0,0, titleSpanH, titleSpanV)
         self.DataPanelLayout.addLayout(self.DataControlsLayout,1,0)
         self.DataPanelLayout.addWidget(self.ThresholdSlider,0,4, dataplotSpanV , 1)
-        self.DataPanelLayout.addWidget(self.DataCanvas,0,1,dataplotSpanV,dataplotSpanH)
+        self.DataPanelLayout.addWidget(self.DataPlaceholder,0,1,dataplotSpanV,dataplotSpanH)
         self.DataPanelLayout.addWidget(self.dataFileWdgt,2,1,dataplotSpanV,dataplotSpanH)
         self.DataPanelLayout.addWidget(self.splitByPowerCheck,4,3, alignment=Qt.AlignRight)
-
-        self.DataCanvas.draw()        
         
         # Execution panel .................................................
         self.ExecPanelTitle   = QLabel("Get data")
@@ -681,13 +483,26 @@ class programGUI(QMainWindow):
         self.refWavelthInput = ListSelect('Reference Wavelength [nm]', self.wavelengths, wlChoices, self.checkConsistency)
         self.refWavelthInput.layout.setSpacing(20)                
 
+        # Averaging strategy selector
+        self.averagingChoices     = ['software', 'burst', 'hardware']
+        self.averagingChoiceNames = ['single readouts', 'burst readouts', 'meter averaging']
+        self.averagingInput = ListSelect('Averaging', self.averagingChoices, self.averagingChoiceNames, self.updateAveraging)
+        self.averagingInput.layout.setSpacing(20)
+
+        # Data file format
+        self.binaryDataCheck = QCheckBox("binary data files")
+        self.binaryDataCheck.setChecked(self.binaryData)
+        self.binaryDataCheck.stateChanged.connect(self.toggleBinaryData)
+
         # "Start button" ..................................................
         self.StartButton = QPushButton("Acquire now", self)
         self.StartButton.setFixedSize(100, 30)
                 
         # Add elements to the panel
         self.ExecPanelLayout.addWidget(self.ExecPanelTitle,0,0, titleSpanH, titleSpanV)
+        self.ExecPanelLayout.addWidget(self.averagingInput, 0,1)
         self.ExecPanelLayout.addWidget(self.refWavelthInput, 0,2)
+        self.ExecPanelLayout.addWidget(self.binaryDataCheck, 0,3)
         self.ExecPanelLayout.addWidget(self.StartButton,0,4)
 
         self.StartButton.clicked.connect(self.startStop)
@@ -709,6 +524,31 @@ class programGUI(QMainWindow):
         self.central_layout.addWidget(self.DataPanel, 1,0)
         self.central_layout.addWidget(self.ExecPanel, 2,0)
 
+        # Runs as soon as the event loop starts, after the window is shown
+        QTimer.singleShot(0, self.createPlots)
+
+    def createPlots(self):
+        # matplotlib and its Qt backend are only loaded here
+        from plotCanvas import DataCanvas
+        startupTimer.mark('import matplotlib')
+
+        reactToScroll = False
+        self.SignatureCanvas = DataCanvas(reactToScroll)
+        self.SetupPanelLayout.replaceWidget(self.SignaturePlaceholder, self.SignatureCanvas)
+        self.SignaturePlaceholder.deleteLater()
+
+        reactToScroll = True
+        self.DataCanvas = DataCanvas(reactToScroll, width=5, height=4, dpi=100)
+        # The line below connects the two mechanisms to set the threshold
+        self.DataCanvas.newThresholdByClick.connect(self.thresholdAdjustedByClick)
+        self.DataPanelLayout.replaceWidget(self.DataPlaceholder, self.DataCanvas)
+        self.DataPlaceholder.deleteLater()
+
+        self.updateSignature()
+        self.DataCanvas.draw()
+        startupTimer.mark('plots')
+        startupTimer.finish()
+
     def saveAndUpdatePath(self, dataSavePath):
         # Ensures that the data path chosen by the user gets
         # saved for the next session(s)
@@ -717,12 +557,16 @@ class programGUI(QMainWindow):
             os.path.join(self.settingsFilePath,self.configFile)
             )
 
+    def updateAveraging(self):
+        self.averaging = self.averagingInput.currChoice
+        log.info('Averaging strategy: %s', self.averaging)
+
     def checkConsistency(self):
         if self.wavelengths == self.calibratedWavelengths:
-            print('Calibration wavelengths match the ones listed for measurement.')
+            log.info('Calibration wavelengths match the ones listed for measurement.')
             self.calibrationConsistency = True            
         else:
-            print('Consistency check failed. Please check the wavelength lists.')
+            log.warning('Consistency check failed. Please check the wavelength lists.')
             self.calibrationConsistency = False
             
     def toggleCheckEnable(self, box, arg):
@@ -782,25 +626,74 @@ class programGUI(QMainWindow):
                 self.selectorEnable(self.refWavelthInput, "Reference Wavelength [nm]")
                 self.buttonEnable(self.StartButton, "Acquisition without correction")
 
-        print('dynamic correction set to ' + str(self.dynCorrection))
+        log.info('dynamic correction set to %s', self.dynCorrection)
         
     def togglePowerSplit(self):
         if self.splitByPowerCheck.isChecked():            
             self.splitByPower = True
-            print('Files will be split by power')
+            log.info('Files will be split by power')
         else:
             self.splitByPower = False
-            print('Files will not be split by power')
+            log.info('Files will not be split by power')
+
+    def toggleAlignment(self):
+        # Used by Reassign, the dynamic reassignment keeps counting pulses
+        self.alignToSignature = self.alignChk.isChecked()
+        if self.alignToSignature:
+            log.info('Pulses will be aligned to the signature')
+        else:
+            log.info('Pulses will be counted')
+
+    def toggleAutoThreshold(self):
+        self.autoThreshold = self.autoThresholdChk.isChecked()
+        log.info('automatic threshold set to %s', self.autoThreshold)
+        if self.autoThreshold:
+            self.applyAutoThreshold()
+
+    def applyAutoThreshold(self):
+        # From the running histogram during the acquisition, otherwise 
+        # from the whole trace shown
+        if self.acquiringNow and self.thresholdEstimator is not None:
+            threshold = self.thresholdEstimator.threshold()
+            # The estimate wanders within the gap between dark readouts and
+            # pulses, it is only followed when readouts change class
+            if threshold is not None and self.thresholdEstimator.readoutsBetween(self.data.threshold, threshold) == 0:
+                return
+        elif len(self.data.measuredPower) != 0 or self.sampleCount != 0:
+            threshold = ThresholdEstimator.estimate(self.acquiredData[1])
+        else:
+            return
+        # Until the pulses stand out from the dark readouts there is none
+        if threshold is not None and threshold != self.data.threshold:
+            self.thresholdAdjustedByClick(threshold)
+
+    def toggleBinaryData(self):
+        self.binaryData = self.binaryDataCheck.isChecked()
+        if self.binaryData:
+            log.info('Data will be saved as binary records')
+        else:
+            log.info('Data will be saved as text')
+
+    def recipeMetadata(self):
+        # Stored in the header of binary data files
+        metadata = {name: getattr(self, name) for name in self.fieldNames}
+        metadata['calibrationFactors'] = self.calibrationFactors
+        metadata['calibratedWavelengths'] = self.calibratedWavelengths
+        metadata['refWavelength'] = self.refWavelength
+        return metadata
 
     def toggleDynamicReassignment(self):
         if self.dynReasChk.isChecked():
             self.thresholdAdjustedByClick(self.data.threshold)
             self.dynReassignment = True
             self.dataWasReassigned = True
+            if self.acquiringNow:
+                # Points acquired so far were not sorted yet
+                self.assignLivePoints(0)
         else:
             self.dynReassignment = False
             self.dataWasReassigned = False
-        print('dynamic reassignment set to ' + str(self.dynReassignment))
+        log.info('dynamic reassignment set to %s', self.dynReassignment)
     
     def onCalibrationAvailable(self, table):        
         self.calibrationTable = table
@@ -818,7 +711,7 @@ class programGUI(QMainWindow):
                 try:
                     self.CalibrationWindow.close()
                 except:
-                    print("Window already closed")
+                    log.debug("Window already closed")
 
         self.selectorDisable(self.refWavelthInput, "Fixed by calibration")
 
@@ -826,80 +719,44 @@ class programGUI(QMainWindow):
 
         self.device.calibrationReady.connect(self.onCalibrationAvailable)
 
-        print('passing ',self.CalibrationWindow.setWavelength)
+        log.debug('passing %s', self.CalibrationWindow.setWavelength)
         
         self.device.progressBarHdl = self.CalibrationWindow.progressBar
         
         if self.testMode == True:
             self.device.runCalibrationLoop(
                 self.CalibrationWindow.calibrationWavelengths, 
-                self.CalibrationWindow.setWavelength,'test')
+                self.CalibrationWindow.setWavelength,'test', self.averaging)
         else:
             self.device.runCalibrationLoop(
                 self.CalibrationWindow.calibrationWavelengths, 
-                self.CalibrationWindow.setWavelength,'system')
+                self.CalibrationWindow.setWavelength,'system', self.averaging)
         
-        print('Calibration factors, main function: ', str(self.calibrationTable))
-        print('Calibration wavelengths, main function: ', str(self.calibratedWavelengths))
+        log.info('Calibration factors: %s', self.calibrationTable)
+        log.info('Calibration wavelengths: %s', self.calibratedWavelengths)
 
     def enableCalibratedAcquisition(self):        
 
         self.toggleCheckEnable(self.dynCalChk, "on")
-        print('self.referenceWavelth: ' + str(self.device.referenceWavelength))
+        log.info('reference wavelength: %s', self.device.referenceWavelength)
         self.refWavelthInput.listDisplay.setCurrentText(str(self.device.referenceWavelength))
         self.refWavelthInput.titleWdgt.setText("Central wavelength [nm]")
         
 
-    def assignCurrPoint(self, currElementInd, currPulse, indL, indP, currentPower):
-
-        if currentPower <= self.data.threshold:
-            currentPower = 0
-        else:
-            if (currElementInd > 0) and (np.all(self.reassignedData[currElementInd,:] == 0)) :
-                # A new pulse starts
-                currPulse = currPulse + 1
-                if currPulse == 0:
-                    indL = 0
-                    indP = 0
-                elif currPulse > 0:
-                    if self.order == 'PL':
-                        if indL < self.signature.wavelengthCount-1:
-                            indL = indL+1
-                        else:
-                            indL = 0
-                            if indP < self.signature.powerSettingCount-1:
-                                indP = indP+1
-                            else:
-                                indP = 0
-                    elif self.order == 'LP':
-                        if indP < self.signature.powerSettingCount-1:
-                            indP = indP+1
-                        else:
-                            indP = 0
-                            if indL < self.signature.wavelengthCount-1:
-                                indL = indL+1                            
-                            else:
-                                indL = 0
-
+    def assignLivePoints(self, first):
+        # Rewrites the sorted live data from point 'first' on, 
+        # using the pulse labels kept by the pulse tracker
+        last = self.pulseTracker.count
+        points, indL, indP = self.pulseTracker.labels(first, last)
+        power = self.pulseTracker.power[points]
         if(self.dynCorrection and self.calibrationConsistency):
-            currentPower = currentPower * self.calibrationTable[indL]
+            power = power * np.asarray(self.calibrationTable)[indL]
 
-        currElementInd = currElementInd+1        
-        self.structuredData[currElementInd,indL,indP] = currentPower
-        self.reassignedData[currElementInd,indL] = currentPower        
-        self.pointers[currElementInd, :] = [indL,indP]
-
-        print('pulse: ', currPulse, 
-                'wavelength: ', self.wavelengths[indL], 
-                'set power: ',self.setPowers[indP],
-                '-> data[' + str(indL)+ ',' + str(indP) + ']' )
-
-
-        return currElementInd, currPulse, indL, indP
+        self.sortedData.assign(first, last, points, indL, indP, power)
 
     def reassignData(self):
                         
-        print("Applying signature: ", self.signature.signatureString)
+        log.info("Applying signature: %s", self.signature.signatureString)
 
         if any(self.data.measuredPower):
             self.tmpData = self.data
@@ -907,86 +764,65 @@ class programGUI(QMainWindow):
             self.tmpData.wavelengthArray = np.zeros(len(self.data.measuredPower))
             self.tmpData.powerSettingArray = np.zeros(len(self.data.measuredPower))
 
-            print('applying threshold: ', self.tmpData.threshold)
+            log.debug('applying threshold: %s', self.tmpData.threshold)
             self.tmpData.applyThreshold()
             self.tmpData.setSignature(self.signature.signatureString)
             self.tmpData.parseSignature()
 
-            print('Field labels: ',self.tmpData.fieldLabels)
-            print('Field element count: ',self.tmpData.fieldElemCount)
-
-            peakInd  = -1 # The first peak will be at 0
+            log.debug('Field labels: %s, element count: %s', self.tmpData.fieldLabels, self.tmpData.fieldElemCount)
 
             self.tmpData.wavelengthCount   = self.tmpData.fieldElemCount[self.tmpData.fieldLabels.index('L')]
             self.tmpData.powerSettingCount = self.tmpData.fieldElemCount[self.tmpData.fieldLabels.index('P')]
 
+            # After thresholding the values outside peaks are zero. Pulses 
+            # are found and labelled for all the points at once
+            power = np.asarray(self.tmpData.measuredPower, dtype=float)
+            if self.alignToSignature:
+                # Labelled by their position, missed or spurious pulses 
+                # do not shift the following ones
+                alignment = SignatureAlignment(self.signature)
+                pointers = alignment.pointers(power, 0)
+                points = np.flatnonzero(~np.isnan(pointers[:, 0]))
+                indL = pointers[points, 0].astype(int)
+                indP = pointers[points, 1].astype(int)
+                log.info("Signature aligned with a lag of %.1f readouts, scale %.5f", alignment.lag, alignment.scale)
+            else:
+                pulses = PulseAssignment.pulseIndices(power, 0)
+                points = np.flatnonzero(pulses >= 0)
+                indL, indP = PulseAssignment.pulseLabels(
+                    pulses[points], self.tmpData.wavelengthCount, 
+                    self.tmpData.powerSettingCount, self.order)
+                log.info("%d pulses found", pulses.max() + 1)
+
+            if self.wavelengths == self.calibratedWavelengths:
+                if(self.dynCorrection):
+                    log.debug("Wavelengths are calibrated")
+                    power[points] = power[points] * np.asarray(self.calibrationTable)[indL]
+                    self.tmpData.measuredPower[:] = power.tolist()
+
             # # Once the data map is ready we can replot the data 
             # # The new data structure has as many elements per row as measurements
-            self.structuredData = np.zeros((len(self.tmpData.measuredPower), self.tmpData.wavelengthCount,  self.tmpData.powerSettingCount))
-            self.reassignedData = np.zeros((len(self.tmpData.measuredPower), self.tmpData.wavelengthCount))
-                        
-            indL = 0
-            indP = 0
-            print('self.data.measuredPowerd inside triggerSignature... ',self.tmpData)
-            for point in range(len(self.data.measuredPower)):
-
-                if self.tmpData.measuredPower[point] > 0:
-                    # After thresholding the values outside peaks are zero
-                    if (point == 0 ) or (self.tmpData.measuredPower[point-1] == 0):
-
-                        peakInd = peakInd + 1
-
-                        if peakInd > 0:
-                            if self.order == 'PL':
-                                if indL < self.tmpData.wavelengthCount-1:
-                                    indL = indL+1
-                                else:
-                                    indL = 0
-                                    if indP < self.tmpData.powerSettingCount-1:
-                                        indP = indP+1
-                                    else:
-                                        indP = 0                                    
-
-                            elif self.order == 'LP':
-                                if indP < self.tmpData.powerSettingCount-1:
-                                    indP = indP+1
-                                else:
-                                    indP = 0
-                                    if indL<self.tmpData.wavelengthCount-1:
-                                        indL = indL+1
-                                    else:
-                                        indL = 0                                    
-                    
-                    print('pulse: ', peakInd, 'wavelength: ', self.wavelengths[indL], 'set power: ',self.setPowers[indP])                    
-                    
-                    if self.wavelengths == self.calibratedWavelengths:                        
-                        if(self.dynCorrection):
-                            print("Wavelengths are calibrated")
-                            self.tmpData.measuredPower[point] = self.tmpData.measuredPower[point] * self.calibrationTable[indL]
-                        
-                    self.structuredData[point,indL,indP] = self.tmpData.measuredPower[point]
-                    self.reassignedData[point,indL] = self.tmpData.measuredPower[point]
-                    self.pointers[point, :] = [indL,indP]
+            pointCount = len(power)
+            self.sortedData = SortedData(self.tmpData.wavelengthCount, self.tmpData.powerSettingCount, pointCount)
+            self.sortedData.assign(0, pointCount, points, indL, indP, power[points])
 
-                    self.tmpData.wavelengthArray[point]   = self.signature.wavelengths[indL]
-                    self.tmpData.powerSettingArray[point] = self.signature.setPowers[indP]
-                    self.data = self.tmpData
+            self.tmpData.wavelengthArray[points]   = np.asarray(self.signature.wavelengths)[indL]
+            self.tmpData.powerSettingArray[points] = np.asarray(self.signature.setPowers)[indP]
+            self.data = self.tmpData
                     
             self.displaySortedData()
             self.dataWasReassigned = True
             if(self.dynCorrection):
                 self.dataWasRecalibrated = True            
         else:
-            print("Please open file or start acquisition")
+            log.warning("Please open file or start acquisition")
 
     def saveSetupToFile(self, fileName):
         fullPath = os.path.join(self.settingsFilePath, fileName)
-        print("saving process in  "+fullPath)
-        print("Process:")
         if(os.path.isfile(fullPath)):
-            print("file already exists. Overwriting content...")
+            log.info("Overwriting the process file %s", fullPath)
         else:
-            print("Creating settings file...")
+            log.info("Creating the process file %s", fullPath)
         with open(fullPath, 'w') as newSettingsFile:
             newSettingsFile.write('Process:\n')
             for name in self.fieldNames:
@@ -994,18 +830,7 @@ class programGUI(QMainWindow):
                 newSettingsFile.write(name+'\t'+str(value)+'\n')
 
     def saveInfoFile(self, infoFilePath, baseFileName):
-        fileName = baseFileName + 'info.txt'
-        fullPath = os.path.join(infoFilePath, fileName)
-        print("saving acquisition information")
-        with open(fullPath, 'w') as infoFile:
-            for name in ["lightSourceModel", 
-                         "lightSourceIdentifier",
-                         "setPowers",
-                         "wavelengths", 
-                         "refWavelength",
-                         "calibrationFactors"]:
-                value = getattr(self, name)
-                infoFile.write(name+'\t'+str(value)+'\n')
+        LightSourceFiles.saveInfoFile(infoFilePath, baseFileName, self)
 
     def setupFromFile(self,processFileName):
         # First flush the containers
@@ -1022,7 +847,6 @@ class programGUI(QMainWindow):
         self.parameterValues = TSVAccess.fieldValuesFromTSV(self.fieldNames, fullPath)
 
         for name, value in zip(self.fieldNames, self.parameterValues):
-            print(name, value)
             setattr(self, name, value)
 
         self.orderSettingWidget.listDisplay.setCurrentIndex(self.orderSettingWidget.choices.index(self.order))
@@ -1033,13 +857,11 @@ class programGUI(QMainWindow):
 
         self.setMetadata(self.lightSourceModel,self.lightSourceIdentifier)
 
-        print('Adding wavelengths:')
         for wavelength in DataSignature.stringOrList2Array(self.wavelengths):
 
             self.wavelengthWidget.inputBox.setText(str(wavelength))
             self.wavelengthWidget.addElement()
 
-        print('Adding set powers:')
         # for setPower in self.setPowers:
         for setPower in DataSignature.stringOrList2Array(self.setPowers):
         
@@ -1060,23 +882,31 @@ class programGUI(QMainWindow):
     def setMetadata(self, lightSourceModel, lightSourceIdentifier):
         self.lightSourceModel = lightSourceModel        
         self.lightSourceIdentifier = lightSourceIdentifier
-        print(self.lightSourceModel, self.lightSourceIdentifier)
+        log.debug('light source: %s, %s', self.lightSourceModel, self.lightSourceIdentifier)
         self.metadataBox.setText(str(self.lightSourceModel)+', '+str(self.lightSourceIdentifier))
 
-    def returnValues(self,values):
-                
-        timePointStr = values[0][:]
-        self.realTimePowers = values[1][:] 
-        
-        self.selectDataStream(timePointStr)
+    def updateStream(self):
+        # On the GUI thread, once per frame: the samples appended by the 
+        # worker since the last frame are taken by index from the shared 
+        # buffer and the live plot is redrawn once. The worker itself only
+        # appends to the buffer
+        count = self.samples.count
+        if count == self.sampleCount:
+            return
+        for index in range(self.sampleCount, count):
+            self.selectDataStream(index)
+        if (self.dynReassignment):
+            self.displaySortedDataRealTime()
+        self.DataCanvas.refreshStream(force=True)
     
     def startStop(self):
         if self.acquiringNow:
+            # Does not block, acquireLPM resumes once the worker has stopped
             self.manager.finishThreads()
-            self.StartButton.setText("Aquire now")
+            self.StartButton.setText("stopping...")
+            self.StartButton.setEnabled(False)
             self.acquiringNow = False
         else:
-            self.DataCanvas.axes.clear() # Clear plots before starting
             self.data.flushFile() # we ensure there is no data from a file 
             self.StartButton.setText("stop")
             self.acquiringNow = True
@@ -1086,12 +916,26 @@ class programGUI(QMainWindow):
 
     def acquireLPM(self):
         
-        # For real-time reassignment
-        self.realTimeLInd = 0
-        self.realTimePind = 0
-        self.realTimePulse = -1
-        self.realTimePoint = 0
-        self.timePoints = []
+        # For real-time reassignment. The tracker follows all the acquired 
+        # points, so the threshold can change at any time
+        self.pulseTracker = PulseTracker(
+            self.signature.wavelengthCount, self.signature.powerSettingCount, 
+            self.order, self.data.threshold)
+        self.thresholdEstimator = ThresholdEstimator()
+        # Preallocated for the whole acquisition, the worker appends to it.
+        # Runs too long to be kept in memory use a mapped file
+        if self.samples is not None:
+            self.samples.release()
+        self.samples = SampleBuffer.forRun(self.duration / self.readoutInterval + 1, self.defaultDataPath)
+        self.sampleCount = 0
+        self.acquiredData = self.samples.view()
+        # Live plot with persistent lines, sized for the whole acquisition
+        self.DataCanvas.startStream(self.duration / self.readoutInterval + 1)
+        # The plot follows the buffer at the frame rate, from the GUI thread
+        self.streamTimer = QTimer(self)
+        self.streamTimer.setInterval(int(1000 * self.DataCanvas.frameInterval))
+        self.streamTimer.timeout.connect(self.updateStream)
+        self.streamTimer.start()
         
         self.acqEventLoop = QEventLoop()
         def acquisitionComplete():
@@ -1100,12 +944,13 @@ class programGUI(QMainWindow):
         basefilename =  datetime.now().strftime("%Y%m%d-%H%M_")        
         basefilename = os.path.join(self.defaultDataPath, basefilename)
 
-        self.manager = MeasurementManager(self.device.sensor, self.returnValues)
+        self.manager = MeasurementManager(self.device.sensor, None)
         # use the values from the GUI
         
         # Use the apropriate calibration reference wavelength:
         currSetWavelength = self.refWavelthInput.getCurrentSelection()
         currSetPower = self.powerSettingWidget.getCurrentSelection()
+        self.manager.samples = self.samples
         self.manager.finished.connect(acquisitionComplete)
 
         if self.testMode == True:
@@ -1113,38 +958,38 @@ class programGUI(QMainWindow):
         else:
             runningMode = 'system-standard'
 
-        self.dataFileName = basefilename+'-blindMode.txt'
+        if self.binaryData:
+            self.dataFileName = basefilename+'-blindMode'+BinaryDataFile.extension
+            self.manager.metadata = self.recipeMetadata()
+        else:
+            self.dataFileName = basefilename+'-blindMode.txt'
         self.avgTime_sec = self.readoutInterval
-        self.manager.add_measurement(currSetWavelength, currSetPower, self.dataFileName, self.duration, self.avgTime_sec, runningMode)
+        self.manager.add_measurement(currSetWavelength, currSetPower, self.dataFileName, self.duration, self.avgTime_sec, runningMode, self.averaging)
         self.manager.start_measurements()
         self.acqEventLoop.exec()
+        self.streamTimer.stop()
+        # The samples acquired since the last frame
+        self.updateStream()
+        self.DataCanvas.stopStream()
         
         # This saves the raw data into a buffer to allow offline reassignment
         self.data.measuredPower = self.acquiredData[1]
         self.acquiringNow = False
 
         self.StartButton.setText("Aquire now")
+        self.StartButton.setEnabled(True)
         return currSetWavelength
     
 
-    def convertToSeconds(self,timestampArray):       
-        secArray = []
-
-        for element in timestampArray:
-
-            formatStr = "%Y-%m-%d %H:%M:%S.%f"                
-            dt = datetime.strptime(element, formatStr)
-        
-            # Calculate total seconds since the start of the day
-            totalSeconds = (
-                dt.hour * 3600 +
-                dt.minute * 60 +
-                dt.second +
-                dt.microsecond / 1_000_000  # Convert microseconds to seconds
-            )
-            secArray.append(totalSeconds)
-
-        return secArray
+    def convertToSeconds(self,timestampArray):
+        # Timestamps as "%Y-%m-%d %H:%M:%S.%f", all parsed at once.
+        # Seconds since the start of the day of the first timestamp,
+        # later days continue counting instead of starting over
+        timestamps = np.array(timestampArray, dtype='datetime64[us]')
+        if timestamps.size == 0:
+            return timestamps.astype(float)
+        dayStart = timestamps[0].astype('datetime64[D]')
+        return (timestamps - dayStart) / np.timedelta64(1, 's')
 
     def saveDataFile(self, path):
         # Reserved for the re-assigned data. These files will be saved
@@ -1177,221 +1022,97 @@ class programGUI(QMainWindow):
         # Save the originalData
 
         outputPathRawData = os.path.join(savePath,filename1)
-        print(outputPathRawData)
+        log.info('Saving the raw data to %s', outputPathRawData)
 
         if self.dataWasReassigned:
-            finalSavePath = os.path.join(savePath, 'Light Sources')
-            os.makedirs(finalSavePath, exist_ok=True)
-            if self.lightSourceModel:
-                finalSavePath = os.path.join(finalSavePath, str(self.lightSourceModel))
-                os.makedirs(finalSavePath, exist_ok=True)
-                if self.lightSourceIdentifier:
-                    finalSavePath = os.path.join(finalSavePath, str(self.lightSourceIdentifier))
-                    os.makedirs(finalSavePath, exist_ok=True)
+            finalSavePath = LightSourceFiles.folder(
+                savePath, self.lightSourceModel, self.lightSourceIdentifier)
             # Info file
             self.saveInfoFile(finalSavePath, filename0)
             # All data files sorted by wavelength
-            for wavelengthInd in range(len(self.signature.wavelengths)):
-
-                filename2 = filename0 + str(self.signature.wavelengths[wavelengthInd]) + 'nm'
-
-                if self.splitByPower:
-                    if((self.order == 'PL' and self.duration >= 1800) |
-                        (self.order == 'LP' and self.duration / self.signature.powerSettingCount > 1800)
-                        ):
-                        # Wavelengths interleaved for more than 30 minutes or 
-                        # a series of more that 30 minuted per wavelength
-                        protocolStr = 'long'
-                    else:
-                        protocolStr = 'short'
-                    for powerInd in range(len(self.signature.setPowers)):
-                        filename3 = filename2 + '_' + protocolStr + '_' + str(self.setPowers[powerInd]) + '%.txt'                    
-                        outputPathsFilteredData[(wavelengthInd, powerInd)] = os.path.join(finalSavePath,filename3)
-                else:
-
-                    if(len(self.setPowers)>1):
-                        # More than one intensity -> linear
-                        protocolStr = 'linear'
-                    elif((self.order == 'PL' and self.duration >= 1800) |
-                        (self.order == 'LP' and self.duration / self.signature.powerSettingCount > 1800)
-                        ):
-                        # Wavelengths interleaved for more than 30 minutes or 
-                        # a series of more that 30 minuted per wavelength
-                        protocolStr = 'long'
-                    else:
-                        protocolStr = 'short'
-                    
-                    if protocolStr == 'linear':
-                        filename2 = filename2 + '_' + protocolStr + '.txt'
-                    elif (protocolStr == 'long' or protocolStr == 'short'):
-                        filename2 = filename2 + '_' + protocolStr + '_' + str(self.setPowers[0]) + '%.txt'
-                    
-                    outputPathsFilteredData[(wavelengthInd)]= os.path.join(finalSavePath,filename2)
-        
-        header_written = {key: False for key in outputPathsFilteredData}
-        with open(inputFullPath, 'r', newline='') as infile, open(outputPathRawData, 'w+', newline='') as outfileMain:
-            reader = csv.reader(infile, delimiter='\t')
-            writer1 = csv.writer(outfileMain, delimiter='\t')
-            
-            # Assuming the first row is the header
-            header = next(reader)
-            writer1.writerow(header)
-
-            # here a strategy to get rid of the transition points:
-            # Due to averaging some power values appear at the slopes 
-            # of the detected pulses. They are still above threshold 
-            # but far below real power values. The "transition" points 
-            # at both ends of each pulse will not be saved.
-
-            isTransitionPoint = False
-            prevWavelengthInd = -1
-            prevSetPowerInd   = -1
-
-            for row_index, row in enumerate(reader, start=1):
-
-                writer1.writerow(row)
-
-                # For the file split:
-                element = row_index - 1
-                wavelengthInd = self.pointers[element, 0]
-                powerInd      = self.pointers[element, 1]
-
-                # For excluding transitional points ...........................................
-                try:
-                    nextWavelengthInd = self.pointers[element+1, 0]
-                    nextPowerInd   = self.pointers[element+1, 1]
-                except:
-                    # At the end of the file there are no pints available
-                    nextWavelengthInd = wavelengthInd
-                    nextPowerInd   = powerInd
-
-                if not np.isnan(wavelengthInd) and not np.isnan(powerInd):
-                    wavelengthInd = int(wavelengthInd)
-                    powerInd = int(powerInd)
-                    
-                    if ((wavelengthInd != prevWavelengthInd) or (powerInd != prevSetPowerInd)):
-                        # beggining of the pulse
-                        isTransitionPoint = True
-                    elif ((wavelengthInd != nextWavelengthInd) or (powerInd != nextPowerInd)):
-                        # end of the pulse
-                        isTransitionPoint = True
-                    else:
-                        isTransitionPoint = False
-
-                    prevWavelengthInd = wavelengthInd
-                    prevSetPowerInd   = powerInd
-                    # ..........................................................................
-
-                    print(outputPathsFilteredData)
-
-                    if self.splitByPower:
-                        fileKey = (wavelengthInd, powerInd)
-                    else:
-                        fileKey = wavelengthInd
-
-                    file = outputPathsFilteredData.get(fileKey)
-
-                    with open(file, 'a+', newline='') as outfileFiltered:
-                        writer2 = csv.writer(outfileFiltered, delimiter='\t')
-                        if not header_written[fileKey]:
-                            # Write the header to this file only once
-                            writer2.writerow(header)
-                            header_written[fileKey] = True
-                        else:
-                            row[1] = str(self.signature.wavelengths[wavelengthInd])
-                            row[2] = str(self.signature.setPowers[powerInd])
-                            
-                            
-                            tempValue = float(row[3])
-                            if tempValue >= self.data.threshold:                                
-
-                                # Exclude raw data points below threshold
-                                print(row)
-                                if self.dataWasRecalibrated:
-                                    # Apply corrections before saving data
-                                    tempValue = self.calibrationTable[wavelengthInd] * tempValue
-                                
-                                if not isTransitionPoint:
-                                    # transition points will not be written
-
-                                    row[3] = tempValue
-                                    writer2.writerow(row)
+            outputPathsFilteredData = LightSourceFiles.filePaths(
+                finalSavePath, filename0, self.signature.wavelengths, self.setPowers, 
+                self.order, self.duration, self.splitByPower)
 
+        if self.dataWasRecalibrated:
+            calibrationTable = self.calibrationTable
+        else:
+            calibrationTable = None
+        LightSourceFiles.split(
+            inputFullPath, outputPathRawData, outputPathsFilteredData, 
+            self.sortedData.pointers if self.sortedData is not None else np.empty((0, 2)), self.splitByPower, self.data.threshold, 
+            self.signature.wavelengths, self.signature.setPowers, calibrationTable)
 
         return savePath
 
-    def selectDataStream(self, timeLabels):
-
-        currTimePoint = np.array(self.convertToSeconds(timeLabels))[-1]
-        
-        if self.timePoints == []:
-            self.timeZero = currTimePoint
-            self.timePoints.append(0)
-        else:
-            self.timePoints.append(currTimePoint - self.timeZero)
+    def selectDataStream(self, index):
+        # Called once per new sample, with its index in the sample buffer
+        self.sampleCount = index + 1
+        currTimePoint, power = self.samples.sample(index)
 
+        self.pulseTracker.append(power)
         if (self.dynReassignment and self.acquiringNow):
+            self.assignLivePoints(self.pulseTracker.count - 1)
 
-            nextElement, self.realTimePulse, self.realTimeLInd, self.realTimePind = \
-                self.assignCurrPoint(self.realTimePoint, self.realTimePulse, 
-                                     self.realTimeLInd, self.realTimePind, self.realTimePowers[-1])
-            if self.realTimePulse >= 0:
-                # Wavelength and power indices only make sense when pulses start (self.realTimePulse >=0)
-                self.structuredData[self.realTimePoint,self.realTimeLInd,self.realTimePind] = \
-                    self.realTimePowers[self.realTimePoint]
-                self.reassignedData[self.realTimePoint,self.realTimeLInd] = self.realTimePowers[self.realTimePoint]
-            self.realTimePoint = nextElement
-        else:
-            self.realTimePoint = self.realTimePoint + 1
+        # The histogram grows by one readout, the threshold follows it
+        self.thresholdEstimator.append(power)
+        if self.autoThreshold and self.acquiringNow:
+            self.applyAutoThreshold()
 
-        self.acquiredData = np.array([self.timePoints, self.realTimePowers])
+        # A view on the buffer, nothing is copied
+        self.acquiredData = self.samples.view()
 
         # Recalculate the limits for the threshold range
-        if self.realTimePowers:
-            self.dataLength = len(self.realTimePowers)
+        if self.sampleCount:
+            self.dataLength = self.sampleCount
             
-            self.minPowserMeasured = min(self.realTimePowers)
-            self.maxPowserMeasured = max(self.realTimePowers)                
+            # Running range, one comparison per sample
+            if self.dataLength == 1:
+                self.minPowserMeasured = power
+                self.maxPowserMeasured = power
+            else:
+                self.minPowserMeasured = min(self.minPowserMeasured, power)
+                self.maxPowserMeasured = max(self.maxPowserMeasured, power)
 
-            self.thresholdLine = np.ones(self.dataLength)*self.data.threshold
-            
             if self.maxPowserMeasured != self.minPowserMeasured:
-                
-                self.DataCanvas.axes.set_ylim(self.minPowserMeasured, self.maxPowserMeasured)
 
                 self.ThresholdSliderStep = (self.maxPowserMeasured - self.minPowserMeasured) / self.ThresholdSliderSteps            
                 self.ThresholdSlider.setMinimum(0)
                 self.ThresholdSlider.setMaximum(self.ThresholdSliderSteps)
                 self.ThresholdSlider.setSingleStep(self.ThresholdSliderSteps)
 
-                self.ThresholdSlider.setValue(100 * (self.data.threshold - self.minPowserMeasured)/ 
+                # Following the new range must not move the threshold itself
+                self.ThresholdSlider.blockSignals(True)
+                self.ThresholdSlider.setValue(int(100 * (self.data.threshold - self.minPowserMeasured)/ 
                     (self.maxPowserMeasured - self.minPowserMeasured)
-                    )
-
-        doNotClearBefore = False        
-        self.DataCanvas.redraw(self.acquiredData[0],[self.acquiredData[1],self.thresholdLine], doNotClearBefore)
+                    ))
+                self.ThresholdSlider.blockSignals(False)
 
-        if (self.dynReassignment):            
-            self.displaySortedDataRealTime()
+        self.DataCanvas.appendStream(currTimePoint, power)
+        self.DataCanvas.setStreamThreshold(self.data.threshold)
 
     def selectDataFile(self, dataFile):
         
-        print(dataFile)
+        log.info('Loading %s', dataFile)
         self.data.setFile(dataFile)
         self.data.loadDataByTag() # This already creates a data map based on the tags on the file
 
-        timePoints = np.array(self.convertToSeconds(self.data.timeStamp))
+        timePoints = self.convertToSeconds(self.data.timeStamp)
         timePoints = timePoints - timePoints[0]
         self.acquiredData = np.array([timePoints,self.data.measuredPower])
 
-        if self.data.measuredPower:
+        if len(self.data.measuredPower) > 0:
             self.dataLength = len(self.data.measuredPower)
-            self.minPowserMeasured = min(self.data.measuredPower)
-            self.maxPowserMeasured = max(self.data.measuredPower)
+            self.minPowserMeasured = np.min(self.data.measuredPower)
+            self.maxPowserMeasured = np.max(self.data.measuredPower)
             self.ThresholdSliderStep = (self.maxPowserMeasured - self.minPowserMeasured) / self.ThresholdSliderSteps
             self.ThresholdSlider.setMinimum(0)
             self.ThresholdSlider.setMaximum(self.ThresholdSliderSteps)
             self.ThresholdSlider.setSingleStep(self.ThresholdSliderSteps)   
+            if self.autoThreshold:
+                threshold = ThresholdEstimator.estimate(self.data.measuredPower)
+                if threshold is not None:
+                    self.data.setThreshold(threshold)
             self.displayMeasData(self.data.threshold) # Initially 0
 
     def updateDurationAndReplot(self):
@@ -1428,43 +1149,24 @@ class programGUI(QMainWindow):
         
     def updatePowersAndReplot(self):
         self.setPowers = self.powerSettingWidget.list
-        print(self.setPowers)
+        log.debug('set powers: %s', self.setPowers)
         self.updateSignature()
     
     def thresholdAdjustedByClick(self, newThreshold):
 
         self.data.setThreshold(newThreshold)
+        if self.acquiringNow and self.pulseTracker is not None:
+            # Only the pulses whose boundaries move are updated
+            firstChanged = self.pulseTracker.setThreshold(newThreshold)
+
         if self.dynReassignment and self.acquiringNow:
-            
-            self.structuredData = np.zeros((self.signature.readoutCount, self.signature.wavelengthCount, self.signature.powerSettingCount))
-            self.reassignedData = np.zeros((self.signature.readoutCount, self.signature.wavelengthCount))
-            self.pointers = np.full((self.signature.readoutCount, 2),np.nan)
-            
-            reasPulseInd = -1
-            reasWlthInd  = 0
-            reasPrwsInd  = 0
-
-            for element in range(len(self.realTimePowers)):
-                nextElement, reasPulseInd, reasWlthInd, reasPrwsInd = \
-                    self.assignCurrPoint(
-                        element, reasPulseInd, reasWlthInd, reasPrwsInd, 
-                        self.realTimePowers[element])
-                if reasPulseInd >= 0:
-                    # Wavelength and power set indices only make sense from the first pulse (reasPuldeInd >=0)
-                    self.structuredData[element,reasWlthInd,reasPrwsInd] = \
-                        self.realTimePowers[element]
-                    self.reassignedData[element,reasWlthInd] = self.realTimePowers[element]
-                element = nextElement
-
-            self.realTimePoint = element
-            self.realTimePulse = reasPulseInd
-            self.realTimeLInd  = reasWlthInd 
-            self.realTimePind  = reasPrwsInd                                
-
-            self.DataCanvas.axes.clear()
+            self.assignLivePoints(firstChanged)
+
+            self.DataCanvas.setStreamThreshold(self.data.threshold)
             self.displaySortedDataRealTime()
+            self.DataCanvas.refreshStream()
 
-        elif len(self.data.measuredPower) != 0 or len(self.realTimePowers) != 0:
+        elif len(self.data.measuredPower) != 0 or self.sampleCount != 0:
             self.displayMeasData(self.data.threshold)
         
     @Slot()
@@ -1488,8 +1190,13 @@ class programGUI(QMainWindow):
     def displayMeasData(self,newThreshold):        
         self.data.setThreshold(newThreshold)
 
+        if self.DataCanvas.streaming:
+            # Live plot, only the threshold line moves
+            self.DataCanvas.setStreamThreshold(self.data.threshold)
+            self.DataCanvas.refreshStream()
+            return
+
         clearBefore = True
-        print('displayMeasData -> displayMeasData(self,value), with value:',self.data.threshold)
         self.thresholdLine = np.ones(self.dataLength)*self.data.threshold
         self.DataCanvas.redraw(
             self.acquiredData[0],
@@ -1504,16 +1211,16 @@ class programGUI(QMainWindow):
         RGB[:,2] = self.signature.Blue
 
         self.thresholdLine = np.ones(self.dataLength)*self.data.threshold
-        print('displaySortedData -> displayMeasData(self), with self.setOffset:',self.data.threshold)
         self.DataCanvas.axes.clear()
         self.DataCanvas.axes.plot(self.acquiredData[0],self.thresholdLine, color = 'gray', linestyle='dashed')
         self.DataCanvas.draw()
         for wavelength in range(self.data.wavelengthCount):
             plotColor = (RGB[wavelength,0]/255,RGB[wavelength,1]/255,RGB[wavelength,2]/255)  
             connectedLines = True
+            points, power = self.sortedData.series(wavelength)
             self.DataCanvas.drawOnTop(
-                self.acquiredData[0],
-                [self.reassignedData[:,wavelength]], 
+                self.acquiredData[0][points],
+                [power], 
                 plotColor, connectedLines
             )
         if not self.acquiringNow:
@@ -1527,14 +1234,17 @@ class programGUI(QMainWindow):
         RGB[:,1] = self.signature.Green
         RGB[:,2] = self.signature.Blue
 
+        # The persistent lines of the live plot are updated in place
+        pointCount = self.DataCanvas.streamCount
         for wavelength in range(self.signature.wavelengthCount):
             for powerSetting in range(self.signature.powerSettingCount):
                 plotColor = (RGB[wavelength,0]/255,RGB[wavelength,1]/255,RGB[wavelength,2]/255)  
-                connectedLines = True
-                self.DataCanvas.drawOnTop(
-                    self.timePoints,
-                    [self.structuredData[0:len(self.timePoints),wavelength,powerSetting]],
-                    plotColor, connectedLines
+                points, power = self.sortedData.series(wavelength, powerSetting)
+                visible = points < pointCount
+                self.DataCanvas.setSortedStream(
+                    (wavelength, powerSetting),
+                    points[visible], power[visible],
+                    plotColor
                 )
 
     def updateSignature(self):
@@ -1558,33 +1268,40 @@ class programGUI(QMainWindow):
             not self.order == "":
             
             self.signature.calculateSignature()
-            self.sigProfile = self.signature.signature
             
             wavelengthCount = len(self.wavelengths)
             
-            if wavelengthCount > 0:
+            if self.SignatureCanvas is None:
+                # The plots are not created yet, createPlots draws it
+                pass
+            elif wavelengthCount > 0:
                 RGB = np.zeros((wavelengthCount,3))
                 RGB[:,0] = self.signature.Red
                 RGB[:,1] = self.signature.Green
                 RGB[:,2] = self.signature.Blue
-                self.SignatureCanvas.axes.clear()
-                for wavelength in range(len(self.wavelengths)):
-                    plotColor = (RGB[wavelength,0]/255,RGB[wavelength,1]/255,RGB[wavelength,2]/255)
-                    self.SignatureCanvas.axes.plot(self.sigProfile[wavelength], color=plotColor)
-                self.SignatureCanvas.draw()
+                plotColors = [(RGB[wavelength,0]/255,RGB[wavelength,1]/255,RGB[wavelength,2]/255)
+                              for wavelength in range(len(self.wavelengths))]
+                self.SignatureCanvas.showSignature(self.signature, plotColors)
             else:
-                print("Nothing to update")
+                log.debug("Nothing to update")
 
             # Memory allocation for the data according to instructions
-            self.structuredData = np.zeros((self.signature.readoutCount, self.signature.wavelengthCount,  self.signature.powerSettingCount))
-            self.reassignedData = np.zeros((self.signature.readoutCount, self.signature.wavelengthCount))
-            self.pointers = np.full((self.signature.readoutCount, 2),np.nan)
+            self.sortedData = SortedData(
+                self.signature.wavelengthCount, self.signature.powerSettingCount, self.signature.readoutCount)
 
-def main(mode):
+def main(mode, timing=False):
+    # Warnings on the console, the session in the rotating log file
+    setupLogging(logFile=defaultLogFile())
     app = QApplication([])
+    startupTimer.mark('QApplication')
+    if timing:
+        # Reports the startup phases and quits once the plots are ready
+        startupTimer.onFinished = lambda: (print(startupTimer.report()), app.quit())
     testMode = (mode == 'test')
     appWindow = programGUI(testMode)
+    startupTimer.mark('main window')
     appWindow.show()
+    startupTimer.mark('show')
     sys.exit(app.exec())
     # Under Windows 11 the desktop themes override components
     # leading to display issues (unreadable text, etc.). Using
@@ -1593,7 +1310,9 @@ def main(mode):
     Aesthetics.Functions.apply_system_palette(app)
 
 if __name__ == "__main__":
+    # SmartLPM.py [test|system] [--timing]
+    arguments = [arg for arg in sys.argv[1:] if arg != '--timing']
     mode = 'system'
-    if len(sys.argv) > 1:
-        mode = sys.argv[1]
-    main(mode)
+    if len(arguments) > 0:
+        mode = arguments[0]
+    main(mode, '--timing' in sys.argv)
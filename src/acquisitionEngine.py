@@ -0,0 +1,535 @@
+"""
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from datetime import datetime, timedelta
+import logging, os, tempfile, time
+import threading
+import numpy as np
+
+from fileInterface import openDataWriter
+
+log = logging.getLogger(__name__)
+
+def sleepUntil(deadline, cancelEvent=None):
+    # Sleeps until the perf_counter_ns() deadline. The OS sleep is only
+    # used while far from it, the last millisecond is yielded in short 
+    # steps to wake up on time without spinning for the whole window.
+    # Returns True straight away if the cancelEvent is set meanwhile.
+    while True:
+        if cancelEvent is not None and cancelEvent.is_set():
+            return True
+        remaining = deadline - time.perf_counter_ns()
+        if remaining <= 0:
+            return False
+        if remaining > 2_000_000:
+            if cancelEvent is None:
+                time.sleep((remaining - 1_000_000) / 1e9)
+            else:
+                cancelEvent.wait((remaining - 1_000_000) / 1e9)
+        else:
+            time.sleep(0)
+
+class SamplingClock():
+    # Readout windows on an absolute grid: window k starts at 
+    # start + k * interval on the time.perf_counter_ns() clock, so the time
+    # spent writing files, in callbacks or in the driver does not accumulate 
+    # as drift. Timestamps are derived from the same grid and are therefore
+    # exactly one interval apart. Windows that could not start on time 
+    # because the previous one overran are skipped and counted.
+    # Clocks started with the same origin, a (datetime, perf_counter_ns) 
+    # pair as given by SharedTimeBase, share the grid. Setting the
+    # cancelEvent wakes up the clock and finishes it.
+
+    def __init__(self, interval, duration, origin=None, cancelEvent=None):
+        self.interval = int(round(float(interval) * 1e9))
+        self.duration = int(round(float(duration) * 1e9))
+        self.cancelEvent = cancelEvent
+        self.start(origin)
+
+    def start(self, origin=None):
+        if origin is None:
+            self.startTime = datetime.now()
+            self.startCounter = time.perf_counter_ns()
+        else:
+            self.startTime, self.startCounter = origin
+        self.window = 0
+        self.missedWindows = 0
+        # Jitter statistics: lateness of each window start [ns]
+        self.jitterCount = 0
+        self.jitterSum = 0
+        self.jitterSquares = 0
+        self.jitterMax = 0
+
+    def finished(self):
+        # Same number of windows as the original duration loop, the 
+        # last one starts at most 'duration' after the first one
+        if self.cancelEvent is not None and self.cancelEvent.is_set():
+            return True
+        return self.window * self.interval > self.duration
+
+    def windowStart(self):
+        return self.startCounter + self.window * self.interval
+
+    def windowEnd(self):
+        return self.windowStart() + self.interval
+
+    def windowTime(self):
+        # Wall clock time of the current window
+        return self.startTime + timedelta(microseconds=self.window * self.interval / 1000)
+
+    def elapsed(self):
+        # Seconds since the first window, on the grid
+        return self.window * self.interval / 1e9
+
+    def progress(self):
+        # Fraction of the duration covered so far
+        if self.duration <= 0:
+            return 1.0
+        return min(self.window * self.interval / self.duration, 1.0)
+
+    def next(self):
+        # Moves to the next window and waits until it starts
+        self.window += 1
+        now = time.perf_counter_ns()
+        if now > self.windowEnd():
+            skipped = (now - self.windowStart()) // self.interval
+            self.window += skipped
+            self.missedWindows += skipped
+        if sleepUntil(self.windowStart(), self.cancelEvent):
+            return
+
+        lateness = time.perf_counter_ns() - self.windowStart()
+        self.jitterCount += 1
+        self.jitterSum += lateness
+        self.jitterSquares += lateness * lateness
+        self.jitterMax = max(self.jitterMax, lateness)
+
+    def statistics(self):
+        # Window start lateness in ms
+        if self.jitterCount == 0:
+            return {'windows': 0, 'mean': 0, 'std': 0, 'max': 0, 'missed': self.missedWindows}
+        mean = self.jitterSum / self.jitterCount
+        variance = max(self.jitterSquares / self.jitterCount - mean * mean, 0)
+        return {
+            'windows': self.jitterCount,
+            'mean': mean / 1e6,
+            'std': np.sqrt(variance) / 1e6,
+            'max': self.jitterMax / 1e6,
+            'missed': self.missedWindows
+            }
+
+    def report(self):
+        stats = self.statistics()
+        return (f"{stats['windows']} windows, start jitter {stats['mean']:.3f} "
+                f"+/- {stats['std']:.3f} ms (max {stats['max']:.3f} ms), "
+                f"{stats['missed']} windows missed")
+
+class WindowAverager():
+    # Reads the power meter during one averaging window and returns the
+    # mean power [W], the mean temperature and the number of samples used.
+    # The windows end at perf_counter_ns() deadlines given by SamplingClock.
+    # This module does not depend on Qt, the threads in automationThreads
+    # only decide when the windows start and what to do with the results.
+    #
+    # Averaging strategies:
+    #   'software' one measPower call per sample, averaged in Python
+    #   'burst'    whole bursts of samples per driver call, averaged in NumPy
+    #   'hardware' the meter averages internally, one readout per window and
+    #              the thread sleeps for the rest of it
+
+    strategies = ['software', 'burst', 'hardware']
+
+    def __init__(self, sensor, strategy='software', burstInterval=100):
+        if strategy not in self.strategies:
+            raise ValueError(f"Unknown averaging strategy '{strategy}'")
+        self.sensor = sensor
+        self.strategy = strategy
+        # Time between two samples of a burst in microseconds. 100 us is the
+        # highest resolution of the PM devices without internal averaging
+        self.burstInterval = burstInterval
+        # Fraction of the window the meter averages over in 'hardware' mode,
+        # leaving time for the readout itself before the next window starts
+        self.hardwareDuty = 0.9
+        # (averaging time, timeout) of the meter before configure
+        self.previousAveragingTime = None
+        # Set to end the current window early. Bursts are kept short
+        # enough for the cancellation to be seen within maxBurstSpan [s]
+        self.cancelEvent = None
+        self.maxBurstSpan = 0.2
+
+    def configure(self, avgTime):
+        # To be called once the sensor is connected, before the first window
+        if self.strategy == 'hardware':
+            self.previousAveragingTime = self.sensor.setAveragingTime(avgTime * self.hardwareDuty)
+
+    def finish(self):
+        # Restores the meter averaging and timeout so other modes are not
+        # slowed down, and turns the array measurement of the bursts off.
+        # Called on the way out of errors as well, a failure here is only
+        # logged so it does not hide the original one
+        if self.strategy == 'burst':
+            try:
+                self.sensor.disableArrayMode()
+            except Exception:
+                log.warning("Array measurement could not be turned off", exc_info=True)
+        if self.previousAveragingTime is not None:
+            previous, self.previousAveragingTime = self.previousAveragingTime, None
+            try:
+                self.sensor.setAveragingTime(*previous)
+            except Exception:
+                log.warning("Meter averaging could not be restored", exc_info=True)
+
+    def cancelled(self):
+        return self.cancelEvent is not None and self.cancelEvent.is_set()
+
+    def average(self, deadline, thermometer=False):
+        if self.strategy == 'burst':
+            return self.averageBursts(deadline, thermometer)
+        if self.strategy == 'hardware':
+            return self.averageOnDevice(thermometer)
+        return self.averageSamples(deadline, thermometer)
+
+    def averageSamples(self, deadline, thermometer):
+        average_count = 0
+        total_power = 0
+        total_temperature = 0
+
+        # At least one sample is taken, even if the window is already over
+        while True:
+            total_power += self.sensor.readPower()
+            if thermometer:
+                total_temperature += self.sensor.readTemperature()
+            average_count += 1
+            if time.perf_counter_ns() >= deadline or self.cancelled():
+                break
+
+        return total_power / average_count, total_temperature / average_count, average_count
+
+    def averageBursts(self, deadline, thermometer):
+        bursts = []
+        while True:
+            remaining = (deadline - time.perf_counter_ns()) / 1e9
+            # The meter captures at most 1 s per sequence call
+            span = min(max(remaining, 0), 1.0, self.maxBurstSpan)
+            count = max(int(span * 1e6 / self.burstInterval), 1)
+            bursts.append(self.sensor.readPowerBurst(count, self.burstInterval))
+            if time.perf_counter_ns() >= deadline or self.cancelled():
+                break
+
+        samples = np.concatenate(bursts)
+        temperature = self.sensor.readTemperature() if thermometer else 0
+        return float(samples.mean()), temperature, samples.size
+
+    def averageOnDevice(self, thermometer):
+        # The readout returns once the meter has averaged, the clock
+        # sleeps for the rest of the window. The driver call itself 
+        # cannot be interrupted, a cancellation is seen after it.
+        power = self.sensor.readPower()
+        temperature = self.sensor.readTemperature() if thermometer else 0
+        return power, temperature, 1
+
+class SampleBuffer():
+    # Preallocated storage for the live samples, shared by the acquisition
+    # thread that appends and the GUI that reads. Row k holds the time [s] 
+    # and power [mW] of sample k, so reading costs the same whatever the
+    # length of the run. count only grows after the row is written: readers
+    # use the rows below count. The capacity doubles when full, views taken
+    # before keep the values they had.
+    #
+    # With a fileName the rows live in a memory mapped file instead of in 
+    # memory, for runs too long to be kept in memory (see forRun). A mapped
+    # file cannot be resized while mapped (Windows) and the readers may 
+    # still hold views on it, so growing maps a new file and copies the 
+    # rows; the file is sized for the whole run so this stays exceptional.
+
+    columns = ['time', 'power']
+    rowBytes = 8 * len(columns)
+    # Runs whose samples would take more memory [bytes] go to a file
+    memoryLimit = 256 << 20
+
+    def __init__(self, capacity=1024, fileName=None):
+        self.capacity = max(int(capacity), 1)
+        self.fileName = fileName
+        # Files mapped so far, removed by release()
+        self.files = []
+        self.count = 0
+        self.data = self.allocate(self.capacity)
+
+    @classmethod
+    def forRun(cls, capacity, folder=None):
+        # Buffer for a run of 'capacity' samples, in memory or, if larger
+        # than memoryLimit, in a temporary file in folder (the system one
+        # if it does not exist)
+        capacity = max(int(capacity), 1)
+        if capacity * cls.rowBytes <= cls.memoryLimit:
+            return cls(capacity)
+        if folder is not None and not os.path.isdir(folder):
+            folder = None
+        descriptor, fileName = tempfile.mkstemp(suffix='.samples', prefix='SmartLPM-', dir=folder)
+        os.close(descriptor)
+        log.info("Samples of the run kept in %s", fileName)
+        return cls(capacity, fileName)
+
+    def allocate(self, capacity):
+        if self.fileName is None:
+            return np.zeros((capacity, len(self.columns)))
+        fileName = self.fileName if not self.files else f"{self.fileName}.{len(self.files)}"
+        self.files.append(fileName)
+        return np.memmap(fileName, dtype=float, mode='w+', shape=(capacity, len(self.columns)))
+
+    def grow(self):
+        capacity = 2 * self.capacity
+        data = self.allocate(capacity)
+        data[:self.count] = self.data[:self.count]
+        if self.fileName is not None:
+            self.data.flush()
+        self.data = data
+        self.capacity = capacity
+
+    def append(self, time, power):
+        # Returns the index of the new sample
+        index = self.count
+        if index == self.capacity:
+            self.grow()
+        self.data[index] = (time, power)
+        self.count = index + 1
+        return index
+
+    def sample(self, index):
+        return self.data[index]
+
+    def view(self):
+        # [times, powers] of all the samples as a (2, count) view, no copy
+        return self.data[:self.count].T
+
+    def release(self):
+        # Removes the files once the samples are no longer needed. Under
+        # Windows a file stays while views on it exist, it is left behind
+        for fileName in self.files:
+            try:
+                os.remove(fileName)
+            except OSError as e:
+                log.debug("Sample file %s not removed: %s", fileName, e)
+        self.files = []
+
+    @classmethod
+    def fromArrays(cls, times, powers):
+        # Buffer holding samples acquired before, e.g. read from a file
+        samples = cls(len(powers))
+        samples.data[:len(powers), 0] = times
+        samples.data[:len(powers), 1] = powers
+        samples.count = len(powers)
+        return samples
+
+    def times(self):
+        return self.view()[0]
+
+    def powers(self):
+        return self.view()[1]
+
+    def __len__(self):
+        return self.count
+
+class SharedTimeBase():
+    # Common start for acquisitions running on several threads. Every 
+    # thread calls wait() once ready, the last one to arrive sets the 
+    # origin 'delay' seconds ahead, so all the clocks start on the same 
+    # grid. If one thread fails, abort() releases the others with an error.
+
+    def __init__(self, parties, delay=0.5, timeout=60):
+        self.delay = delay
+        self.timeout = timeout
+        self.origin = None
+        self.barrier = threading.Barrier(parties, action=self.setOrigin)
+
+    def setOrigin(self):
+        offset = int(self.delay * 1e9)
+        self.origin = (datetime.now() + timedelta(microseconds=offset / 1000), 
+                       time.perf_counter_ns() + offset)
+
+    def wait(self):
+        self.barrier.wait(self.timeout)
+        return self.origin
+
+    def abort(self):
+        self.barrier.abort()
+
+class StandardAcquisition():
+    # A readout series at a set wavelength and power setting: every window
+    # of the SamplingClock grid is averaged by the WindowAverager and the
+    # row written to fileName, as text or as BinaryDataFile records with 
+    # metadata for *.lpmb files. The samples (seconds since the first 
+    # readout, power [mW]) are appended to a SampleBuffer, given or created.
+    # Used by the Qt worker threads and by the headless runner.
+
+    def __init__(self, sensor, averager, wavelength, power, fileName, duration, avgTime, 
+                 flushRows=100, flushInterval=1.0):
+        self.sensor = sensor
+        self.averager = averager
+        self.wavelength = wavelength
+        self.power = power
+        self.fileName = fileName
+        self.duration = duration
+        self.avgTime = avgTime
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+        # Set by stop(), or shared with a job so it can be cancelled directly
+        self.cancelEvent = threading.Event()
+        # The buffer can be shared with a reader, for the live plots
+        self.samples = None
+        # Recipe and calibration, kept in the header of binary files
+        self.metadata = None
+        # Start shared with other acquisitions, see SharedTimeBase
+        self.timeBase = None
+        # reportProgress(fraction) is called after every window
+        self.reportProgress = None
+
+    @property
+    def stopRequested(self):
+        return self.cancelEvent.is_set()
+
+    def stop(self):
+        # Returns at once, the acquisition ends within one readout
+        self.cancelEvent.set()
+
+    def startClock(self):
+        # Without this delay, the first number is consistently higher than the rest
+        if self.timeBase is None:
+            self.cancelEvent.wait(0.5)
+            return SamplingClock(self.avgTime, self.duration, cancelEvent=self.cancelEvent)
+        clock = SamplingClock(self.avgTime, self.duration, self.timeBase.wait(), self.cancelEvent)
+        sleepUntil(clock.windowStart(), self.cancelEvent)
+        return clock
+
+    def run(self, effect=None):
+        # effect(samples) is called after every new readout
+        if self.samples is None:
+            self.samples = SampleBuffer.forRun(self.duration / self.avgTime + 1, 
+                                               os.path.dirname(os.path.abspath(self.fileName)))
+        timeZero = None
+
+        try:
+            self.sensor.connect()
+            self.sensor.setWavelength(self.wavelength)
+            self.averager.configure(float(self.avgTime))
+            self.averager.cancelEvent = self.cancelEvent
+            thermometer = self.sensor.hasThermometer()
+        except:
+            self.averager.finish()
+            # The other acquisitions would wait for this one
+            if self.timeBase is not None:
+                self.timeBase.abort()
+            raise
+
+        if thermometer:
+            header = ["timestamp", "wavelength", "setting", "power", "temperature"]
+        else:
+            header = ["timestamp", "wavelength", "setting", "power"]
+        writer = openDataWriter(self.fileName, header, self.flushRows, self.flushInterval, self.metadata)
+        writer.start()
+
+        try:
+            # Readout windows on a fixed grid, free of drift
+            clock = self.startClock()
+
+            ind = 0 # To discard the first point
+            while not clock.finished():
+                start_average = clock.windowTime()
+
+                total_power, total_temperature, average_count = \
+                    self.averager.average(clock.windowEnd(), thermometer)
+                total_power *= 1000 # W -> mW
+
+                if self.stopRequested:
+                    break
+
+                if thermometer:
+                    fields = [start_average, self.wavelength, self.power, total_power, total_temperature]
+                else:
+                    fields = [start_average, self.wavelength, self.power, total_power]
+
+                # With the TLPM sensor the first readont is always slightly off
+                if ind > 0:
+                    writer.write(fields)
+                    if log.isEnabledFor(logging.DEBUG):
+                        timeString = start_average.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+                        log.debug('\t'.join([timeString] + [str(field) for field in fields[1:]]))
+                
+                    if timeZero is None:
+                        timeZero = clock.elapsed()
+                    self.samples.append(clock.elapsed() - timeZero, total_power)
+                    if effect is not None:
+                        effect(self.samples)
+
+                ind = ind+1
+                clock.next()
+                if self.reportProgress is not None:
+                    self.reportProgress(clock.progress())
+            log.info("Readout timing: %s", clock.report())
+        finally:
+            try:
+                # All the rows are on disk once this returns
+                writer.stop()
+            finally:
+                # The session stays open for the next measurement, also after
+                # an error or a cancellation
+                self.averager.finish()
+        return self.samples
+
+class SynchronizedAcquisition():
+    # Runs StandardAcquisitions on several meters at the same time, one 
+    # thread per meter. The readout windows of all of them are on the grid 
+    # of a SharedTimeBase, so sample k of every meter covers the same time. 
+    # Each acquisition writes its own file and fills its own SampleBuffer.
+
+    def __init__(self, acquisitions):
+        self.acquisitions = acquisitions
+        self.errors = [None] * len(acquisitions)
+
+    def stop(self):
+        for acquisition in self.acquisitions:
+            acquisition.stop()
+
+    def run(self, effect=None):
+        # effect(index, samples) is called from the thread of 
+        # acquisition 'index' after each of its readouts
+        timeBase = SharedTimeBase(len(self.acquisitions))
+
+        def acquire(index, acquisition):
+            update = None
+            if effect is not None:
+                update = lambda samples: effect(index, samples)
+            try:
+                acquisition.run(update)
+            except Exception as e:
+                log.exception("Error in acquisition %d", index)
+                self.errors[index] = e
+                timeBase.abort()
+
+        threads = []
+        for index, acquisition in enumerate(self.acquisitions):
+            acquisition.timeBase = timeBase
+            thread = threading.Thread(target=acquire, args=(index, acquisition), daemon=True)
+            threads.append(thread)
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # The failure that stopped the others is reported first
+        errors = [error for error in self.errors if error is not None]
+        errors.sort(key=lambda error: isinstance(error, threading.BrokenBarrierError))
+        if errors:
+            raise errors[0]
+        return [acquisition.samples for acquisition in self.acquisitions]
@@ -0,0 +1,50 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import sys
+import numpy as np
+
+from lpmParser import DataSignature, SignatureAlignment
+
+# Regression check of SignatureAlignment on a long trace, run by hand
+# after changing the alignment: python alignmentCheck.py
+# The exit status is the number of cases with mislabelled points.
+
+def main():
+    # The default recipe (4 wavelengths x 8 power settings, LP) read every
+    # 0.1 s for about 10^6 readouts. The signature repeats itself every pulse,
+    # the acquisition starting late must not shift the labels by whole periods
+    signature = DataSignature()
+    signature.setParameters([405, 488, 561, 640], [1, 2, 4, 8, 16, 32, 64, 100], 224, 0.1, 100000, 2, 'LP')
+    signature.calculateSignature()
+    count = signature.readoutCount
+    expected = np.full((count, 2), np.nan)
+    for pulse in signature.pulses:
+        expected[pulse['start']:pulse['start'] + pulse['length']] = (pulse['wavelength'], pulse['powerSetting'])
+    power = np.where(np.isnan(expected[:, 0]), 0.0, 1.0 + np.random.default_rng(0).random(count))
+
+    failures = 0
+    for delay in [0, 10, 50, 137, 300, 700, 2000, 5000]:
+        trace = np.concatenate((np.zeros(delay), power))[:count]
+        shifted = np.concatenate((np.full((delay, 2), np.nan), expected))[:count]
+        alignment = SignatureAlignment(signature)
+        pointers = alignment.pointers(trace, 0.5)
+        wrong = int(np.sum((np.nan_to_num(pointers, nan=-1) != np.nan_to_num(shifted, nan=-1)).any(axis=1)))
+        print(f"start delay {delay}: lag {alignment.lag:.1f}, scale {alignment.scale:.6f}, {wrong} points mislabelled")
+        failures += wrong > 0
+    return failures
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,24 +13,24 @@ This program is free software: you can redistribute it and/or modify
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-from PySide6.QtCore import QThread, QObject, Signal, Slot, QEventLoop
-from ctypes import c_long, c_ulong, c_uint32, byref, create_string_buffer, c_bool, c_char_p, c_int, c_int16, \
-    c_double, sizeof, c_voidp
+from PySide6.QtCore import QObject, Signal, Slot, QThreadPool, QRunnable
 import time
-import sys
-from datetime import datetime, timedelta
-import os, csv
+import heapq, itertools, logging, threading
 import numpy as np
 from queue import Queue
 
+from acquisitionEngine import WindowAverager, SamplingClock, StandardAcquisition, SampleBuffer
+from fileInterface import openDataWriter
+
+log = logging.getLogger(__name__)
+
 class Worker(QObject):
     finished = Signal()    
     resultReady = Signal(object)
 
-    def __init__(self, sensor, wavelength, power, fileName, duration, avgTime, runningMode, effect):
+    def __init__(self, sensor, wavelength, power, fileName, duration, avgTime, runningMode, effect, averaging='software'):
         super().__init__()
         self.sensor = sensor
-        self.bridge = sensor.bridge
         self.wavelength = wavelength
         self.power = power
         self.fileName = fileName
@@ -38,53 +38,83 @@ class Worker(QObject):
         self.avgTime = avgTime
         self.runningMode = runningMode
         self.calledFunction = effect
-        self.stopRequested = False
+        # Set by stop() or by the job that runs this worker. The clocks 
+        # wake up on it and the averaging loops check it every sample.
+        self.cancelEvent = threading.Event()
+        # How the meter is read within each averaging window (system modes)
+        self.averager = WindowAverager(sensor, averaging)
+        # Rows are written to disk in batches by a separate thread
+        self.flushRows = 100
+        self.flushInterval = 1.0
+        self.writer = None
+        self.acquisition = None
+        # Recipe and calibration for the header of binary data files
+        self.metadata = None
+        # Live samples of the standard modes, shared with the GUI
+        self.samples = None
+        # reportProgress(fraction) is called after every window, 
+        # set by the scheduler
+        self.reportProgress = None
 
         self.results = []
 
     def returnFileName(self):
         return self.fileName
 
+    @property
+    def stopRequested(self):
+        return self.cancelEvent.is_set()
+
     def stop(self):
-        print(f"Stop requested for wavelength {self.wavelength}.")
-        self.stopRequested = True
+        # Returns at once, the worker finishes within one sample
+        log.info("Stop requested for wavelength %s", self.wavelength)
+        self.cancelEvent.set()
 
     def getResults(self):
         return self.results
 
+    def updateProgress(self, clock):
+        if self.reportProgress is not None:
+            self.reportProgress(clock.progress())
+
+    def closeWriter(self):
+        # All the rows are on disk once this returns
+        if self.writer is not None:
+            self.writer.stop()
+            self.writer = None
+
     @Slot()
     def run(self):
-        print(f"Worker started for wavelength {self.wavelength}, power {self.power}")
+        log.info("Worker started for wavelength %s, power %s", self.wavelength, self.power)
         try:
             iterations = []
-            timePoints = []
             powers = []
         
             # Simulating task execution
-            print(f"Running {self.runningMode}")
+            log.info("Running %s", self.runningMode)
 
             if self.runningMode == 'test-standard':
             
                 self.avgSimulation = 3.5
                 self.SimSpan = 10
-                origStdOut = sys.stdout
 
-                with open(self.fileName, "a") as fout:
-                    if fout and os.stat(self.fileName).st_size == 0:
-                        sys.stdout = fout
-                        print("timestamp\twavelength\tsetting\tpower\ttemperature")
-                        sys.stdout = origStdOut
+                self.writer = openDataWriter(self.fileName, 
+                    ["timestamp", "wavelength", "setting", "power", "temperature"], 
+                    self.flushRows, self.flushInterval, self.metadata)
+                self.writer.start()
 
-                start = datetime.now()
-                measure_until = start + timedelta(seconds=float(self.duration))
+                # Readout windows on a fixed grid, free of drift
+                clock = SamplingClock(self.avgTime, self.duration, cancelEvent=self.cancelEvent)
+                if self.samples is None:
+                    self.samples = SampleBuffer.forRun(self.duration / self.avgTime + 1)
 
-                while datetime.now() <= measure_until:
+                while not clock.finished():
                     average_count = 0
                     total_power = 0
-                    start_average = datetime.now()
-                    average_until = start_average + timedelta(seconds=float(self.avgTime))
+                    start_average = clock.windowTime()
+                    average_until = clock.windowEnd()
 
-                    while datetime.now() < average_until:
+                    while time.perf_counter_ns() < average_until and not self.stopRequested:
                         power = np.random.normal(self.avgSimulation, self.SimSpan, size=1)
                         total_power += power[-1]
                         average_count += 1
@@ -92,113 +122,45 @@ class Worker(QObject):
                         break
 
                     total_power /= average_count
-                    origStdOut = sys.stdout
 
-                    with open(self.fileName, "a") as fout:
+                    self.writer.write([start_average, self.wavelength, self.power, total_power])
+                    if log.isEnabledFor(logging.DEBUG):
                         timeString = start_average.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                        outString = f"{timeString}\t{self.wavelength}\t{self.power}\t{total_power}"
-                        sys.stdout = fout
-                        print(outString)
-                        sys.stdout = origStdOut
-                        print(outString)
+                        log.debug("%s\t%s\t%s\t%s", timeString, self.wavelength, self.power, total_power)
 
-                        timePoints.append(timeString)
-                        powers.append(total_power)
-
-                        self.results = [timePoints, powers]
-                        
-                        # This function (to update plots) is expected to run every
-                        # time a new value is acquired
-
-                        self.calledFunction(self.results)
+                    self.samples.append(clock.elapsed(), total_power)
+                    self.results = self.samples
+                    
+                    # Called on this thread after every new value, the GUI
+                    # reads the sample buffer on its own thread instead
+                    if self.calledFunction is not None:
+                        self.calledFunction(self.samples)
+                    clock.next()
+                    self.updateProgress(clock)
+                log.info("Readout timing: %s", clock.report())
 
             elif self.runningMode == 'system-standard':
 
-                self.sensor.connect()
-                thermometer = False
-                
-                self.sensor.bridge.setWavelength(c_double(float(self.wavelength)))
-                temperature = c_double()
-                try:                    
-                    self.sensor.bridge.measExtNtcTemperature(byref(temperature))
-                    thermometer = True
-                except NameError as err:
-                    print("Temperature sensor not connected!")
-                    print(err.args)
-
-                origStdOut = sys.stdout
-                with open(self.fileName, "a") as fout:
-                    if fout and os.stat(self.fileName).st_size == 0:
-                        sys.stdout = fout
-                        if not thermometer:
-                            print("timestamp\twavelength\tsetting\tpower")
-                        elif temperature.value != 0:
-                            print("timestamp\twavelength\tsetting\tpower\ttemperature")
-                        sys.stdout = origStdOut
-                
-                time.sleep(0.5)  # Without this delay, the first number is consistently higher than the rest
-                start = datetime.now()
-                measure_until = start + timedelta(seconds=float(self.duration))
-
-                ind = 0 # To discard the first point
-                
-                counter = 0
-                while datetime.now() <= measure_until:
-                    average_count = 0
-                    total_power = 0
-                    total_temperature = 0
-
-                    start_average = datetime.now()
-                    average_until = start_average + timedelta(seconds=float(self.avgTime))
-
-                    while datetime.now() < average_until:
-                        power = c_double()                        
-                        self.sensor.bridge.measPower(byref(power))
-                        total_power += power.value * 1000 # W -> mW
-
-                        if thermometer:
-                            self.bridge.measExtNtcTemperature(byref(temperature))
-                            total_temperature += temperature.value
-                        average_count += 1
-
-                    if self.stopRequested:
-                        break
-
-                    total_power /= average_count
-                    counter = counter + 1
-                    
-                    if thermometer:
-                        total_temperature /= average_count
-
-                    with open(self.fileName, "a") as fout:
-                        if thermometer:
-                            outString = f"{start_average.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}\t{self.wavelength}\t{self.power}\t{total_power}\t{total_temperature}"                            
-                        else:
-                            outString = f"{start_average.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}\t{self.wavelength}\t{self.power}\t{total_power}"                        
-                            
-                        sys.stdout = fout
-                        # With the TLPM sensor the first readont is always slightly off
-                        if ind > 0:
-                            print(outString)
-                            sys.stdout = origStdOut
-                            print(outString)
-                        
-                            timeString = start_average.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                            timePoints.append(timeString)
-                            powers.append(total_power)
-
-                            self.results = [timePoints, powers]
-
-                            # This function (to update plots) is expected to run every 
-                            # time a new value is acquired
-                            try:
-                                self.calledFunction(self.results)
-                            except:
-                                pass
-
-                        ind = ind+1
-                self.sensor.disconnect()
-                print(f"Worker completing for wavelength {self.wavelength}.")
+                self.acquisition = StandardAcquisition(
+                    self.sensor, self.averager, self.wavelength, self.power, self.fileName,
+                    self.duration, self.avgTime, self.flushRows, self.flushInterval)
+                self.acquisition.metadata = self.metadata
+                self.acquisition.samples = self.samples
+                self.acquisition.reportProgress = self.reportProgress
+                self.acquisition.cancelEvent = self.cancelEvent
+
+                def update(samples):
+                    # Called on this thread after every new value, the GUI
+                    # reads the sample buffer on its own thread instead
+                    try:
+                        self.calledFunction(samples)
+                    except:
+                        pass
+
+                # The session stays open for the next queued job,
+                # the manager disconnects once the queue is empty
+                self.results = self.acquisition.run(update if self.calledFunction is not None else None)
+                log.info("Worker completing for wavelength %s", self.wavelength)
 
             elif self.runningMode == 'test-calibration':
                 # This function performs the power measurement, calling the tlPM device
@@ -208,21 +170,19 @@ class Worker(QObject):
                 self.avgSimulation = 3.5
                 self.SimSpan = 2
 
-                time.sleep(0.5)  # Without this delay, the first number is consistently higher than the rest
-                start = datetime.now()
+                self.cancelEvent.wait(0.5)  # Without this delay, the first number is consistently higher than the rest
+                clock = SamplingClock(self.avgTime, self.duration, cancelEvent=self.cancelEvent)
 
-                measure_until = start + timedelta(seconds=float(self.duration))
-                print("Running simulation for a set wavelength of "+ str(self.wavelength)+" nm")
+                log.info("Running simulation for a set wavelength of %s nm", self.wavelength)
 
                 iteration = 0
-                while datetime.now() <= measure_until:
+                while not clock.finished():
 
                     average_count = 0
                     total_power = 0
 
-                    start_average = datetime.now()  
-                    average_until = start_average + timedelta(seconds=float(self.avgTime))
-                    while(datetime.now() <= average_until):
+                    average_until = clock.windowEnd()
+                    while(time.perf_counter_ns() <= average_until and not self.stopRequested):
                         power = np.random.normal(self.avgSimulation, self.SimSpan, size = 1)
                         total_power += power[-1]
                         average_count += 1
@@ -236,6 +196,8 @@ class Worker(QObject):
                     self.results = [iterations, powers]  
                     # print('results: ',self.results)                  
                     iteration += 1                   
+                    clock.next()
+                    self.updateProgress(clock)
                 # This function (the calibration) is expected to run 
                 # once all values are acquired
                 self.output = self.calledFunction(self.results)
@@ -246,121 +208,316 @@ class Worker(QObject):
                 # The wavelength, average time and duration configure the process
                 # The set powerlevel is written in the file together with the results
                 self.sensor.connect()
-                start = datetime.now()
 
-                measure_until = start + timedelta(seconds=float(self.duration))
-                print("System mode, set wavelength: "+ str(self.wavelength)+" nm")
-                self.bridge.setWavelength(c_double(float(self.wavelength)))
+                log.info("System mode, set wavelength: %s nm", self.wavelength)
+                self.sensor.setWavelength(self.wavelength)
+                self.averager.configure(float(self.avgTime))
+                try:
+                    self.averager.cancelEvent = self.cancelEvent
+                    clock = SamplingClock(self.avgTime, self.duration, cancelEvent=self.cancelEvent)
                 
-                iteration = 0
+                    iteration = 0
 
-                while datetime.now() <= measure_until:
+                    while not clock.finished():
 
-                    average_count = 0
-                    total_power = 0
-                    
-                    start_average = datetime.now()  
-                    average_until = start_average + timedelta(seconds=float(self.avgTime))
-                    while datetime.now() < average_until:
-                        power = c_double()
-                        self.bridge.measPower(byref(power))
-                        total_power += power.value
-                        average_count += 1
-                    if self.stopRequested:
-                        break    
-                    total_power /= average_count            
+                        total_power, _, average_count = self.averager.average(clock.windowEnd())
+                        if self.stopRequested:
+                            break    
                     
-                    iterations.append(iteration)
-                    powers.append(total_power)
-                    self.results = [iterations, powers]    
-                    iteration += 1
+                        iterations.append(iteration)
+                        powers.append(total_power)
+                        self.results = [iterations, powers]    
+                        iteration += 1
+                        clock.next()
+                        self.updateProgress(clock)
+
+                    # This function (the calibration) is expected to run 
+                    # once all values are acquired
+                    self.output = self.calledFunction(self.results)
+                finally:
+                    # Also after an error or a cancellation, the session 
+                    # stays open for the next job
+                    self.averager.finish()
+                log.info("Worker completing for wavelength %s", self.wavelength)
+
+        except Exception:
+            log.exception("Error in worker for wavelength %s", self.wavelength)
+            # Reconnect with the next job, the session might be broken
+            self.sensor.invalidate()
+            self.finished.emit()
 
-                # This function (the calibration) is expected to run 
-                # once all values are acquired
-                self.output = self.calledFunction(self.results)
-                self.sensor.disconnect()
-                print(f"Worker completing for wavelength {self.wavelength}.")
+        finally:
+            log.info("Worker finishing for wavelength %s", self.wavelength)
+            try:
+                self.closeWriter()
+            except Exception:
+                log.exception("Error closing the data file of the worker")
+            self.finished.emit()
+
+class CancellationToken():
+    # Shared between a job and whoever may cancel it. Backed by an 
+    # event, so a thread can also sleep on it and wake up when cancelled.
 
+    def __init__(self):
+        self.event = threading.Event()
+
+    def cancel(self):
+        self.event.set()
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        # True if cancelled before the timeout [s]
+        return self.event.wait(timeout)
+
+class Job(QObject):
+    # A task run by the JobScheduler. The task is either an object with 
+    # run() and stop() methods, like Worker, or a callable that receives 
+    # the CancellationToken. Jobs on the same device never overlap; among 
+    # the jobs that can start, higher priorities go first, then the 
+    # order of submission.
+    started = Signal(object)
+    progress = Signal(object)
+    finished = Signal(object)
+
+    pending, running, done, cancelled = 'pending', 'running', 'done', 'cancelled'
+
+    def __init__(self, task, priority=0, device=None, name=''):
+        super().__init__()
+        self.task = task
+        self.priority = priority
+        self.device = device
+        self.name = name
+        self.token = CancellationToken()
+        self.state = Job.pending
+        self.error = None
+        self.fraction = 0.0
+        self.startTime = None
+        if hasattr(task, 'reportProgress'):
+            task.reportProgress = self.reportProgress
+        # Cancelling the token stops the task within one sample
+        if hasattr(task, 'cancelEvent'):
+            task.cancelEvent = self.token.event
+
+    def execute(self):
+        # Runs on a thread of the pool
+        self.startTime = time.perf_counter()
+        self.started.emit(self)
+        try:
+            if callable(self.task) and not hasattr(self.task, 'run'):
+                self.task(self.token)
+            else:
+                self.task.run()
         except Exception as e:
-            print(f"Error in Worker: {e}")
-            self.finished.emit()
+            log.exception("Error in job %s", self.name)
+            self.error = e
+
+    def cancel(self):
+        self.token.cancel()
+        if self.state == Job.running and hasattr(self.task, 'stop'):
+            self.task.stop()
+
+    def reportProgress(self, fraction):
+        self.fraction = fraction
+        self.progress.emit(self)
+
+    def eta(self):
+        # Remaining time [s] extrapolated from the progress so far
+        if self.startTime is None or self.fraction <= 0:
+            return None
+        elapsed = time.perf_counter() - self.startTime
+        return elapsed * (1 - self.fraction) / self.fraction
+
+class JobRunnable(QRunnable):
+    def __init__(self, job, done):
+        super().__init__()
+        self.job = job
+        self.done = done
+        self.setAutoDelete(True)
 
+    def run(self):
+        try:
+            self.job.execute()
         finally:
-            print(f"Worker finishing for wavelength {self.wavelength}.")            
-            self.finished.emit()
+            self.done.emit(self.job)
+
+class JobScheduler(QObject):
+    # Runs jobs on a pool of reusable threads. Jobs overlap unless they
+    # use the same device, which is locked while one of its jobs runs. 
+    # Finished jobs are released, their signals are delivered on the 
+    # thread of the scheduler (the GUI thread).
+    jobDone = Signal(object)
+    jobProgress = Signal(object)
+    allFinished = Signal()
+
+    sharedScheduler = None
+
+    def __init__(self, maxWorkers=4):
+        super().__init__()
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(maxWorkers)
+        self.queue = []
+        self.order = itertools.count()
+        # Device -> job holding it
+        self.deviceLocks = {}
+        self.running = set()
+        self.jobDone.connect(self.onJobDone)
+
+    @classmethod
+    def shared(cls):
+        # One scheduler for the whole program, so jobs of 
+        # different managers share the devices and the pool
+        if cls.sharedScheduler is None:
+            cls.sharedScheduler = cls()
+        return cls.sharedScheduler
+
+    def submit(self, task, priority=0, device=None, name=''):
+        job = Job(task, priority, device, name)
+        job.progress.connect(self.jobProgress)
+        heapq.heappush(self.queue, (-priority, next(self.order), job))
+        self.dispatch()
+        return job
+
+    def cancel(self, job):
+        if job.state == Job.pending:
+            self.queue = [entry for entry in self.queue if entry[2] is not job]
+            heapq.heapify(self.queue)
+            job.token.cancel()
+            job.state = Job.cancelled
+            self.release(job)
+        else:
+            job.cancel()
+
+    def cancelAll(self):
+        for _, _, job in list(self.queue):
+            self.cancel(job)
+        for job in list(self.running):
+            job.cancel()
+
+    def isIdle(self):
+        return not self.queue and not self.running
+
+    def deviceKey(self, device):
+        return None if device is None else id(device)
+
+    def dispatch(self):
+        # Starts the first jobs in priority order whose device is free
+        waiting = []
+        while self.queue and len(self.running) < self.pool.maxThreadCount():
+            entry = heapq.heappop(self.queue)
+            job = entry[2]
+            key = self.deviceKey(job.device)
+            if key is not None and key in self.deviceLocks:
+                waiting.append(entry)
+                continue
+            if key is not None:
+                self.deviceLocks[key] = job
+            job.state = Job.running
+            self.running.add(job)
+            self.pool.start(JobRunnable(job, self.jobDone))
+        for entry in waiting:
+            heapq.heappush(self.queue, entry)
+
+    def onJobDone(self, job):
+        self.running.discard(job)
+        key = self.deviceKey(job.device)
+        if self.deviceLocks.get(key) is job:
+            del self.deviceLocks[key]
+        job.state = Job.cancelled if job.token.cancelled else Job.done
+        self.release(job)
+        self.dispatch()
+
+    def release(self, job):
+        job.finished.emit(job)
+        # The task and the job are not needed anymore
+        if isinstance(job.task, QObject):
+            job.task.deleteLater()
+        job.deleteLater()
+        if self.isIdle():
+            self.allFinished.emit()
+
+    def remaining(self):
+        # Estimated time [s] until the running jobs are done
+        etas = [job.eta() for job in self.running]
+        etas = [eta for eta in etas if eta is not None]
+        return max(etas) if etas else None
 
 class MeasurementManager(QObject):
+    # Queues the measurements of one device on the JobScheduler. They run 
+    # in the order they were added, one at a time as they share the 
+    # device, and finished is emitted once all of them are done.
     finished = Signal()
+    # Emitted with finished once the jobs stopped by finishThreads are done
+    stopped = Signal()
+    progress = Signal(float, object)
 
-    def __init__(self, device, effect):
+    def __init__(self, device, effect, scheduler=None, priority=0):
         super().__init__()
         self.queue = Queue()
         self.device = device
-        self.current_thread = None
         self.externalCall = effect
         self.calibrationTable = []
         self.results = []
-        self.threadList = []
+        self.fileNames = []
+        self.jobs = []
+        self.scheduler = scheduler if scheduler is not None else JobScheduler.shared()
+        self.priority = priority
+        self.stopping = False
+        # Passed to the workers, stored in binary data files
+        self.metadata = None
+        # Passed to the workers of the standard modes
+        self.samples = None
 
     def returnFileNames(self):
-        fileNameList = []
-        for job in self.threadList:    
-            _, currWorker = job
-            fileNameList.append(currWorker.returnFileName())
-        return fileNameList
+        return self.fileNames
 
-    def add_measurement(self, wavelength, power, fileName, duration, avgTime, runningMode):
-        self.queue.put((wavelength, power, fileName, duration, avgTime, runningMode))
-        print(f"Measurement queued: {wavelength}, {power}")
+    def add_measurement(self, wavelength, power, fileName, duration, avgTime, runningMode, averaging='software'):
+        self.queue.put((wavelength, power, fileName, duration, avgTime, runningMode, averaging))
+        log.info("Measurement queued: %s, %s", wavelength, power)
 
     def start_measurements(self):
-        if not self.queue.empty():
-            self.process_next_measurement()
-
-    def process_next_measurement(self):
-        if not self.queue.empty():
-            measurement = self.queue.get()
-            wavelength, power, fileName, duration, avgTime, runningMode = measurement
-            self.process_measurement(wavelength, power, fileName, duration, avgTime, runningMode)
+        while not self.queue.empty():
+            self.process_measurement(*self.queue.get())
 
     def storeResult(self, result):
         self.results.append(result)
 
-    def process_measurement(self, wavelength, power, fileName, duration, avgTime, runningMode):
-        print('Processing measurement...')
-        thread = QThread()        
-        worker = Worker(self.device, wavelength, power, fileName, duration, avgTime, runningMode, self.externalCall)
-        worker.moveToThread(thread)
-        self.threadList.append((thread, worker))
-        
-        # Connect signals
-        worker.finished.connect(thread.quit)
-        worker.finished.connect(lambda: self.onWorkerFinished(thread, worker))
-        thread.started.connect(worker.run)
-        thread.finished.connect(lambda: self.cleanup_thread(thread))
+    def process_measurement(self, wavelength, power, fileName, duration, avgTime, runningMode, averaging='software'):
+        log.debug("Processing measurement")
+        worker = Worker(self.device, wavelength, power, fileName, duration, avgTime, runningMode, self.externalCall, averaging)
+        worker.metadata = self.metadata
+        worker.samples = self.samples
         worker.resultReady.connect(self.storeResult)
-
-        print(f'Starting thread for measurement {wavelength}')
-        self.current_thread = thread
-        self.current_thread.start()
-        return thread
-
-    def onWorkerFinished(self, thread, worker):
-        print(f"Worker finished signal received for wavelength {worker.wavelength}.")
-        self.calibrationTable = worker.getResults()
-        worker.deleteLater()
-        self.cleanup_thread(thread)
-        self.process_next_measurement()
+        self.fileNames.append(fileName)
+
+        job = self.scheduler.submit(worker, self.priority, self.device, f"{runningMode} {wavelength}")
+        job.progress.connect(self.onProgress)
+        job.finished.connect(self.onWorkerFinished)
+        self.jobs.append(job)
+        return job
+
+    def onProgress(self, job):
+        self.progress.emit(job.fraction, job.eta())
+
+    def onWorkerFinished(self, job):
+        log.debug("Worker finished signal received for %s", job.name)
+        self.calibrationTable = job.task.getResults()
+        self.jobs.remove(job)
+        if not self.jobs:
+            # The device session is shared by all the queued jobs
+            self.device.disconnect()
+            if self.stopping:
+                self.stopping = False
+                self.stopped.emit()
+            self.finished.emit()
 
     def finishThreads(self):        
-        for thread, worker in self.threadList:
-            print("trying to stop")
-            worker.stop()
-            thread.quit()
-            thread.wait()
-            
-    def cleanup_thread(self, thread):
-        if thread.isFinished():
-            print("Cleaning up thread...")            
-            thread.deleteLater()
-            self.finished.emit()
+        # Does not wait for the workers, stopped and finished are
+        # emitted once all of them are done
+        if self.jobs:
+            self.stopping = True
+        for job in list(self.jobs):
+            log.info("Stopping %s", job.name)
+            self.scheduler.cancel(job)
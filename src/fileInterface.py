@@ -13,9 +13,18 @@ This program is free software: you can redistribute it and/or modify
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import csv, os
+import csv, os, time, json, shutil
+import logging, threading
+from queue import Queue, Empty
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+
+from lpmParser import PulseAssignment
 # from datetime import datetime
 
+log = logging.getLogger(__name__)
+
 class TSVAccess():
 
     def fieldValuesFromTSV(fields, fullFilePath):
@@ -42,7 +51,7 @@ class TSVAccess():
                                     # remove the first and last chars
                                     value = value[1:-1]
                                 
-                        print(row, value)
+                        log.debug("%s: %r", name, value)
                         fieldValues.append(value)
         return fieldValues
 
@@ -64,6 +73,370 @@ class TSVAccess():
         os.replace(temp_file_path, fullFilePath)
 
 
+class BufferedDataWriter(threading.Thread):
+    # Writes the acquired rows from its own thread. The file stays open for 
+    # the whole acquisition and the rows are written in batches, flushed 
+    # once flushRows rows are pending or flushInterval seconds have passed.
+    # stop() writes what is left and syncs the file to disk.
+    # Timestamps given as datetime are written with millisecond resolution.
+
+    mode = 'a'
+    empty = ''
+
+    def __init__(self, fileName, header, flushRows=100, flushInterval=1.0):
+        super().__init__(daemon=True)
+        self.fileName = fileName
+        self.header = header
+        self.flushRows = flushRows
+        self.flushInterval = flushInterval
+        self.rows = Queue()
+        self.error = None
+
+    @staticmethod
+    def format(field):
+        if isinstance(field, datetime):
+            return field.strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+        return str(field)
+
+    def encode(self, fields):
+        return '\t'.join(self.format(field) for field in fields) + '\n'
+
+    def writeHeader(self, fout):
+        if self.header:
+            fout.write('\t'.join(self.header) + '\n')
+
+    def write(self, fields):
+        # Once writing failed the acquisition stops, not only at stop()
+        if self.error is not None:
+            raise self.error
+        self.rows.put(self.encode(fields))
+
+    def stop(self):
+        self.rows.put(None)
+        self.join()
+        if self.error is not None:
+            raise self.error
+
+    def run(self):
+        try:
+            with open(self.fileName, self.mode) as fout:
+                if os.path.getsize(self.fileName) == 0:
+                    self.writeHeader(fout)
+
+                pending = []
+                lastFlush = time.monotonic()
+                running = True
+                while running:
+                    timeout = max(self.flushInterval - (time.monotonic() - lastFlush), 0)
+                    try:
+                        row = self.rows.get(timeout=timeout)
+                        if row is None:
+                            running = False
+                        else:
+                            pending.append(row)
+                    except Empty:
+                        pass
+
+                    now = time.monotonic()
+                    if not pending:
+                        lastFlush = now
+                    elif not running or len(pending) >= self.flushRows or now - lastFlush >= self.flushInterval:
+                        fout.write(self.empty.join(pending))
+                        fout.flush()
+                        pending = []
+                        lastFlush = now
+
+                os.fsync(fout.fileno())
+        except Exception as e:
+            log.error("Error writing %s: %s", self.fileName, e)
+            self.error = e
+
+class BinaryDataFile():
+    # Compact acquisition files (*.lpmb), to be memory mapped when read:
+    #   'SMARTLPM', header length (uint32), JSON header, zero padding to a 
+    #   multiple of 64 bytes, then fixed-width little-endian records.
+    # 'time' holds the wall clock time of the timestamps of the text files,
+    # as seconds since 1970-01-01 00:00 (no time zone). Missing temperatures 
+    # are NaN. The header keeps the recipe and calibration ('metadata').
+
+    extension = '.lpmb'
+    magic = b'SMARTLPM'
+    alignment = 64
+    dtype = np.dtype([
+        ('time', '<f8'),
+        ('wavelength', '<f4'),
+        ('setting', '<f4'),
+        ('power', '<f8'),
+        ('temperature', '<f8')])
+    epoch = datetime(1970, 1, 1)
+
+    @staticmethod
+    def isBinary(fileName):
+        try:
+            with open(fileName, 'rb') as fin:
+                return fin.read(len(BinaryDataFile.magic)) == BinaryDataFile.magic
+        except (OSError, TypeError):
+            return False
+
+    @staticmethod
+    def headerBytes(columns, metadata):
+        header = {
+            'format': 1,
+            'columns': list(columns),
+            'dtype': BinaryDataFile.dtype.descr,
+            'metadata': metadata or {}
+            }
+        # NumPy values (calibration tables) are stored as lists
+        text = json.dumps(header, default=lambda value: value.tolist() if hasattr(value, 'tolist') else str(value))
+        text = text.encode('utf-8')
+        size = len(BinaryDataFile.magic) + 4 + len(text)
+        padding = -size % BinaryDataFile.alignment
+        return (BinaryDataFile.magic + (len(text) + padding).to_bytes(4, 'little') + 
+                text + b' ' * padding)
+
+    @staticmethod
+    def record(fields):
+        # fields as given to the text writer: 
+        # [timestamp (datetime), wavelength, setting, power(, temperature)]
+        timestamp = fields[0]
+        if isinstance(timestamp, datetime):
+            timestamp = (timestamp - BinaryDataFile.epoch).total_seconds()
+        temperature = fields[4] if len(fields) > 4 else np.nan
+        values = (timestamp, fields[1], fields[2], fields[3], temperature)
+        return np.array(values, dtype=BinaryDataFile.dtype).tobytes()
+
+    @staticmethod
+    def read(fileName):
+        # Returns the header and a copy-on-write memory map of the records
+        with open(fileName, 'rb') as fin:
+            if fin.read(len(BinaryDataFile.magic)) != BinaryDataFile.magic:
+                raise ValueError(f"{fileName} is not a SmartLPM binary file")
+            length = int.from_bytes(fin.read(4), 'little')
+            header = json.loads(fin.read(length).decode('utf-8'))
+        offset = len(BinaryDataFile.magic) + 4 + length
+        if os.path.getsize(fileName) == offset:
+            return header, np.zeros(0, dtype=BinaryDataFile.dtype)
+        records = np.memmap(fileName, dtype=BinaryDataFile.dtype, mode='c', offset=offset)
+        return header, records
+
+    @staticmethod
+    def timestamps(records):
+        return (records['time'] * 1e6).astype('datetime64[us]')
+
+    @staticmethod
+    def textRows(fileName):
+        # Header and rows as they are in the text files
+        header, records = BinaryDataFile.read(fileName)
+        columns = header['columns']
+        timeStrings = np.char.replace(
+            np.datetime_as_string(BinaryDataFile.timestamps(records), unit='ms'), 'T', ' ')
+        rows = [timeStrings.tolist(), 
+                records['wavelength'].astype(int).astype(str).tolist(), 
+                records['setting'].astype(int).astype(str).tolist(), 
+                [str(value) for value in records['power'].tolist()]]
+        if any(column.startswith('temperature') for column in columns):
+            rows.append([str(value) for value in records['temperature'].tolist()])
+        return columns, [list(row) for row in zip(*rows)]
+
+class BinaryDataWriter(BufferedDataWriter):
+    # Same as BufferedDataWriter, writing BinaryDataFile records
+
+    mode = 'ab'
+    empty = b''
+
+    def __init__(self, fileName, header, flushRows=100, flushInterval=1.0, metadata=None):
+        super().__init__(fileName, header, flushRows, flushInterval)
+        self.metadata = metadata
+
+    def encode(self, fields):
+        return BinaryDataFile.record(fields)
+
+    def writeHeader(self, fout):
+        fout.write(BinaryDataFile.headerBytes(self.header, self.metadata))
+
+def openDataWriter(fileName, header, flushRows=100, flushInterval=1.0, metadata=None):
+    # The file extension selects the format
+    if fileName.endswith(BinaryDataFile.extension):
+        return BinaryDataWriter(fileName, header, flushRows, flushInterval, metadata)
+    return BufferedDataWriter(fileName, header, flushRows, flushInterval)
+
+class SplitFileWriter():
+    # Writes rows into many tab separated files at once. Files are opened 
+    # for appending with a large buffer and kept open, up to maxOpen of 
+    # them: the least recently used one is closed to open a new one.
+    # The header is written the first time a file is used.
+
+    def __init__(self, header, maxOpen=64, bufferSize=1 << 16):
+        self.header = header
+        self.maxOpen = maxOpen
+        self.bufferSize = bufferSize
+        self.files = OrderedDict()
+        self.started = set()
+
+    def writer(self, fileName):
+        entry = self.files.get(fileName)
+        if entry is not None:
+            self.files.move_to_end(fileName)
+            return entry[1]
+
+        if len(self.files) >= self.maxOpen:
+            _, (oldest, _) = self.files.popitem(last=False)
+            oldest.close()
+        fout = open(fileName, 'a', newline='', buffering=self.bufferSize)
+        writer = csv.writer(fout, delimiter='\t')
+        self.files[fileName] = (fout, writer)
+        if fileName not in self.started:
+            self.started.add(fileName)
+            writer.writerow(self.header)
+        return writer
+
+    def writerow(self, fileName, row):
+        self.writer(fileName).writerow(row)
+
+    def close(self):
+        while self.files:
+            _, (fout, _) = self.files.popitem()
+            fout.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class LightSourceFiles():
+    # The sorted data of an experiment, saved in the 'Light Sources' tree:
+    #   Light Sources/<model>/<identifier>/<base>info.txt
+    #   Light Sources/<model>/<identifier>/<base><wavelength>nm_<protocol>[_<power>%].txt
+    # The same files are written by the GUI and by the headless runner
+
+    infoFields = ["lightSourceModel", 
+                  "lightSourceIdentifier",
+                  "setPowers",
+                  "wavelengths", 
+                  "refWavelength",
+                  "calibrationFactors"]
+
+    @staticmethod
+    def folder(savePath, lightSourceModel, lightSourceIdentifier):
+        finalSavePath = os.path.join(savePath, 'Light Sources')
+        os.makedirs(finalSavePath, exist_ok=True)
+        if lightSourceModel:
+            finalSavePath = os.path.join(finalSavePath, str(lightSourceModel))
+            os.makedirs(finalSavePath, exist_ok=True)
+            if lightSourceIdentifier:
+                finalSavePath = os.path.join(finalSavePath, str(lightSourceIdentifier))
+                os.makedirs(finalSavePath, exist_ok=True)
+        return finalSavePath
+
+    @staticmethod
+    def saveInfoFile(infoFilePath, baseFileName, source):
+        # The info fields are read from the attributes of source
+        fileName = baseFileName + 'info.txt'
+        fullPath = os.path.join(infoFilePath, fileName)
+        log.info("Saving acquisition information to %s", fullPath)
+        with open(fullPath, 'w') as infoFile:
+            for name in LightSourceFiles.infoFields:
+                value = getattr(source, name)
+                infoFile.write(name+'\t'+str(value)+'\n')
+
+    @staticmethod
+    def filePaths(finalSavePath, filename0, wavelengths, setPowers, order, duration, splitByPower):
+        # Destination of each wavelength index, or of each 
+        # (wavelength, power) index pair when split by power
+        outputPathsFilteredData = {}
+        powerSettingCount = len(setPowers)
+        if((order == 'PL' and duration >= 1800) |
+            (order == 'LP' and duration / powerSettingCount > 1800)
+            ):
+            # Wavelengths interleaved for more than 30 minutes or 
+            # a series of more that 30 minuted per wavelength
+            protocolStr = 'long'
+        else:
+            protocolStr = 'short'
+
+        for wavelengthInd in range(len(wavelengths)):
+
+            filename2 = filename0 + str(wavelengths[wavelengthInd]) + 'nm'
+
+            if splitByPower:
+                for powerInd in range(powerSettingCount):
+                    filename3 = filename2 + '_' + protocolStr + '_' + str(setPowers[powerInd]) + '%.txt'                    
+                    outputPathsFilteredData[(wavelengthInd, powerInd)] = os.path.join(finalSavePath,filename3)
+            else:
+                if(powerSettingCount>1):
+                    # More than one intensity -> linear
+                    filename2 = filename2 + '_linear.txt'
+                else:
+                    filename2 = filename2 + '_' + protocolStr + '_' + str(setPowers[0]) + '%.txt'
+                outputPathsFilteredData[(wavelengthInd)]= os.path.join(finalSavePath,filename2)
+        return outputPathsFilteredData
+
+    @staticmethod
+    def split(inputFullPath, outputPathRawData, outputPathsFilteredData, pointers, 
+              splitByPower, threshold, wavelengths, setPowers, calibrationTable=None):
+        # Copies the raw data file and writes its labelled points to the 
+        # sorted files, replacing the wavelength and setting columns. 
+        # Points below threshold and pulse transitions are left out and 
+        # powers are corrected when a calibration table is given.
+        # Binary data files are copied as they are, the sorted files are text
+        if BinaryDataFile.isBinary(inputFullPath):
+            header, rows = BinaryDataFile.textRows(inputFullPath)
+            outputPathRawData = os.path.splitext(outputPathRawData)[0] + BinaryDataFile.extension
+            shutil.copyfile(inputFullPath, outputPathRawData)
+        else:
+            with open(inputFullPath, 'r', newline='') as infile, open(outputPathRawData, 'w+', newline='') as outfileMain:
+                reader = csv.reader(infile, delimiter='\t')
+                writer1 = csv.writer(outfileMain, delimiter='\t')
+                
+                # Assuming the first row is the header
+                header = next(reader)
+                writer1.writerow(header)
+                rows = list(reader)
+                writer1.writerows(rows)
+
+        if not outputPathsFilteredData:
+            return
+
+        # here a strategy to get rid of the transition points:
+        # Due to averaging some power values appear at the slopes 
+        # of the detected pulses. They are still above threshold 
+        # but far below real power values. The "transition" points 
+        # at both ends of each pulse will not be saved.
+        pointers = pointers[:len(rows)]
+        labelled, isTransition = PulseAssignment.transitionPoints(pointers)
+
+        with SplitFileWriter(header) as splitter:
+            for element in np.flatnonzero(labelled):
+                row = rows[element]
+                wavelengthInd = int(pointers[element, 0])
+                powerInd = int(pointers[element, 1])
+
+                if splitByPower:
+                    fileKey = (wavelengthInd, powerInd)
+                else:
+                    fileKey = wavelengthInd
+                file = outputPathsFilteredData.get(fileKey)
+
+                if file not in splitter.started:
+                    # The first point of each file only starts it
+                    splitter.writer(file)
+                    continue
+                if isTransition[element]:
+                    # transition points will not be written
+                    continue
+
+                tempValue = float(row[3])
+                if tempValue >= threshold:
+                    # Exclude raw data points below threshold
+                    if calibrationTable is not None:
+                        # Apply corrections before saving data
+                        tempValue = calibrationTable[wavelengthInd] * tempValue
+                    row[1] = str(wavelengths[wavelengthInd])
+                    row[2] = str(setPowers[powerInd])
+                    row[3] = tempValue
+                    splitter.writerow(file, row)
+
 def main():
 
     fieldNames = [
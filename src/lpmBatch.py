@@ -0,0 +1,158 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import csv, glob, multiprocessing, os, sys, time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+import numpy as np
+
+from fileInterface import BinaryDataFile
+from lpmHeadless import HeadlessRun, thresholdArgument
+from lpmLogging import addLoggingArguments, loggingOptions, setupLogging, stopLogging, loggerLevels, attachToQueue
+
+# Sorts archived raw files again, e.g. after correcting a recipe or the
+# threshold. Every file is loaded, reassigned and split by a process of
+# the pool, with the same steps as the headless runner. A manifest lists
+# the outcome, timing and error of every file.
+
+manifestFields = ['file', 'status', 'seconds', 'points', 'threshold', 'assigned', 'output', 'error']
+
+def findRawFiles(inputs):
+    # Raw files given as folders (all the *-blindMode files in them),
+    # glob patterns or file names, in order and without repetitions
+    fileNames = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = []
+            for extension in ['.txt', BinaryDataFile.extension]:
+                matches += glob.glob(os.path.join(item, '*-blindMode' + extension))
+        else:
+            matches = glob.glob(item)
+        for fileName in sorted(matches):
+            if fileName not in fileNames:
+                fileNames.append(fileName)
+    return fileNames
+
+def processFile(recipeFile, dataFileName, options):
+    # Runs in a process of the pool. Returns the manifest entry
+    entry = dict.fromkeys(manifestFields, '')
+    entry['file'] = dataFileName
+    start = time.perf_counter()
+    try:
+        run = HeadlessRun(recipeFile)
+        if options.get('threshold') == 'auto':
+            run.autoThreshold = True
+        else:
+            run.threshold = options.get('threshold')
+        run.alignToSignature = options.get('align', False)
+        run.splitByPower = options.get('splitByPower', False)
+        if options.get('output'):
+            run.dataSavePath = options['output']
+        # The output files of every raw file start with its name
+        run.deviceLabel = os.path.splitext(os.path.basename(dataFileName))[0] + '_'
+        samples = run.loadDataFile(dataFileName)
+        entry['points'] = len(samples)
+        if run.threshold is not None or run.autoThreshold:
+            run.reassignData()
+            if run.pointers is not None:
+                entry['threshold'] = run.threshold
+                entry['assigned'] = int(np.sum(~np.isnan(run.pointers[:, 0])))
+        entry['output'] = run.saveDataFile()
+        entry['status'] = 'ok'
+    except Exception as e:
+        entry['status'] = 'error'
+        entry['error'] = f"{type(e).__name__}: {e}"
+    entry['seconds'] = round(time.perf_counter() - start, 3)
+    return entry
+
+def writeManifest(fileName, entries):
+    with open(fileName, 'w', newline='') as fout:
+        writer = csv.DictWriter(fout, fieldnames=manifestFields, delimiter='\t')
+        writer.writeheader()
+        writer.writerows(entries)
+
+def processFiles(recipeFile, fileNames, options, workers=None, logQueue=None):
+    # Manifest entries in the order of fileNames. The messages logged by
+    # the processes go to logQueue, a queue shared with the listener of
+    # this process, when given
+    entries = {}
+    initializer, initargs = None, ()
+    if logQueue is not None:
+        initializer, initargs = attachToQueue, (logQueue, loggerLevels())
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs) as pool:
+        futures = {pool.submit(processFile, recipeFile, fileName, options): fileName
+                   for fileName in fileNames}
+        for done, future in enumerate(as_completed(futures), 1):
+            entry = future.result()
+            entries[futures[future]] = entry
+            print(f"[{done}/{len(fileNames)}] {entry['status']}\t{entry['seconds']} s\t{entry['file']}"
+                  + (f"\t{entry['error']}" if entry['error'] else ''))
+    return [entries[fileName] for fileName in fileNames]
+
+def processBatch(args, logQueue):
+    # The work of main, once the arguments are parsed and the logging set up
+    fileNames = findRawFiles(args.inputs)
+    if not fileNames:
+        print("No raw data files found", file=sys.stderr)
+        return 1
+
+    try:
+        outputPath = args.output or HeadlessRun(args.recipe).dataSavePath
+        os.makedirs(outputPath, exist_ok=True)
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+
+    options = {'threshold': args.threshold, 'align': args.align, 
+               'splitByPower': args.split_by_power, 'output': outputPath}
+    start = time.perf_counter()
+    entries = processFiles(args.recipe, fileNames, options, args.workers, logQueue)
+
+    manifest = args.manifest or os.path.join(
+        outputPath, datetime.now().strftime("batchManifest-%Y%m%d-%H%M%S.tsv"))
+    writeManifest(manifest, entries)
+    errors = sum(entry['status'] != 'ok' for entry in entries)
+    print(f"{len(entries)} files in {time.perf_counter() - start:.1f} s, {errors} errors, manifest: {manifest}")
+    return 0 if errors == 0 else 1
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Sorts raw SmartLPM data files again with a recipe, several files at once.")
+    parser.add_argument("recipe", help="process file (.tsv) with the experiment settings")
+    parser.add_argument("inputs", nargs='+',
+                        help="raw data files, glob patterns or folders (their *-blindMode files)")
+    parser.add_argument("--threshold", type=thresholdArgument,
+                        help="detection threshold [mW] to sort the readouts by pulse, "
+                             "'auto' to estimate it for every file")
+    parser.add_argument("--align", action="store_true", 
+                        help="label the pulses by their position in the signature instead of counting them")
+    parser.add_argument("--split-by-power", action="store_true",
+                        help="one sorted file per wavelength and power setting")
+    parser.add_argument("--output", help="data folder, instead of the one in the recipe")
+    parser.add_argument("--workers", type=int, help="number of processes, one per CPU by default")
+    parser.add_argument("--manifest", help="summary file (.tsv), batchManifest-<time>.tsv in the data folder by default")
+    addLoggingArguments(parser)
+    args = parser.parse_args(argv)
+    # Shared with the processes of the pool, one listener writes all the messages
+    with multiprocessing.Manager() as logManager:
+        logQueue = setupLogging(logQueue=logManager.Queue(), **loggingOptions(args))
+        try:
+            return processBatch(args, logQueue)
+        finally:
+            stopLogging()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging, time
+import numpy as np
+
+from ctypes import c_uint, c_uint32, byref, create_string_buffer, c_bool, c_int, c_int16, c_double
+
+log = logging.getLogger(__name__)
+
+class SensorDevice():
+    def __init__(self, serialNumber=None):
+        # The driver DLL is loaded on first use, see bridge. Every device 
+        # has its own driver instance and session, so several meters 
+        # can be read at the same time from different threads.
+        self.driver = None
+        # Meter to open, the first one found when not given
+        self.serialNumber = serialNumber
+        # The session is kept open between measurements. Only the first 
+        # connection enumerates and resets the device, afterwards only 
+        # the wavelength is changed when necessary.
+        self.isConnected = False
+        self.currentWavelength = None
+        # Not all meters support measurement sequences, in that case
+        # bursts are read with the array measurement instead
+        self.sequenceMode = True
+        self.arrayModeEnabled = False
+
+    @property
+    def bridge(self):
+        if self.driver is None:
+            from TLPM import TLPM
+            self.driver = TLPM()
+        return self.driver
+
+    def disconnect(self):
+        if self.isConnected:
+            self.bridge.close()
+            self.isConnected = False
+            self.currentWavelength = None
+            self.arrayModeEnabled = False
+            log.info("Power meter disconnected")
+
+    def invalidate(self):
+        # Drops the session after a driver error, the next call
+        # to connect() will open a new one. Called while handling that 
+        # error, so it must not raise: the session may have failed to
+        # open or be dead already
+        if self.isConnected and self.driver is not None:
+            try:
+                self.driver.close()
+                log.info("Power meter session closed")
+            except NameError as err:
+                log.warning("Power meter session could not be closed: %s", err.args)
+        self.isConnected = False
+        self.currentWavelength = None
+        self.arrayModeEnabled = False
+        log.warning("Power meter session dropped")
+
+    @staticmethod
+    def findResources(bridge=None):
+        # Lists the connected meters as dictionaries with their resource 
+        # index, model, serial number, manufacturer and availability 
+        # (False when another application has a session open)
+        if bridge is None:
+            from TLPM import TLPM
+            bridge = TLPM()
+        deviceCount = c_uint32()
+        bridge.findRsrc(byref(deviceCount))
+
+        resources = []
+        for index in range(deviceCount.value):
+            modelName = create_string_buffer(256)
+            serialNumber = create_string_buffer(256)
+            manufacturer = create_string_buffer(256)
+            available = c_int16()
+            bridge.getRsrcInfo(c_int(index), modelName, serialNumber, manufacturer, byref(available))
+            resources.append({
+                'index': index,
+                'model': modelName.value.decode(errors='replace'),
+                'serialNumber': serialNumber.value.decode(errors='replace'),
+                'manufacturer': manufacturer.value.decode(errors='replace'),
+                'available': bool(available.value)
+                })
+        return resources
+
+    def resourceIndex(self):
+        # Resource index of the meter with this serial number
+        if self.serialNumber is None:
+            return 0
+        for resource in self.findResources(self.bridge):
+            if resource['serialNumber'] == self.serialNumber:
+                return resource['index']
+        raise RuntimeError(f"Power meter {self.serialNumber} not found")
+
+    def connect(self):
+        if self.isConnected:
+            return self.bridge
+
+        deviceCount = c_uint32()
+        self.bridge.findRsrc(byref(deviceCount))
+        log.info("devices found: %d", deviceCount.value)
+        if deviceCount.value<1:
+            raise RuntimeError("No power meter found")
+
+        resourceName = create_string_buffer(1024)
+        self.bridge.getRsrcName(c_int(self.resourceIndex()), resourceName)
+        self.bridge.open(resourceName, c_bool(True), c_bool(True))
+        self.isConnected = True
+        self.currentWavelength = None
+        # The reset on opening leaves the array measurement off
+        self.arrayModeEnabled = False
+        log.info("Power meter connected")
+        return self.bridge
+
+    def setWavelength(self, wavelength):
+        # Tunes the meter only if the wavelength changes
+        if wavelength != self.currentWavelength:
+            self.bridge.setWavelength(c_double(float(wavelength)))
+            self.currentWavelength = wavelength
+
+    def readPower(self):
+        # Single power readout [W]
+        power = c_double()
+        self.bridge.measPower(byref(power))
+        return power.value
+
+    def readTemperature(self):
+        temperature = c_double()
+        self.bridge.measExtNtcTemperature(byref(temperature))
+        return temperature.value
+
+    def hasThermometer(self):
+        # The driver reports a missing temperature probe as an error
+        try:
+            self.readTemperature()
+            return True
+        except NameError as err:
+            log.warning("Temperature sensor not connected: %s", err.args)
+            return False
+
+    def setAveragingTime(self, avgTime, timeout=None):
+        # Configures the averaging done by the meter itself [s] and the
+        # interface timeout [ms], by default long enough for the readout to
+        # wait for the average. Returns the previous (averaging time, 
+        # timeout) so they can be restored later
+        previous = c_double()
+        try:
+            self.bridge.getAvgTime(c_int16(0), byref(previous))
+            self.bridge.setAvgTime(c_double(avgTime))
+            previousTime = previous.value
+        except NameError as err:
+            # Older meters only accept an average count (~3000 samples/s)
+            log.warning("Average time not supported, using average count: %s", err.args)
+            previousCount = c_int16()
+            self.bridge.getAvgCnt(byref(previousCount))
+            count = min(max(int(avgTime * 3000), 1), 32767)
+            self.bridge.setAvgCnt(c_int16(count))
+            previousTime = previousCount.value / 3000
+
+        previousTimeout = c_int()
+        self.bridge.getTimeoutValue(byref(previousTimeout))
+        if timeout is None:
+            # The readout has to wait for the average, 1 s margin for the interface
+            timeout = int(avgTime * 1000) + 1000
+        self.bridge.setTimeoutValue(c_int(timeout))
+        return previousTime, previousTimeout.value
+
+    def readPowerBurst(self, count, interval):
+        # Reads 'count' power values [W] spaced 'interval' microseconds in a 
+        # single driver call. The meter captures at most 1 s per sequence. 
+        # For best results the bandwidth should be high and the autorange off.
+        powerValues = (c_double * count)()
+        if self.sequenceMode:
+            # The driver reports every error the same way, a single failure 
+            # may be transient: the sequence is retried once before falling 
+            # back to the array measurement for the rest of the session
+            for attempt in range(2):
+                try:
+                    self.bridge.getPowerMeasurementSequence(c_int(count), c_int(interval), powerValues)
+                    return np.ctypeslib.as_array(powerValues).copy()
+                except NameError as err:
+                    reason = err.args
+                    if attempt == 0:
+                        log.warning("Measurement sequence failed, retrying: %s", reason)
+            log.warning("Measurement sequences not supported, using array measurements: %s", reason)
+            self.sequenceMode = False
+
+        if not self.arrayModeEnabled:
+            self.bridge.setArrMeasurement(c_uint(1))
+            self.arrayModeEnabled = True
+
+        # The array measurement returns as many values as the meter 
+        # acquired during its averaging time, up to the buffer size
+        timestamps = (c_uint * count)()
+        valueCount = c_uint(count)
+        self.bridge.getPowerArrayMeasurement(byref(valueCount), timestamps, powerValues)
+        return np.ctypeslib.as_array(powerValues)[:valueCount.value].copy()
+
+    def disableArrayMode(self):
+        # Switches the array measurement of readPowerBurst off again, the
+        # session is kept open for jobs reading single values
+        if self.arrayModeEnabled:
+            self.bridge.setArrMeasurement(c_uint(0))
+            self.arrayModeEnabled = False
+
+class VirtualDevice():
+    def __init__(self, serialNumber='virtual'):        
+        self.bridge = self
+        self.serialNumber = serialNumber
+        self.avgSimulation = 3.5
+        self.SimSpan = 0.2
+        self.averagingTime = 0
+
+    def disconnect(self):
+        log.info("Virtual power meter disconnected")
+
+    def connect(self):
+        log.info("Virtual power meter (random number generator)")
+
+    def invalidate(self):
+        pass
+
+    def setWavelength(self, wavelength):
+        pass
+
+    def readPower(self):
+        # The simulated values are given in mW, the meter returns W
+        if self.averagingTime > 0:
+            time.sleep(self.averagingTime)
+        return np.random.normal(self.avgSimulation, self.SimSpan) / 1000
+
+    def setAveragingTime(self, avgTime, timeout=None):
+        previousTime = self.averagingTime
+        self.averagingTime = avgTime
+        return previousTime, None
+
+    def readTemperature(self):
+        return 0
+
+    def hasThermometer(self):
+        return False
+
+    def readPowerBurst(self, count, interval):
+        # Takes as long as the real capture would
+        time.sleep(count * interval / 1e6)
+        return np.random.normal(self.avgSimulation, self.SimSpan, size=count) / 1000
+
+    def disableArrayMode(self):
+        pass
+
+def openDevices(serialNumbers=None, testMode=False):
+    # One device per serial number, all the available meters when none 
+    # are given. In test mode the meters are virtual.
+    if testMode:
+        if not serialNumbers:
+            serialNumbers = ['virtual']
+        return [VirtualDevice(serialNumber) for serialNumber in serialNumbers]
+    if not serialNumbers:
+        serialNumbers = [resource['serialNumber'] for resource in SensorDevice.findResources() 
+                         if resource['available']]
+    return [SensorDevice(serialNumber) for serialNumber in serialNumbers]
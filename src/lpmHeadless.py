@@ -0,0 +1,269 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import logging, os, sys
+from datetime import datetime
+import numpy as np
+
+from acquisitionEngine import WindowAverager, StandardAcquisition, SynchronizedAcquisition, SampleBuffer
+from fileInterface import TSVAccess, LightSourceFiles, BinaryDataFile
+from lpmDevices import SensorDevice, openDevices
+from lpmLogging import addLoggingArguments, loggingOptions, setupLogging
+from lpmParser import DataSignature, PulseAssignment, SignatureAlignment, ThresholdEstimator, DataObject
+
+log = logging.getLogger(__name__)
+
+class HeadlessRun():
+    # Runs an experiment without the GUI: acquisition with the settings of
+    # a recipe file (a process file as saved by SmartLPM), reassignment 
+    # of the readouts to the pulses of the signature and saving of the raw 
+    # and sorted data. Neither Qt nor matplotlib are imported, so it can 
+    # be started from a scheduler or a microscope macro.
+
+    fieldNames = [
+        "wavelengths",
+        "setPowers",
+        "duration",
+        "measurementInterval",
+        "averageInterval",
+        "readoutInterval",            
+        "signaturePause",
+        "order",
+        "dataSavePath",
+        "lightSourceModel",
+        "lightSourceIdentifier"]
+
+    def __init__(self, recipeFile, testMode=False, averaging='software'):
+        self.recipeFile = recipeFile
+        self.testMode = testMode
+        self.averaging = averaging
+        # Sorting needs a detection threshold [mW], without it 
+        # only the raw data is saved. With autoThreshold it is 
+        # estimated from the data of every meter
+        self.threshold = None
+        self.autoThreshold = False
+        # Pulses labelled by their aligned position in the signature
+        # instead of counting them
+        self.alignToSignature = False
+        self.splitByPower = False
+        # Meter wavelength and power setting written with the data, 
+        # by default the first ones of the recipe
+        self.refWavelength = None
+        self.setPower = None
+        self.calibrationFactors = []
+        self.binaryData = False
+        self.pointers = None
+        # Meters to read at the same time, by serial number. One 
+        # file set is saved per meter, labelled with its serial number.
+        self.serialNumbers = None
+        self.deviceLabel = ''
+        self.loadRecipe()
+
+    def loadRecipe(self):
+        parameterValues = TSVAccess.fieldValuesFromTSV(self.fieldNames, self.recipeFile)
+        for name, value in zip(self.fieldNames, parameterValues):
+            setattr(self, name, value)
+
+        self.wavelengths = [int(float(value)) for value in DataSignature.stringOrList2Array(self.wavelengths)]
+        self.setPowers = [int(float(value)) for value in DataSignature.stringOrList2Array(self.setPowers)]
+
+        self.signature = DataSignature()
+        self.signature.setParameters(
+            self.wavelengths, self.setPowers, 
+            self.measurementInterval, self.readoutInterval, 
+            self.duration, self.signaturePause, self.order
+            )
+        self.signature.calculateSignature()
+
+    def acquire(self):
+        # Without serial numbers the first meter found is used
+        if self.serialNumbers or self.testMode:
+            sensors = openDevices(self.serialNumbers, self.testMode)
+        else:
+            sensors = [SensorDevice()]
+
+        if self.refWavelength is None:
+            self.refWavelength = self.wavelengths[0]
+        if self.setPower is None:
+            self.setPower = self.setPowers[0]
+
+        os.makedirs(self.dataSavePath, exist_ok=True)
+        basefilename = datetime.now().strftime("%Y%m%d-%H%M_")
+        if self.binaryData:
+            extension = BinaryDataFile.extension
+        else:
+            extension = '.txt'
+
+        metadata = {name: getattr(self, name) for name in self.fieldNames}
+        metadata['refWavelength'] = self.refWavelength
+        acquisitions = []
+        self.devices = []
+        for sensor in sensors:
+            label = ''
+            if len(sensors) > 1:
+                label = str(sensor.serialNumber) + '_'
+            dataFileName = os.path.join(self.dataSavePath, basefilename + label + '-blindMode' + extension)
+            acquisition = StandardAcquisition(
+                sensor, WindowAverager(sensor, self.averaging), self.refWavelength, self.setPower, 
+                dataFileName, self.duration, self.readoutInterval)
+            acquisition.metadata = dict(metadata, serialNumber=sensor.serialNumber)
+            acquisitions.append(acquisition)
+            self.devices.append((label, dataFileName))
+
+        try:
+            if len(acquisitions) == 1:
+                sampleSets = [acquisitions[0].run()]
+            else:
+                sampleSets = SynchronizedAcquisition(acquisitions).run()
+        finally:
+            for sensor in sensors:
+                sensor.disconnect()
+
+        self.devices = [(label, dataFileName, samples) 
+                        for (label, dataFileName), samples in zip(self.devices, sampleSets)]
+        self.deviceLabel, self.dataFileName, self.samples = self.devices[0]
+        return self.dataFileName
+
+    def loadDataFile(self, dataFileName):
+        # Instead of acquire(): sorts a raw file saved before (text or 
+        # binary). The readouts are placed on the grid of the recipe
+        data = DataObject()
+        data.setFile(dataFileName)
+        data.loadDataByTag()
+        power = np.asarray(data.measuredPower, dtype=float)
+        times = np.arange(len(power)) * float(self.readoutInterval)
+        self.samples = SampleBuffer.fromArrays(times, power)
+        self.dataFileName = dataFileName
+        self.devices = [(self.deviceLabel, dataFileName, self.samples)]
+        return self.samples
+
+    def reassignData(self):
+        power = self.samples.powers()
+        if self.autoThreshold:
+            self.threshold = ThresholdEstimator.estimate(power)
+            if self.threshold is None:
+                # Only the raw data is saved
+                log.warning("No threshold found, the pulses do not stand out from the dark readouts")
+                self.pointers = None
+                return
+            log.info("Estimated threshold: %.4g mW", self.threshold)
+        if self.alignToSignature:
+            alignment = SignatureAlignment(self.signature)
+            self.pointers = alignment.pointers(power, self.threshold)
+            log.info("Signature aligned with a lag of %.1f readouts, scale %.5f", alignment.lag, alignment.scale)
+        else:
+            self.pointers = PulseAssignment.pointers(
+                power, self.threshold, 
+                self.signature.wavelengthCount, self.signature.powerSettingCount, self.order)
+        log.info("%d of %d points assigned", np.sum(~np.isnan(self.pointers[:, 0])), len(power))
+
+    def saveDataFile(self):
+        savePath = self.dataSavePath
+        filename0 = datetime.now().strftime("%Y%m%d-%H%M_") + self.deviceLabel
+        outputPathRawData = os.path.join(savePath, filename0 + 'raw.txt')
+
+        outputPathsFilteredData = {}
+        if self.pointers is not None:
+            finalSavePath = LightSourceFiles.folder(
+                savePath, self.lightSourceModel, self.lightSourceIdentifier)
+            LightSourceFiles.saveInfoFile(finalSavePath, filename0, self)
+            outputPathsFilteredData = LightSourceFiles.filePaths(
+                finalSavePath, filename0, self.wavelengths, self.setPowers, 
+                self.order, self.duration, self.splitByPower)
+            pointers = self.pointers
+        else:
+            pointers = np.empty((0, 2))
+
+        LightSourceFiles.split(
+            self.dataFileName, outputPathRawData, outputPathsFilteredData, pointers, 
+            self.splitByPower, self.threshold, self.wavelengths, self.setPowers)
+        return outputPathRawData
+
+    def run(self):
+        self.acquire()
+        for self.deviceLabel, self.dataFileName, self.samples in self.devices:
+            if self.threshold is not None or self.autoThreshold:
+                self.reassignData()
+            else:
+                log.info("No threshold given, the data is not sorted")
+            self.saveDataFile()
+            self.samples.release()
+
+def thresholdArgument(value):
+    # A threshold [mW] or 'auto'
+    if value == 'auto':
+        return value
+    try:
+        return float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid threshold '{value}', a power [mW] or 'auto'")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Runs a SmartLPM experiment from a recipe file, without the GUI.")
+    parser.add_argument("recipe", nargs='?', help="process file (.tsv) with the experiment settings")
+    parser.add_argument("--test", action="store_true", help="use the virtual power meter")
+    parser.add_argument("--averaging", choices=WindowAverager.strategies, default='software',
+                        help="how the meter is read within each readout interval")
+    parser.add_argument("--threshold", type=thresholdArgument, 
+                        help="detection threshold [mW] to sort the readouts by pulse, "
+                             "'auto' to estimate it from the data")
+    parser.add_argument("--align", action="store_true", 
+                        help="label the pulses by their position in the signature instead of counting them")
+    parser.add_argument("--wavelength", type=int, help="meter wavelength [nm]")
+    parser.add_argument("--power", type=int, help="power setting [%%] written with the data")
+    parser.add_argument("--split-by-power", action="store_true", 
+                        help="one sorted file per wavelength and power setting")
+    parser.add_argument("--output", help="data folder, instead of the one in the recipe")
+    parser.add_argument("--binary", action="store_true", 
+                        help="save the acquired data as binary records (*.lpmb)")
+    parser.add_argument("--serial", action="append", dest="serialNumbers", 
+                        help="serial number of a meter to read, repeat it to read several at once")
+    parser.add_argument("--list-devices", action="store_true", help="list the connected meters and exit")
+    addLoggingArguments(parser)
+    args = parser.parse_args(argv)
+    setupLogging(**loggingOptions(args))
+
+    if args.list_devices:
+        for resource in SensorDevice.findResources():
+            state = "available" if resource['available'] else "in use"
+            print(f"{resource['serialNumber']}\t{resource['model']}\t{resource['manufacturer']}\t{state}")
+        return 0
+    if args.recipe is None:
+        parser.error("a recipe file is required")
+
+    try:
+        run = HeadlessRun(args.recipe, args.test, args.averaging)
+        if args.threshold == 'auto':
+            run.autoThreshold = True
+        else:
+            run.threshold = args.threshold
+        run.alignToSignature = args.align
+        run.refWavelength = args.wavelength
+        run.setPower = args.power
+        run.splitByPower = args.split_by_power
+        run.binaryData = args.binary
+        run.serialNumbers = args.serialNumbers
+        if args.output:
+            run.dataSavePath = args.output
+        run.run()
+    except Exception as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,150 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import os, sys
+import numpy as np
+
+from lpmBatch import findRawFiles
+from lpmHeadless import HeadlessRun, thresholdArgument
+from lpmLogging import addLoggingArguments, loggingOptions, setupLogging
+from lpmParser import DataObject, DataSignature, SignatureInference
+
+# Proposes the signature (pulse length, wavelength and power setting 
+# counts and order) of raw files saved without their recipe, and can 
+# write it as a process file, to sort the files with lpmBatch.
+
+def loadTrace(dataFileName):
+    # Measured powers and readout interval [s] of a raw file
+    data = DataObject()
+    data.setFile(dataFileName)
+    data.loadDataByTag()
+    power = np.asarray(data.measuredPower, dtype=float)
+    timestamps = np.array(data.timeStamp, dtype='datetime64[us]')
+    intervals = np.diff(timestamps) / np.timedelta64(1, 's')
+    readoutInterval = float(np.median(intervals)) if intervals.size else None
+    return power, readoutInterval
+
+def recipeValues(result, readoutInterval, readoutCount, wavelengths=None, setPowers=None):
+    # Process file fields that reproduce a proposed signature. Without the
+    # real wavelengths and power settings they are numbered from 1
+    wavelengthCount, powerSettingCount = result['wavelengthCount'], result['powerSettingCount']
+    if not wavelengths or len(wavelengths) != wavelengthCount:
+        wavelengths = list(range(1, wavelengthCount + 1))
+    if not setPowers or len(setPowers) != powerSettingCount:
+        setPowers = list(range(1, powerSettingCount + 1))
+    # Interval and pause rounded to ms, the signature works on seconds
+    readoutInterval = round(readoutInterval, 3)
+    signaturePause = round(result['pauseLength'] * readoutInterval, 3)
+    pulsePeriod = round((result['pulseLength'] + result['pauseLength']) * readoutInterval, 3)
+    return {
+        "wavelengths": wavelengths,
+        "setPowers": setPowers,
+        "duration": round((readoutCount - 1) * readoutInterval + signaturePause, 3),
+        "measurementInterval": round(wavelengthCount * powerSettingCount * pulsePeriod, 3),
+        "averageInterval": readoutInterval,
+        "readoutInterval": readoutInterval,
+        "signaturePause": signaturePause,
+        "order": result['order'],
+        "dataSavePath": "",
+        "lightSourceModel": "unknown",
+        "lightSourceIdentifier": "inferred"}
+
+def checkRecipe(values):
+    # Signature string of the recipe, as calculated by SmartLPM
+    signature = DataSignature()
+    signature.setParameters(
+        values["wavelengths"], values["setPowers"], values["measurementInterval"], 
+        values["readoutInterval"], values["duration"], values["signaturePause"], values["order"])
+    signature.calculateSignature()
+    return signature.signatureString
+
+def writeRecipe(fileName, values):
+    # Same layout as the process files saved by SmartLPM
+    with open(fileName, 'w') as fout:
+        fout.write('Process:\n')
+        for name in HeadlessRun.fieldNames:
+            fout.write(name + '\t' + str(values[name]) + '\n')
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Proposes the signature of raw SmartLPM data files recorded without a recipe.")
+    parser.add_argument("inputs", nargs='+',
+                        help="raw data files, glob patterns or folders (their *-blindMode files)")
+    parser.add_argument("--threshold", type=thresholdArgument, default='auto',
+                        help="detection threshold [mW], estimated from the data by default")
+    parser.add_argument("--wavelength-count", type=int, help="number of wavelengths, if known")
+    parser.add_argument("--power-count", type=int, help="number of power settings, if known")
+    parser.add_argument("--order", choices=['LP', 'PL'], help="order of the signature, if known")
+    parser.add_argument("--candidates", type=int, default=3, help="number of proposals listed per file")
+    parser.add_argument("--max-block", type=int, default=64, 
+                        help="largest number of pulses (wavelengths x power settings) in a block")
+    parser.add_argument("--workers", type=int, help="number of threads scoring the proposals")
+    parser.add_argument("--write-recipe", metavar="FOLDER",
+                        help="write the best proposal of every file as a process file (<file>-inferred.tsv)")
+    parser.add_argument("--wavelengths", type=int, nargs='+', help="wavelengths [nm] for the process files")
+    parser.add_argument("--set-powers", type=int, nargs='+', help="power settings [%%] for the process files")
+    addLoggingArguments(parser)
+    args = parser.parse_args(argv)
+    setupLogging(**loggingOptions(args))
+
+    fileNames = findRawFiles(args.inputs)
+    if not fileNames:
+        print("No raw data files found", file=sys.stderr)
+        return 1
+
+    inference = SignatureInference(args.max_block, workers=args.workers)
+    threshold = None if args.threshold == 'auto' else args.threshold
+    errors = 0
+    for dataFileName in fileNames:
+        print(dataFileName)
+        try:
+            power, readoutInterval = loadTrace(dataFileName)
+            results = inference.infer(power, threshold, args.candidates, 
+                                      args.wavelength_count, args.power_count, args.order)
+        except Exception as e:
+            print(f"    Error: {e}")
+            errors += 1
+            continue
+        if not results:
+            print("    No pulses found")
+            errors += 1
+            continue
+
+        best = results[0]
+        print(f"    {best['pulseCount']} pulses of {best['pulseLength']} readouts, pauses of "
+              f"{best['pauseLength']}, threshold {best['threshold']:.4g} mW")
+        for rank, result in enumerate(results, 1):
+            # LP and PL blocks with the counts swapped cannot be told apart
+            # by their levels alone
+            tie = "  (same score as above)" if rank > 1 and result['score'] == results[rank - 2]['score'] else ""
+            print(f"    {rank}. {result['signature']}\t{result['order']}\t{result['wavelengthCount']} wavelengths\t"
+                  f"{result['powerSettingCount']} power settings\tscore {result['score']:.1f}\t"
+                  f"deviation {100 * (10**result['deviation'] - 1):.2f} %{tie}")
+
+        if args.write_recipe and readoutInterval:
+            values = recipeValues(best, readoutInterval, power.size, args.wavelengths, args.set_powers)
+            values["dataSavePath"] = args.write_recipe
+            os.makedirs(args.write_recipe, exist_ok=True)
+            recipeFile = os.path.join(args.write_recipe, 
+                                      os.path.splitext(os.path.basename(dataFileName))[0] + '-inferred.tsv')
+            writeRecipe(recipeFile, values)
+            signatureString = checkRecipe(values)
+            note = "" if signatureString == best['signature'] else f", its signature is {signatureString}"
+            print(f"    process file: {recipeFile}{note}")
+    return 0 if errors == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
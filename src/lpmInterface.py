@@ -13,57 +13,21 @@ This program is free software: you can redistribute it and/or modify
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import os, csv, time
+import os, csv, logging, time
 import numpy as np
-from TLPM import TLPM
 from timeit import default_timer as timer
 from datetime import datetime, timedelta
 import xml.etree.ElementTree as ET
 
 from PySide6.QtCore import QThread, QObject, Signal, Slot, QEventLoop
 
-from ctypes import c_long, c_ulong, c_uint32, byref, create_string_buffer, c_bool, c_char_p, c_int, c_int16, \
-    c_double
-
 from automationThreads import MeasurementManager
+# The devices do not depend on Qt, they are kept in their own module
+from lpmDevices import SensorDevice, VirtualDevice
 
-import time
 import sys
 
-class SensorDevice():
-    def __init__(self):
-        self.bridge = TLPM()
-
-    def disconnect(self):
-        self.bridge.close()
-        print("Power meter disconnected")
-
-    def connect(self):
-        deviceCount = c_uint32()
-        self.bridge.findRsrc(byref(deviceCount))
-        print("devices found: " + str(deviceCount.value))
-        if deviceCount.value<1:
-            print("thorlabs power meter not found")
-            exit(-1)
-
-        resourceName = create_string_buffer(1024)
-        self.bridge.getRsrcName(c_int(0), resourceName)
-        self.bridge.open(resourceName, c_bool(True), c_bool(True))
-        print('\nPower meter connected\n')
-        return self.bridge
-   
-class VirtualDevice():
-    def __init__(self):        
-        self.bridge = self
-        self.avgSimulation = 3.5
-        self.SimSpan = 0.2
-
-    def disconnect(self):
-        print("Power meter disconnected")
-
-    def connect(self):
-        deviceCount = 1
-        print("Virtual power meter (random number generator)")
+log = logging.getLogger(__name__)
 
 class PowerMeter(QObject):
     
@@ -85,20 +49,20 @@ class PowerMeter(QObject):
         avg   = np.mean(self.powerCalibrationPts)
         noise = np.std(self.powerCalibrationPts)
 
-        print("Average: ",avg,"std: ",noise)
+        log.info("Average: %s, std: %s", avg, noise)
         self.averageSeries.append(avg)
         self.noiseSeries.append(noise)
         if any(value > 0.01 for value in self.noiseSeries):
-            print("The data is too noisy to use it as a calibration source")
+            log.warning("The data is too noisy to use it as a calibration source")
         else:
             self.calibrationTable = self.calibrate(self.wavelengthSeries, self.averageSeries, self.referenceWavelength)
-            print("Calibration table measuring at ",self.referenceWavelength, " mn")
-            print("wavelengths: ",self.wavelengthSeries)
-            print("Correction factors, returnStats: ", self.calibrationTable)
+            log.info("Calibration table measuring at %s nm", self.referenceWavelength)
+            log.info("wavelengths: %s", self.wavelengthSeries)
+            log.info("Correction factors: %s", self.calibrationTable)
             self.isCalibrated = True
             self.calibrationReady.emit(self.calibrationTable)
     
-    def runCalibrationLoop(self, wavelengthSeries, referenceWavelength, runningMode):
+    def runCalibrationLoop(self, wavelengthSeries, referenceWavelength, runningMode, averaging='software'):
         # We request a short series of measurements or the same source,
         # setting configuring the power meter to different wavelengths
         # The reference Wavelength shoud correspond to the actual wavelength.
@@ -123,13 +87,13 @@ class PowerMeter(QObject):
         mode = runningMode + '-calibration'
         if self.referenceWavelength in self.wavelengthSeries:
             for wavelength in self.wavelengthSeries:
-                manager.add_measurement(wavelength, setpower, 'calibration.csv', duration, avgTime, mode)
+                manager.add_measurement(wavelength, setpower, 'calibration.csv', duration, avgTime, mode, averaging)
             manager.start_measurements()
             # Wait until the test peasurements are done
             eventLoop.exec()
 
         else:
-            print("Cannot proceed. \nOne of the set wavelengths must correspond to the source")
+            log.error("Cannot proceed, one of the set wavelengths must correspond to the source")
 
 
 
@@ -147,9 +111,7 @@ class PowerMeter(QObject):
 
         lLambda = len(lambdaSeries)
 
-        print('refLambda: ',refLambda)
-        print('lambdaSeries: ',lambdaSeries)
-        print('powerSeries: ',powerSeries)
+        log.debug("reference wavelength %s, wavelengths %s, powers %s", refLambda, lambdaSeries, powerSeries)
 
         if len(powerSeries) == lLambda:
             self.calibrationTable = []
@@ -162,10 +124,10 @@ class PowerMeter(QObject):
                         self.calibrationTable[wavelengthInd]= powerSeries[wavelengthInd]/referencePower
                 return self.calibrationTable
             except ValueError:
-                print("Could not calibrate. \nYour data does not contain the reference wavelength")
+                log.error("Could not calibrate, the data does not contain the reference wavelength")
                 return []
         else:
-            print("Error: inconsistent input data")
+            log.error("Could not calibrate, inconsistent input data")
             return []
 
 def main():
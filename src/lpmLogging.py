@@ -0,0 +1,197 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+import atexit, logging, logging.handlers, os, queue, sys, threading, time
+
+# Logging of all the modules. Each module logs to logging.getLogger(__name__);
+# the records go through a queue to a listener thread that writes them to 
+# the console and to a rotating file, so neither the sampling loop nor the 
+# parsing ever waits for console I/O. By default only warnings and errors 
+# are shown, the log file also keeps the INFO messages. Levels are set per 
+# module, e.g. with the environment variable (a bare level is for all)
+#   SMARTLPM_LOG=INFO,lpmParser=DEBUG,automationThreads=DEBUG
+# or with the --log-level/--log-module/--log-file options of the command 
+# line tools. Per sample messages are DEBUG and rate limited.
+
+logFormat = "%(asctime)s %(levelname)-7s %(processName)s %(name)s: %(message)s"
+consoleFormat = "%(levelname)s %(name)s: %(message)s"
+levelVariable = 'SMARTLPM_LOG'
+
+class RateLimitFilter(logging.Filter):
+    # Lets through at most 'burst' records per call site in every 'interval' 
+    # seconds. Per sample and per row messages are thus cheap to leave in the 
+    # loops: the rest of the records of a call site are dropped before they 
+    # are formatted and the next record let through tells how many there were.
+    # Warnings and errors are never dropped.
+
+    def __init__(self, interval=1.0, burst=5):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.sites = {}
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            windowStart, count, suppressed = self.sites.get(key, (now, 0, 0))
+            if now - windowStart >= self.interval:
+                windowStart, count = now, 0
+            if count >= self.burst:
+                self.sites[key] = (windowStart, count, suppressed + 1)
+                return False
+            self.sites[key] = (windowStart, count + 1, 0)
+        if suppressed:
+            record.msg = f"{record.msg} ({suppressed} similar messages suppressed)"
+        return True
+
+def parseLevel(level):
+    # 'debug', 'DEBUG' or 10 -> 10
+    if isinstance(level, int):
+        return level
+    value = logging.getLevelName(str(level).upper())
+    if not isinstance(value, int):
+        raise ValueError(f"unknown log level '{level}'")
+    return value
+
+def parseModuleLevels(text):
+    # 'INFO,lpmParser=DEBUG' -> {'': 20, 'lpmParser': 10}, '' is the root logger
+    moduleLevels = {}
+    for item in text.replace(';', ',').split(','):
+        if item.strip():
+            name, separator, level = item.rpartition('=')
+            moduleLevels[name.strip()] = parseLevel(level.strip())
+    return moduleLevels
+
+def defaultLogFile():
+    # Next to the configuration of SmartLPM under Windows, none elsewhere
+    programData = os.environ.get('PROGRAMDATA')
+    if programData is None:
+        return None
+    return os.path.join(programData, 'SmartLPM', 'Logs', 'SmartLPM.log')
+
+class LevelFilter(logging.Filter):
+    # Level of the closest module given in moduleLevels, 'level' for the rest
+
+    def __init__(self, level, moduleLevels):
+        super().__init__()
+        self.level = level
+        self.moduleLevels = moduleLevels
+
+    def filter(self, record):
+        name = record.name
+        while name:
+            if name in self.moduleLevels:
+                return record.levelno >= self.moduleLevels[name]
+            name = name.rpartition('.')[0]
+        return record.levelno >= self.level
+
+_listener = None
+_handler = None
+# Logger levels, for attachToQueue in the processes of a pool
+_levels = {}
+
+def setupLogging(level='WARNING', logFile=None, moduleLevels=None, console=True, fileLevel='INFO',
+                 maxBytes=5 << 20, backupCount=3, rateInterval=1.0, rateBurst=5, logQueue=None):
+    # Installs the queue on the root logger and starts the listener. Calling
+    # it again replaces the previous setup. logQueue can be a queue shared
+    # with other processes (see attachToQueue), a private one by default.
+    # Returns the queue.
+    global _listener, _handler, _levels
+    stopLogging()
+
+    levels = dict(moduleLevels or {})
+    levels.update(parseModuleLevels(os.environ.get(levelVariable, '')))
+    level = parseLevel(levels.pop('', level))
+    fileLevel = min(level, parseLevel(fileLevel)) if logFile else level
+
+    handlers = []
+    if console:
+        consoleHandler = logging.StreamHandler(sys.stderr)
+        consoleHandler.setFormatter(logging.Formatter(consoleFormat))
+        consoleHandler.addFilter(LevelFilter(level, levels))
+        handlers.append(consoleHandler)
+    if logFile:
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(logFile)), exist_ok=True)
+            fileHandler = logging.handlers.RotatingFileHandler(
+                logFile, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8')
+            fileHandler.setFormatter(logging.Formatter(logFormat))
+            fileHandler.addFilter(LevelFilter(fileLevel, levels))
+            handlers.append(fileHandler)
+        except OSError as e:
+            print(f"Cannot write the log file {logFile}: {e}", file=sys.stderr)
+            fileLevel = level
+
+    # Records below these levels are not even created
+    _levels = dict(levels)
+    _levels[''] = fileLevel
+    for name, moduleLevel in _levels.items():
+        logging.getLogger(name).setLevel(moduleLevel)
+
+    if logQueue is None:
+        logQueue = queue.SimpleQueue()
+    _handler = logging.handlers.QueueHandler(logQueue)
+    _handler.addFilter(RateLimitFilter(rateInterval, rateBurst))
+    logging.getLogger().addHandler(_handler)
+    _listener = logging.handlers.QueueListener(logQueue, *handlers)
+    _listener.start()
+    return logQueue
+
+def loggerLevels():
+    # Levels of the loggers set up by setupLogging, '' is the root logger
+    return dict(_levels)
+
+def attachToQueue(logQueue, levels, rateInterval=1.0, rateBurst=5):
+    # For the processes of a pool: their records go to the queue of the 
+    # listener of the parent process (a multiprocessing queue), with the
+    # logger levels of the parent (loggerLevels)
+    global _handler
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for name, level in levels.items():
+        logging.getLogger(name).setLevel(level)
+    _handler = logging.handlers.QueueHandler(logQueue)
+    _handler.addFilter(RateLimitFilter(rateInterval, rateBurst))
+    root.addHandler(_handler)
+
+def stopLogging():
+    # Writes the records still in the queue
+    global _listener, _handler
+    if _handler is not None:
+        logging.getLogger().removeHandler(_handler)
+        _handler = None
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stopLogging)
+
+def addLoggingArguments(parser):
+    parser.add_argument("--log-level", default='WARNING', type=parseLevel,
+                        help="level of the messages shown and logged (DEBUG, INFO, WARNING, ERROR), WARNING by default")
+    parser.add_argument("--log-module", action="append", default=[], metavar="MODULE=LEVEL",
+                        help="level of the messages of one module, e.g. lpmParser=DEBUG (repeatable)")
+    parser.add_argument("--log-file", help="rotating log file, none by default")
+
+def loggingOptions(args):
+    # setupLogging keywords from the parsed arguments
+    return {'level': args.log_level, 'logFile': args.log_file,
+            'moduleLevels': parseModuleLevels(','.join(args.log_module))}
@@ -13,9 +13,980 @@ This program is free software: you can redistribute it and/or modify
     along with this program.  If not, see <https://www.gnu.org/licenses/>.
 """
 
-import csv, sys, os
+import csv, logging, math, sys, os
+from functools import lru_cache
 import numpy as np
 
+from colorhandling import ColorHandler
+
+log = logging.getLogger(__name__)
+
+class PulseAssignment():
+    # Vectorized pulse detection and labelling. Points above the threshold
+    # belong to illumination pulses, the rest to the dark pauses. Pulses 
+    # are numbered in order of appearance and the pulse number gives the 
+    # wavelength and power setting indices following the signature order:
+    #   'LP': power settings change first, then wavelengths
+    #   'PL': wavelengths change first, then power settings
+
+    @staticmethod
+    def pulseIndices(power, threshold):
+        # Returns the pulse number of each point, -1 for dark points.
+        # As with applyThreshold, values below the threshold and 
+        # values that are not positive are dark
+        power = np.asarray(power, dtype=float)
+        lit = (power >= threshold) & (power > 0)
+        starts = lit.copy()
+        starts[1:] &= ~lit[:-1]
+        return np.where(lit, np.cumsum(starts) - 1, -1)
+
+    @staticmethod
+    def pulseLabels(pulses, wavelengthCount, powerSettingCount, order):
+        # Wavelength and power setting indices for each pulse number
+        pulses = np.asarray(pulses)
+        if order == 'PL':
+            indL = pulses % wavelengthCount
+            indP = (pulses // wavelengthCount) % powerSettingCount
+        elif order == 'LP':
+            indP = pulses % powerSettingCount
+            indL = (pulses // powerSettingCount) % wavelengthCount
+        else:
+            raise ValueError(f"Unknown order '{order}'")
+        return indL, indP
+
+    @staticmethod
+    def pointers(power, threshold, wavelengthCount, powerSettingCount, order):
+        # Wavelength and power setting index of each point, NaN for dark points
+        pulses = PulseAssignment.pulseIndices(power, threshold)
+        points = np.flatnonzero(pulses >= 0)
+        indL, indP = PulseAssignment.pulseLabels(
+            pulses[points], wavelengthCount, powerSettingCount, order)
+        pointers = np.full((len(pulses), 2), np.nan)
+        pointers[points, 0] = indL
+        pointers[points, 1] = indP
+        return pointers
+
+    @staticmethod
+    def transitionPoints(pointers):
+        # Readouts at either end of a pulse. Due to averaging they are still
+        # above threshold but far below the real power values. Returns two 
+        # masks: labelled points (valid wavelength and power indices) and 
+        # transition points, those whose indices differ from the previous 
+        # labelled point or from the next point, dark points included.
+        # The last point is only compared with the previous one
+        wavelengthInd = pointers[:, 0]
+        powerInd = pointers[:, 1]
+        labelled = ~np.isnan(wavelengthInd) & ~np.isnan(powerInd)
+
+        transition = np.zeros(len(pointers), dtype=bool)
+        # NaN never compares equal, a dark point next makes a transition
+        transition[:-1] = ((wavelengthInd[:-1] != wavelengthInd[1:]) | 
+                           (powerInd[:-1] != powerInd[1:]))
+
+        points = np.flatnonzero(labelled)
+        changed = np.ones(points.size, dtype=bool)
+        changed[1:] = ((wavelengthInd[points[1:]] != wavelengthInd[points[:-1]]) | 
+                       (powerInd[points[1:]] != powerInd[points[:-1]]))
+        transition[points] |= changed
+        return labelled, transition & labelled
+
+class PulseTracker():
+    # Pulse numbers of a growing power trace (live acquisition), with the
+    # same rules as PulseAssignment. Points are appended one at a time. 
+    # When the threshold moves, a sorted view of the trace gives the points
+    # that change state; only the pulse starts next to them are updated and 
+    # the pulse numbers are recomputed from the first change on. Callers 
+    # get that index back and only need to rewrite their data from there.
+
+    def __init__(self, wavelengthCount, powerSettingCount, order, threshold=0, capacity=1024):
+        self.wavelengthCount = wavelengthCount
+        self.powerSettingCount = powerSettingCount
+        self.order = order
+        self.threshold = threshold
+
+        self.count = 0
+        self.pulseCount = 0
+        self.power  = np.zeros(capacity)
+        self.lit    = np.zeros(capacity, dtype=bool)
+        self.starts = np.zeros(capacity, dtype=bool)
+        self.pulses = np.full(capacity, -1, dtype=np.int64)
+
+        # Sorted view of the first sortedCount points
+        self.sortedIndices = np.zeros(0, dtype=np.int64)
+        self.sortedPower = np.zeros(0)
+
+    def grow(self):
+        capacity = 2 * len(self.power)
+        for name, fill in [('power', 0), ('lit', False), ('starts', False), ('pulses', -1)]:
+            old = getattr(self, name)
+            new = np.full(capacity, fill, dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def isLit(self, power):
+        return (power >= self.threshold) & (power > 0)
+
+    def append(self, value):
+        # Returns the pulse number of the new point (-1 if dark)
+        if self.count == len(self.power):
+            self.grow()
+        point = self.count
+        lit = bool(self.isLit(value))
+        start = lit and (point == 0 or not self.lit[point - 1])
+
+        self.power[point] = value
+        self.lit[point] = lit
+        self.starts[point] = start
+        if start:
+            self.pulseCount += 1
+        self.pulses[point] = self.pulseCount - 1 if lit else -1
+        self.count += 1
+        return self.pulses[point]
+
+    def updateSortedView(self):
+        # Merges the points appended since the last threshold change
+        sortedCount = len(self.sortedIndices)
+        if sortedCount < self.count:
+            newIndices = np.arange(sortedCount, self.count)
+            indices = np.concatenate((self.sortedIndices, newIndices[np.argsort(self.power[newIndices], kind='stable')]))
+            # Two sorted runs, the stable sort merges them in linear time
+            order = np.argsort(self.power[indices], kind='stable')
+            self.sortedIndices = indices[order]
+            self.sortedPower = self.power[self.sortedIndices]
+
+    def setThreshold(self, threshold):
+        # Returns the first point whose pulse number may have changed
+        # (count if nothing changed)
+        previous = self.threshold
+        self.threshold = threshold
+        if threshold == previous or self.count == 0:
+            return self.count
+
+        self.updateSortedView()
+        low, high = min(previous, threshold), max(previous, threshold)
+        first = np.searchsorted(self.sortedPower, low, side='left')
+        last  = np.searchsorted(self.sortedPower, high, side='left')
+        flipped = self.sortedIndices[first:last]
+        flipped = flipped[self.power[flipped] > 0]
+        if flipped.size == 0:
+            return self.count
+
+        self.lit[flipped] = self.isLit(self.power[flipped])
+
+        # A point decides whether it and the following one start a pulse
+        affected = np.unique(np.concatenate((flipped, flipped + 1)))
+        affected = affected[affected < self.count]
+        previousLit = np.where(affected > 0, self.lit[np.maximum(affected - 1, 0)], False)
+        self.starts[affected] = self.lit[affected] & ~previousLit
+
+        firstChanged = int(affected[0])
+        before = np.count_nonzero(self.starts[:firstChanged])
+        numbers = before + np.cumsum(self.starts[firstChanged:self.count]) - 1
+        self.pulses[firstChanged:self.count] = np.where(self.lit[firstChanged:self.count], numbers, -1)
+        self.pulseCount = before + np.count_nonzero(self.starts[firstChanged:self.count])
+        return firstChanged
+
+    def labels(self, first, last):
+        # Points within [first, last) that belong to pulses and
+        # their wavelength and power setting indices
+        points = first + np.flatnonzero(self.pulses[first:last] >= 0)
+        indL, indP = PulseAssignment.pulseLabels(
+            self.pulses[points], self.wavelengthCount, self.powerSettingCount, self.order)
+        return points, indL, indP
+
+class SignatureAlignment():
+    # Labels the pulses of a trace by their position in the signature, 
+    # instead of counting them. The lit readouts of the trace (+1, dark -1)
+    # are cross-correlated with the signature, through FFTs, for the time
+    # scales within maxDrift of 1. The best lag and scale are then refined
+    # by a fit of the pulse edges of the trace to those of the signature. 
+    # Every pulse of the trace takes the labels of the signature pulse it
+    # overlaps most, so a missed or spurious pulse, or a pulse split in 
+    # two, does not shift the labels of the following ones. Pulses that do
+    # not overlap any signature pulse stay unlabelled.
+
+    # Largest number of blocks correlated at once, longer traces are 
+    # averaged in blocks first (as long as the blocks are shorter than 
+    # a quarter of the pulse period)
+    coarseSize = 1 << 14
+
+    def __init__(self, signature, maxDrift=0.001):
+        # signature: a DataSignature with its pulses calculated. 
+        # maxDrift: largest relative difference between the readout 
+        # intervals of the trace and the signature
+        self.pulses = signature.pulses
+        self.readoutCount = signature.readoutCount
+        self.maxDrift = maxDrift
+        # Trace readout n is signature readout (n - lag) * scale
+        self.lag = 0.0
+        self.scale = 1.0
+        self.score = 0.0
+
+    def coverage(self, positions):
+        # Lit readouts of the signature before each position
+        edges = np.stack((self.pulses['start'], self.pulses['start'] + self.pulses['length']), axis=1).ravel()
+        litBefore = np.zeros(edges.size)
+        litBefore[1::2] = self.pulses['length']
+        litBefore = np.cumsum(litBefore)
+        return np.interp(positions, edges, litBefore)
+
+    def template(self, scale, factor):
+        # Mean of the lit (+1) and dark (-1) readouts of the signature in
+        # blocks of 'factor' readouts of a trace whose readouts are 'scale'
+        # signature readouts apart
+        size = -(-int(np.ceil(self.readoutCount / scale)) // factor)
+        bounds = np.minimum(np.arange(size + 1) * factor * scale, self.readoutCount)
+        litFraction = np.diff(self.coverage(bounds)) / (factor * scale)
+        return 2 * litFraction - 1
+
+    @staticmethod
+    def blockMeans(values, factor):
+        # Means of 'factor' consecutive values, the last block padded dark
+        blocks = -(-values.size // factor)
+        padded = np.full(blocks * factor, -1.0)
+        padded[:values.size] = values
+        return padded.reshape(blocks, factor).mean(axis=1)
+
+    @staticmethod
+    def correlate(trace, template, size):
+        # Score of every lag, from -(template.size - 1) to trace.size - 1. 
+        # The signature is dark before and after the template, so pulses 
+        # of the trace that fall outside it are penalized as well. The 
+        # acquisition may start late or stop early, template readouts
+        # outside the trace are not scored
+        correlation = np.fft.irfft(np.fft.rfft(trace, size) * np.conj(np.fft.rfft(template, size)), size)
+        lags = np.arange(-(template.size - 1), trace.size)
+        scores = correlation[lags % size]
+        cumulative = np.concatenate(([0], np.cumsum(trace)))
+        before = cumulative[np.clip(lags, 0, trace.size)]
+        after = cumulative[-1] - cumulative[np.clip(lags + template.size, 0, trace.size)]
+        return lags, scores - before - after
+
+    @staticmethod
+    def traceEdges(lit):
+        # First readout and end (exclusive) of every pulse of the trace
+        starts = lit.copy()
+        starts[1:] &= ~lit[:-1]
+        ends = lit.copy()
+        ends[:-1] &= ~lit[1:]
+        return np.flatnonzero(starts), np.flatnonzero(ends) + 1
+
+    def matchPulses(self, traceStarts, traceEnds):
+        # Signature pulse overlapping most each trace pulse, with the 
+        # current lag and scale, and whether there is any overlap
+        first = (traceStarts - self.lag) * self.scale
+        last = (traceEnds - self.lag) * self.scale
+        # The signature pulses are in order and do not overlap, only the 
+        # first one ending after the trace pulse starts and the next 
+        # one can overlap it
+        signatureStarts = self.pulses['start']
+        signatureEnds = self.pulses['start'] + self.pulses['length']
+        candidate = np.searchsorted(signatureEnds, first, side='right')
+        candidates = np.minimum(np.stack((candidate, candidate + 1)), self.pulses.size - 1)
+        overlap = (np.minimum(last, signatureEnds[candidates]) - 
+                   np.maximum(first, signatureStarts[candidates]))
+        overlap[:, candidate >= self.pulses.size] = 0
+        match = candidates[np.argmax(overlap, axis=0), np.arange(candidate.size)]
+        return match, overlap.max(axis=0) > 0
+
+    def period(self):
+        # Typical distance between the starts of consecutive pulses
+        periods = np.diff(self.pulses['start'])
+        return int(np.median(periods)) if periods.size else self.readoutCount
+
+    def coarseAlign(self, trace, scale, candidateCount):
+        # Lags with the best correlations at the given scale, on block means
+        # of the trace. The signature repeats itself and lags a pulse period
+        # apart score almost as well, the candidateCount best lags at least
+        # half a period apart are returned
+        period = self.period()
+        factor = max(1, min(-(-max(trace.size, self.readoutCount) // self.coarseSize), period // 4))
+        coarseTrace = self.blockMeans(trace, factor)
+        template = self.template(scale, factor)
+        size = 1 << int(np.ceil(np.log2(coarseTrace.size + template.size)))
+        lags, scores = self.correlate(coarseTrace, template, size)
+
+        separation = max(1, period // (2 * factor))
+        candidates = []
+        for _ in range(min(candidateCount, scores.size)):
+            index = int(np.argmax(scores))
+            candidates.append(float(lags[index] * factor))
+            scores[max(index - separation, 0):index + separation + 1] = -np.inf
+        return candidates
+
+    def anchorLags(self, traceStarts, traceEnds, scale):
+        # Lags that put the first pulse of the trace on the first pulse of
+        # the signature and the last one on the last. The signature repeats
+        # itself, only its ends tell lags a period apart, and the coarse 
+        # search on long traces blurs them. Pulses shorter than half a 
+        # signature pulse (glitches) are skipped
+        lengths = traceEnds - traceStarts
+        full = np.flatnonzero(lengths * scale >= np.median(self.pulses['length']) / 2)
+        if full.size == 0:
+            return []
+        signatureEnd = self.pulses['start'][-1] + self.pulses['length'][-1]
+        return [float(traceStarts[full[0]] - self.pulses['start'][0] / scale),
+                float(traceEnds[full[-1]] - signatureEnd / scale)]
+
+    def exactScore(self, trace):
+        # Correlation at full resolution for the current lag and scale,
+        # scored as in correlate. Each trace readout is compared with the 
+        # part of the signature it covers, dark outside the signature
+        bounds = np.clip((np.arange(trace.size + 1) - self.lag) * self.scale, 0, self.readoutCount)
+        litFraction = np.diff(self.coverage(bounds)) / self.scale
+        return float(np.dot(trace, 2 * litFraction - 1))
+
+    def fitEdges(self, traceStarts, traceEnds, iterations=2):
+        # Least squares fit of the trace pulse edges to the edges of the
+        # matching signature pulses. Edges far from the fit (glitches, 
+        # split pulses) are left out
+        for _ in range(iterations):
+            match, matched = self.matchPulses(traceStarts, traceEnds)
+            signatureEdges = np.concatenate((self.pulses['start'][match[matched]], 
+                                             (self.pulses['start'] + self.pulses['length'])[match[matched]]))
+            edges = np.concatenate((traceStarts[matched], traceEnds[matched]))
+            if edges.size < 2:
+                return
+            residuals = edges - (self.lag + signatureEdges / self.scale)
+            deviations = np.abs(residuals - np.median(residuals))
+            kept = deviations <= max(2, 3 * np.median(deviations))
+            if np.ptp(signatureEdges[kept]) > 0:
+                slope, lag = np.polyfit(signatureEdges[kept], edges[kept], 1)
+                scale = 1 / slope
+            else:
+                lag, scale = self.lag + np.median(residuals), self.scale
+            if abs(scale - 1) > self.maxDrift:
+                scale = 1 + np.clip(scale - 1, -self.maxDrift, self.maxDrift)
+                lag = np.median(edges[kept] - signatureEdges[kept] / scale)
+            self.lag, self.scale = float(lag), float(scale)
+
+    def refine(self, traceStarts, traceEnds, traceSize):
+        # The lag found at scale 1 fits the middle of the trace, further 
+        # out the drift adds up. The edges are fitted in a window around
+        # the middle that doubles until it covers the whole trace, each 
+        # fit being good enough to match the pulses of the next window
+        centre = traceSize / 2
+        halfWidth = 8 * self.period()
+        while True:
+            window = np.abs(traceStarts - centre) <= halfWidth
+            self.fitEdges(traceStarts[window], traceEnds[window])
+            if halfWidth >= centre:
+                break
+            halfWidth *= 2
+
+    def align(self, lit, candidateCount=4):
+        # Sets the lag and scale. The best lag at scale 1 may be some periods
+        # off, but the fit of the edges still finds the scale. The coarse 
+        # search is then repeated at that scale and the candidate that scores
+        # best once refined is kept. When the trace starts with the signature
+        # lags a whole number of periods apart can score the same, scores
+        # within one pulse of the best are taken as a tie and the signature
+        # is assumed to start with the acquisition (the smallest lag). The 
+        # lags that match the ends of the trace and the signature are 
+        # always tried as well
+        trace = np.where(lit, 1.0, -1.0)
+        traceStarts, traceEnds = self.traceEdges(lit)
+        self.lag, self.scale = self.coarseAlign(trace, 1.0, 1)[0], 1.0
+        self.refine(traceStarts, traceEnds, trace.size)
+        scale = self.scale
+        results = []
+        candidates = self.coarseAlign(trace, scale, candidateCount)
+        candidates += self.anchorLags(traceStarts, traceEnds, scale)
+        for lag in candidates:
+            # With the drift known the pulses match across the whole trace
+            self.lag, self.scale = lag, scale
+            self.fitEdges(traceStarts, traceEnds)
+            results.append((self.exactScore(trace), self.lag, self.scale))
+        # A pulse off at either end costs twice its length
+        tolerance = np.median(self.pulses['length']) / 2
+        bestScore = max(score for score, _, _ in results)
+        ties = [result for result in results if result[0] >= bestScore - tolerance]
+        self.score, self.lag, self.scale = min(ties, key=lambda result: abs(result[1]))
+        return traceStarts, traceEnds
+
+    def pointers(self, power, threshold):
+        # Wavelength and power setting index of each point, NaN for dark 
+        # points and for pulses outside the signature
+        power = np.asarray(power, dtype=float)
+        lit = (power >= threshold) & (power > 0)
+        pointers = np.full((lit.size, 2), np.nan)
+        if not lit.any() or self.pulses is None or self.pulses.size == 0:
+            return pointers
+
+        traceStarts, traceEnds = self.align(lit)
+        match, matched = self.matchPulses(traceStarts, traceEnds)
+
+        points = np.flatnonzero(lit)
+        pulses = np.searchsorted(traceStarts, points, side='right') - 1
+        points, pulses = points[matched[pulses]], match[pulses[matched[pulses]]]
+        pointers[points, 0] = self.pulses['wavelength'][pulses]
+        pointers[points, 1] = self.pulses['powerSetting'][pulses]
+        return pointers
+
+class ThresholdEstimator():
+    # Detection threshold from the histogram of the log power, where the
+    # dark readouts and the pulses make two separate modes. The histogram
+    # has fixed bins, so it can grow one readout at a time during an 
+    # acquisition and the threshold is recalculated from the bin counts 
+    # only. Readouts that are not positive are dark in any case, they are
+    # only counted (far below the dark mode in log scale, they would pull
+    # the split towards it). 
+    #   'otsu': the split with the largest variance between both classes
+    #   'mixture': where a two component gaussian mixture, fitted to the
+    #              histogram starting from the Otsu split, changes class
+    # No threshold is given (None) until both modes are clearly apart: 
+    # the between class variance must be at least minSeparation of the
+    # total variance. The mixture is used by default, it puts the threshold
+    # between both modes also when one of them is much wider (Otsu leans
+    # towards the narrower one).
+
+    methods = ['otsu', 'mixture']
+
+    def __init__(self, method='mixture', minPower=1e-9, maxPower=1e4, binsPerDecade=80, minSeparation=0.6):
+        if method not in self.methods:
+            raise ValueError(f"Unknown threshold method '{method}'")
+        self.method = method
+        self.minSeparation = minSeparation
+        self.logMin = np.log10(minPower)
+        self.binsPerDecade = binsPerDecade
+        binCount = int(np.ceil((np.log10(maxPower) - self.logMin) * binsPerDecade))
+        # Bin i holds log powers from centres[i] - width/2 to centres[i] + width/2
+        self.edges = self.logMin + np.arange(binCount + 1) / binsPerDecade
+        self.centres = (self.edges[:-1] + self.edges[1:]) / 2
+        self.counts = np.zeros(binCount, dtype=np.int64)
+        self.nonPositiveCount = 0
+
+    @classmethod
+    def fromPower(cls, power, **options):
+        estimator = cls(**options)
+        estimator.add(power)
+        return estimator
+
+    @staticmethod
+    def estimate(power, **options):
+        # Threshold [mW] for a whole trace, None if there is no clear split
+        return ThresholdEstimator.fromPower(power, **options).threshold()
+
+    @property
+    def count(self):
+        return int(self.counts.sum()) + self.nonPositiveCount
+
+    def append(self, value):
+        # One readout, as they arrive during an acquisition
+        if value > 0:
+            index = math.floor((math.log10(value) - self.logMin) * self.binsPerDecade)
+            self.counts[min(max(index, 0), self.counts.size - 1)] += 1
+        else:
+            self.nonPositiveCount += 1
+
+    def add(self, power):
+        # All the readouts of a trace at once
+        power = np.asarray(power, dtype=float).ravel()
+        positive = power[power > 0]
+        self.nonPositiveCount += power.size - positive.size
+        indices = np.floor((np.log10(positive) - self.logMin) * self.binsPerDecade).astype(np.int64)
+        self.counts += np.bincount(np.clip(indices, 0, self.counts.size - 1), minlength=self.counts.size)
+
+    def readoutsBetween(self, first, second):
+        # Readouts (as far as the bins tell) that change class when the
+        # threshold moves from one value to the other
+        low, high = sorted([first, second])
+        bounds = [0 if value <= 0 else
+                  min(max(math.floor((math.log10(value) - self.logMin) * self.binsPerDecade), 0), self.counts.size)
+                  for value in (low, high)]
+        return int(self.counts[bounds[0]:bounds[1]].sum())
+
+    def otsuSplit(self):
+        # Number of bins in the dark class and the separation of that split
+        weights = self.counts.astype(float)
+        total = weights.sum()
+        if total == 0:
+            return None, 0.0
+        darkWeight = np.cumsum(weights)[:-1]
+        litWeight = total - darkWeight
+        darkSum = np.cumsum(weights * self.centres)[:-1]
+        mean = np.sum(weights * self.centres) / total
+        valid = (darkWeight > 0) & (litWeight > 0)
+        if not valid.any():
+            return None, 0.0
+        darkMean = darkSum / np.where(valid, darkWeight, 1)
+        litMean = (mean * total - darkSum) / np.where(valid, litWeight, 1)
+        between = np.where(valid, darkWeight * litWeight * (darkMean - litMean)**2, -1) / total**2
+        split = int(np.argmax(between))
+        variance = np.sum(weights * (self.centres - mean)**2) / total
+        return split + 1, between[split] / variance
+
+    def mixtureSplit(self, split, iterations=50):
+        # Expectation maximization on the bin counts, the two classes of the
+        # Otsu split as starting point. The split is the first bin, between
+        # both means, where the lit component is the most likely
+        weights = self.counts.astype(float)
+        x = self.centres
+        resolution = 1 / self.binsPerDecade
+        classes = [slice(0, split), slice(split, None)]
+        fractions = np.array([weights[c].sum() for c in classes]) / weights.sum()
+        means = np.array([np.average(x[c], weights=weights[c]) for c in classes])
+        deviations = np.array([np.sqrt(np.average((x[c] - m)**2, weights=weights[c])) for c, m in zip(classes, means)])
+        for _ in range(iterations):
+            deviations = np.maximum(deviations, resolution)
+            densities = (fractions[:, None] / deviations[:, None] * 
+                         np.exp(-0.5 * ((x[None, :] - means[:, None]) / deviations[:, None])**2))
+            responsibilities = densities / np.maximum(densities.sum(axis=0), 1e-300)
+            classWeights = responsibilities @ weights
+            if np.any(classWeights == 0):
+                return split
+            fractions = classWeights / weights.sum()
+            means = (responsibilities * x) @ weights / classWeights
+            deviations = np.sqrt((responsibilities * (x[None, :] - means[:, None])**2) @ weights / classWeights)
+        dark, lit = np.argsort(means)
+        between = np.flatnonzero((x > means[dark]) & (x <= means[lit]) & 
+                                 (densities[lit] >= densities[dark]))
+        return int(between[0]) if between.size else split
+
+    def threshold(self):
+        # Threshold [mW]: the lower edge of the first lit bin
+        split, separation = self.otsuSplit()
+        if split is None or separation < self.minSeparation:
+            return None
+        if self.method == 'mixture':
+            split = self.mixtureSplit(split)
+        return float(10.0**self.edges[split])
+
+class SignatureInference():
+    # Proposes the signature of a trace recorded without its recipe. The
+    # trace is cut into pulses (pulse length and pause from the medians 
+    # of their durations) and every pulse is reduced to its plateau level.
+    # Each wavelength and each power setting scale the measured power, so
+    # the log levels are modelled as a wavelength term plus a power term,
+    # repeated every wavelengthCount * powerSettingCount pulses. Every
+    # count and order is fitted and scored (BIC: the residual of the fit 
+    # against the number of terms) in parallel. 
+    # A block of 'a' wavelengths and 'b' power settings in 'LP' order looks
+    # like 'b' wavelengths and 'a' power settings in 'PL' order. Between
+    # both, the one whose power settings grow along the block is taken 
+    # (setPowers listed in increasing order), then 'LP' as in the default
+    # recipe; known counts or order can also be given. The acquisition is
+    # assumed to start with the signature, as for the counting.
+
+    def __init__(self, maxPulsesPerBlock=64, levelResolution=0.005, workers=None):
+        # levelResolution: smallest level deviation considered [log10], 
+        # keeps noise free data from being overfitted
+        self.maxPulsesPerBlock = maxPulsesPerBlock
+        self.levelResolution = levelResolution
+        self.workers = workers
+
+    @staticmethod
+    def segment(power, threshold):
+        # First readout, length and plateau level of every pulse. The first
+        # and last readouts of longer pulses are averaged with the pauses 
+        # and left out of the level
+        power = np.asarray(power, dtype=float)
+        lit = (power >= threshold) & (power > 0)
+        starts = lit.copy()
+        starts[1:] &= ~lit[:-1]
+        ends = lit.copy()
+        ends[:-1] &= ~lit[1:]
+        starts, ends = np.flatnonzero(starts), np.flatnonzero(ends) + 1
+        lengths = ends - starts
+        trimmed = lengths > 2
+        first = starts + trimmed
+        sizes = lengths - 2 * trimmed
+        # Medians of all the pulses at once, their readouts sorted by 
+        # pulse number and then by power
+        offsets = np.cumsum(sizes) - sizes
+        pulseOf = np.repeat(np.arange(starts.size), sizes)
+        points = np.repeat(first - offsets, sizes) + np.arange(sizes.sum())
+        sortedPoints = points[np.lexsort((power[points], pulseOf))]
+        levels = (power[sortedPoints[offsets + (sizes - 1) // 2]] + 
+                  power[sortedPoints[offsets + sizes // 2]]) / 2
+        return starts, lengths, levels
+
+    def candidates(self, pulseCount, wavelengthCount=None, powerSettingCount=None, order=None):
+        # (order, wavelength count, power setting count), all the blocks 
+        # that fit at least once in the trace and match the known values
+        candidates = []
+        for blockSize in range(1, min(self.maxPulsesPerBlock, pulseCount) + 1):
+            for L in range(1, blockSize + 1):
+                P = blockSize // L
+                if (blockSize % L != 0 or wavelengthCount not in (None, L) or 
+                        powerSettingCount not in (None, P)):
+                    continue
+                for blockOrder in ['LP', 'PL']:
+                    if order in (None, blockOrder):
+                        candidates.append((blockOrder, L, P))
+        return candidates
+
+    def phaseStatistics(self, logLevels, blockSize):
+        # Count, mean and spread (sum of squares) of the pulses at each
+        # position in the block
+        phases = np.arange(logLevels.size) % blockSize
+        counts = np.bincount(phases, minlength=blockSize)
+        means = np.bincount(phases, weights=logLevels, minlength=blockSize) / counts
+        spread = np.sum((logLevels - means[phases])**2)
+        return counts, means, spread
+
+    def score(self, logLevels, candidate, statistics):
+        order, wavelengthCount, powerSettingCount = candidate
+        blockSize = wavelengthCount * powerSettingCount
+        counts, means, spread = statistics[blockSize]
+        indL, indP = PulseAssignment.pulseLabels(np.arange(blockSize), wavelengthCount, powerSettingCount, order)
+
+        # Weighted least squares on the block positions: a term per 
+        # wavelength and per power setting (the first one is zero)
+        design = np.zeros((blockSize, wavelengthCount + powerSettingCount - 1))
+        design[np.arange(blockSize), indL] = 1
+        design[np.flatnonzero(indP > 0), wavelengthCount + indP[indP > 0] - 1] = 1
+        weights = np.sqrt(counts)
+        terms = np.linalg.lstsq(design * weights[:, None], means * weights, rcond=None)[0]
+        residual = spread + np.sum(counts * (means - design @ terms)**2)
+
+        pulseCount = logLevels.size
+        variance = residual / pulseCount + self.levelResolution**2
+        bic = pulseCount * np.log(variance) + design.shape[1] * np.log(pulseCount)
+        powerTerms = np.concatenate(([0], terms[wavelengthCount:]))
+        increasing = bool(np.all(np.diff(powerTerms) > 0))
+        return {'order': order, 
+                'wavelengthCount': wavelengthCount, 
+                'powerSettingCount': powerSettingCount, 
+                'score': float(bic), 
+                'deviation': float(np.sqrt(residual / pulseCount)), 
+                'increasingPowers': increasing}
+
+    def infer(self, power, threshold=None, count=5, wavelengthCount=None, powerSettingCount=None, order=None):
+        # The count most likely signatures, best first. Without a threshold
+        # it is estimated from the power histogram
+        if threshold is None:
+            threshold = ThresholdEstimator.estimate(power)
+            if threshold is None:
+                return []
+        starts, lengths, levels = self.segment(power, threshold)
+        if starts.size == 0:
+            return []
+        # Glitches crossing the threshold are much shorter than the pulses
+        kept = lengths >= np.median(lengths) / 2
+        starts, lengths, levels = starts[kept], lengths[kept], levels[kept]
+        pulseLength = int(np.median(lengths))
+        gaps = starts[1:] - (starts + lengths)[:-1]
+        pauseLength = int(np.median(gaps)) if gaps.size else 0
+        logLevels = np.log10(levels)
+
+        candidates = self.candidates(starts.size, wavelengthCount, powerSettingCount, order)
+        blockSizes = sorted({L * P for _, L, P in candidates})
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            statistics = dict(zip(blockSizes, pool.map(lambda size: self.phaseStatistics(logLevels, size), blockSizes)))
+            results = list(pool.map(lambda candidate: self.score(logLevels, candidate, statistics), candidates))
+
+        # Equal scores: increasing power settings first, then 'LP'
+        results.sort(key=lambda result: (round(result['score'], 6), not result['increasingPowers'], 
+                                         result['order'] != 'LP'))
+        for result in results:
+            result.update(pulseLength=pulseLength, pauseLength=pauseLength, 
+                          pulseCount=int(starts.size), threshold=threshold)
+            if result['order'] == 'LP':
+                result['signature'] = f"{pulseLength}T{result['powerSettingCount']}P{result['wavelengthCount']}L"
+            else:
+                result['signature'] = f"{pulseLength}T{result['wavelengthCount']}L{result['powerSettingCount']}P"
+        return results[:count]
+
+class SortedData():
+    # Readouts sorted by pulse. One row per pulse (first readout, length,
+    # wavelength and power setting index) and the power of each readout
+    # are kept, instead of (readouts, wavelengths, power settings) arrays
+    # that are mostly zeros. pointers holds the wavelength and power 
+    # setting index of each readout, NaN for dark ones, as used to split
+    # the data files.
+
+    pulseType = np.dtype([('start', np.int64), ('length', np.int64), 
+                          ('wavelength', np.int64), ('powerSetting', np.int64)])
+
+    def __init__(self, wavelengthCount, powerSettingCount, capacity=1024):
+        self.wavelengthCount = wavelengthCount
+        self.powerSettingCount = powerSettingCount
+        capacity = max(int(capacity), 1)
+        self.count = 0
+        self.power = np.zeros(capacity)
+        self.pointers = np.full((capacity, 2), np.nan)
+        self.pulses = np.zeros(0, dtype=self.pulseType)
+
+    def ensureCapacity(self, count):
+        # The live data can run past the readout count of the signature
+        capacity = len(self.power)
+        if count > capacity:
+            capacity = max(count, 2 * capacity)
+            power = np.zeros(capacity)
+            power[:self.count] = self.power[:self.count]
+            pointers = np.full((capacity, 2), np.nan)
+            pointers[:self.count] = self.pointers[:self.count]
+            self.power, self.pointers = power, pointers
+
+    def assign(self, first, last, points, indL, indP, power):
+        # Rewrites readouts [first, last) with the labelled points given.
+        # Pulses that reach 'first' are rebuilt, the rest are kept
+        self.ensureCapacity(last)
+        self.power[first:last] = 0
+        self.pointers[first:last] = np.nan
+        self.power[points] = power
+        self.pointers[points, 0] = indL
+        self.pointers[points, 1] = indP
+        self.count = last
+
+        kept = self.pulses['start'] + self.pulses['length'] < first
+        rescan = first
+        if not kept.all():
+            rescan = min(first, int(self.pulses['start'][~kept].min()))
+        self.pulses = np.concatenate((self.pulses[kept], self.findPulses(rescan, last)))
+
+    def findPulses(self, first, last):
+        # Runs of consecutive readouts with the same indices
+        wavelengthInd = self.pointers[first:last, 0]
+        powerInd = self.pointers[first:last, 1]
+        lit = ~np.isnan(wavelengthInd)
+        starts = lit.copy()
+        starts[1:] &= ~lit[:-1] | (wavelengthInd[1:] != wavelengthInd[:-1]) | (powerInd[1:] != powerInd[:-1])
+        startPoints = np.flatnonzero(starts)
+
+        pulses = np.zeros(startPoints.size, dtype=self.pulseType)
+        pulses['start'] = first + startPoints
+        pulses['length'] = np.bincount((np.cumsum(starts) - 1)[lit], minlength=startPoints.size)
+        pulses['wavelength'] = wavelengthInd[startPoints]
+        pulses['powerSetting'] = powerInd[startPoints]
+        return pulses
+
+    def series(self, wavelength, powerSetting=None):
+        # Readout indices and powers to plot the pulses of one wavelength 
+        # (and power setting) as a line that is zero in between, like a 
+        # dense series with zeros would look
+        selected = self.pulses['wavelength'] == wavelength
+        if powerSetting is not None:
+            selected &= self.pulses['powerSetting'] == powerSetting
+        starts = self.pulses['start'][selected]
+        lengths = self.pulses['length'][selected]
+
+        # Each pulse with one dark readout on either side
+        sizes = lengths + 2
+        offsets = np.cumsum(sizes) - sizes
+        position = np.arange(sizes.sum()) - np.repeat(offsets, sizes)
+        indices = np.repeat(starts - 1, sizes) + position
+        edge = (position == 0) | (position == np.repeat(lengths + 1, sizes))
+        inside = (indices >= 0) & (indices < self.count)
+        indices, edge = indices[inside], edge[inside]
+        values = np.where(edge, 0, self.power[indices])
+
+        # The line spans the whole trace
+        if self.count > 0 and (indices.size == 0 or indices[0] > 0):
+            indices, values = np.concatenate(([0], indices)), np.concatenate(([0], values))
+        if self.count > 0 and indices[-1] < self.count - 1:
+            indices, values = np.concatenate((indices, [self.count - 1])), np.concatenate((values, [0]))
+        return indices, values
+
+class DataSignature():
+    # The signature is kept as a list of pulses, one row per pulse with its
+    # first readout, length, wavelength index, power setting value and index. 
+    # Dense arrays of readouts are only rendered on demand, for the readouts 
+    # that are shown (render), or for the whole duration (signature).
+
+    pulseType = np.dtype([('start', np.int64), ('length', np.int64), 
+                          ('wavelength', np.int64), ('power', float), 
+                          ('powerSetting', np.int64)])
+
+    def __init__(self):        
+        self.pulses = None
+        self.denseSignature = None
+        self.signatureString = []
+        self.readoutCount = 0
+        self.wavelengthCount = 0
+
+    @property
+    def signature(self):
+        # Dense (wavelengths, readouts) array, rendered once per signature
+        if self.pulses is None:
+            return []
+        if self.denseSignature is None:
+            self.denseSignature = self.render()
+            self.denseSignature.setflags(write=False)
+        return self.denseSignature
+
+    def render(self, first=0, last=None, step=1):
+        # Dense signature of the readouts [first, last). With step > 1 each
+        # column covers 'step' readouts and holds the highest power setting
+        # among them, so short pulses stay visible in long views.
+        if last is None:
+            last = self.readoutCount
+        step = max(int(step), 1)
+        columnCount = max(-(-(last - first) // step), 0)
+        dense = np.zeros((self.wavelengthCount, columnCount))
+
+        starts = np.maximum(self.pulses['start'], first)
+        ends = np.minimum(self.pulses['start'] + self.pulses['length'], last)
+        visible = ends > starts
+        starts, ends = starts[visible], ends[visible]
+        rows, values = self.pulses['wavelength'][visible], self.pulses['power'][visible]
+
+        firstColumn = (starts - first) // step
+        counts = (ends - 1 - first) // step - firstColumn + 1
+        offsets = np.cumsum(counts) - counts
+        columns = np.repeat(firstColumn - offsets, counts) + np.arange(counts.sum())
+        rows, values = np.repeat(rows, counts), np.repeat(values, counts)
+        if step == 1:
+            dense[rows, columns] = values
+        else:
+            np.maximum.at(dense, (rows, columns), values)
+        return dense
+        
+    def calculateColors(self, wavelengths):
+        # To define how wavelengths will be represented later
+        self.Red   = []
+        self.Green = []
+        self.Blue  = []
+        for wavelength in wavelengths:        
+            RL, GL, BL = ColorHandler.waveLengthToRGB(wavelength)            
+            self.Red.append(RL)
+            self.Green.append(GL)
+            self.Blue.append(BL)
+    
+    @staticmethod
+    def stringOrList2Array(inputData):
+        
+        if isinstance(inputData, str):
+            inputData = inputData.strip('[]')
+            array = [elem.strip() for elem in inputData.split(',') if elem]
+            return array
+        if isinstance(inputData, list):
+            if len(inputData) == 1:        
+                return [int(inputData[0])]  # Convert the single element to a string in a list
+            elif len(inputData) > 1:                            
+                return [int(elem) for elem in inputData]  # Convert each element to a string
+
+    def calculateSignature(self):
+        # The full signature consists in power setting blocks concatenated.
+        # Editing a field recalculates it, the last pulse lists are kept
+        # and shared (read only) while the parameters do not change.
+
+        self.calculateColors(self.wavelengths)
+        
+        setPowerArray = self.stringOrList2Array(self.setPowers)
+        wavelengthArray = self.stringOrList2Array(self.wavelengths)
+
+        self.powerSettingCount = len(setPowerArray)
+        self.wavelengthCount   = len(wavelengthArray)
+
+        duration = self.duration-self.signaturePause # We want to prepend one section of zeros atr the beggining
+        self.readoutCount = int((duration / self.readoutInterval) + 1)
+        self.runingTimePerPulse = int(self.measurementInterval/(self.powerSettingCount * self.wavelengthCount))
+
+        if isinstance(self.setPowers, str):
+            setPowers = self.setPowers
+        else:
+            setPowers = tuple(self.setPowers)
+        self.pulses, self.signatureString = self.buildPulses(
+            self.wavelengthCount, tuple(setPowerArray), setPowers, 
+            self.measurementInterval, self.readoutInterval, self.duration, 
+            self.signaturePause, self.order)
+        self.denseSignature = None
+
+    @staticmethod
+    @lru_cache(maxsize=16)
+    def buildPulses(wavelengthCount, setPowerArray, setPowers, measurementInterval, 
+                    readoutInterval, duration, signaturePause, order):
+        # Pulse list and signature string for the given parameters. 
+        # setPowerArray is the parsed list of power settings, used by 'LP'; 
+        # 'PL' uses the setPowers as given.
+        powerSettingCount = len(setPowerArray)
+
+        pulsesPerBlock = powerSettingCount * wavelengthCount
+
+        duration = duration-signaturePause # We want to prepend one section of zeros atr the beggining
+        readoutCount = int((duration / readoutInterval) + 1)
+
+        runingTimePerPulse = int(measurementInterval/pulsesPerBlock)
+        dataPointsPerPulse = int((runingTimePerPulse - signaturePause) / readoutInterval)
+        idlePointsPerPulse = int(signaturePause / readoutInterval)
+
+        overallPulseShift = idlePointsPerPulse  # Start after one idle cycle
+
+        # a block consits in the set of pulses and pauses covering all the 
+        # desired cases once. Blocks can be repeated it duration allows        
+        blocks = int(duration/measurementInterval)
+
+        pulseLength = max(dataPointsPerPulse, 0)
+        signatureString = []
+        starts = lengths = wavelengthInd = powerInd = powers = np.zeros(0, dtype=np.int64)
+
+        if order == 'LP':
+            # Powers first: for every wavelength one pulse per power setting, 
+            # each followed by a pause. The blocks follow each other as far 
+            # as the signature goes.
+            PulselLen = pulseLength + idlePointsPerPulse
+            placeholderLen = powerSettingCount * PulselLen
+            lblk = wavelengthCount * placeholderLen
+
+            block, wavelength, power = np.meshgrid(
+                np.arange(blocks), np.arange(wavelengthCount), np.arange(powerSettingCount), indexing='ij')
+            starts = (overallPulseShift + block * lblk + wavelength * placeholderLen + power * PulselLen).ravel()
+            lengths = np.full(starts.size, pulseLength)
+            wavelengthInd = wavelength.ravel()
+            powerInd = power.ravel()
+            powers = np.asarray(setPowerArray, dtype=float)[powerInd]
+            
+            signatureString = str(dataPointsPerPulse)+'T'+str(powerSettingCount)+'P'+str(wavelengthCount)+'L'
+
+        if order == 'PL':
+            # Wavelengths first: one pulse per wavelength, for every power
+            # setting, after the idle shift
+            PulselLen = dataPointsPerPulse + idlePointsPerPulse
+            wavelengthSetLen = wavelengthCount*PulselLen
+            if wavelengthSetLen < 0:
+                raise ValueError("negative dimensions are not allowed")
+            lblk = wavelengthSetLen * powerSettingCount
+            if lblk > 0 and overallPulseShift + lblk > readoutCount:
+                raise ValueError("The signature blocks do not fit in the duration")
+
+            power, wavelength = np.meshgrid(
+                np.arange(powerSettingCount), np.arange(wavelengthCount), indexing='ij')
+            starts = (overallPulseShift + power * wavelengthSetLen + wavelength * PulselLen).ravel()
+            lengths = np.full(starts.size, min(pulseLength, max(PulselLen, 0)))
+            wavelengthInd = wavelength.ravel()
+            powerInd = power.ravel()
+            powers = np.array([float(setPowers[setPowerInd]) for setPowerInd in powerInd])
+
+            # Every following block is a copy of the first lblk readouts, 
+            # which start with the idle shift, as long as it ends before 
+            # the last readout. The first block is then cut at lblk as well.
+            copies = min(blocks - 1, (readoutCount - 1) // lblk - 1) if lblk > 0 else 0
+            if copies > 0:
+                lengths = np.minimum(lengths, lblk - starts)
+                shifts = np.repeat(np.arange(copies + 1) * lblk, starts.size)
+                starts = np.tile(starts, copies + 1) + shifts
+                lengths = np.tile(lengths, copies + 1)
+                wavelengthInd = np.tile(wavelengthInd, copies + 1)
+                powerInd = np.tile(powerInd, copies + 1)
+                powers = np.tile(powers, copies + 1)
+            
+            signatureString = str(dataPointsPerPulse)+'T'+str(wavelengthCount)+'L'+str(powerSettingCount)+'P'
+
+        # Pulses are cut at the end of the signature
+        lengths = np.minimum(lengths, readoutCount - starts)
+        kept = lengths > 0
+        pulses = np.zeros(int(np.count_nonzero(kept)), dtype=DataSignature.pulseType)
+        pulses['start'] = starts[kept]
+        pulses['length'] = lengths[kept]
+        pulses['wavelength'] = wavelengthInd[kept]
+        pulses['power'] = powers[kept]
+        pulses['powerSetting'] = powerInd[kept]
+        # The cached list is shared by all the callers
+        pulses.setflags(write=False)
+        return pulses, signatureString
+
+    def setParameters(self, wavelengths, setPowers, measurementInterval, readoutInterval, duration, signaturePause, order):
+        self.wavelengths = wavelengths
+        self.setPowers   = setPowers
+        self.measurementInterval = measurementInterval
+        self.readoutInterval = readoutInterval     
+        self.duration = duration
+        self.signaturePause = signaturePause
+        self.order = order
+
 class DataObject:
     def __init__(self):
         
@@ -53,6 +1024,8 @@ class DataObject:
         self.threshold          = 0
 
         self.dataObjType = 'unknown'
+        # Recipe and calibration stored with binary data files
+        self.metadata = {}
 
         # signatures:
         # nPnLnT (power (nP: number of power settings), (nP: number of wavelength settings), (nP: number of time points)) 
@@ -91,6 +1064,13 @@ class DataObject:
             values = self.loadDataBySignature()
         return values
 
+    @staticmethod
+    def findColumns(fieldNames, tags):
+        # Column of each tag in the header. Units may follow the name,
+        # as in 'wavelength[nm]' or 'power[mW]'
+        names = [name.strip().split('[')[0].strip().lower() for name in fieldNames]
+        return [names.index(tag) for tag in tags]
+
     def loadDataByTag(self):
         # Loads the contents of a data file reading the tags
         # the data map self.dataMap[Tidx, Lidx, Pidx]
@@ -99,41 +1079,33 @@ class DataObject:
 
         self.fieldLabels = ['T', 'L', 'P']
 
-        timeStampFull     = []
-        wavelengthFull    = []
-        powerSettingFull  = []
-        measuredPowerFull = []
+        # fileInterface depends on this module
+        from fileInterface import BinaryDataFile
+        if BinaryDataFile.isBinary(self.dataFile):
+            return self.loadBinaryData()
 
         self.content = self.getFileContent()
 
         fieldNames = self.content[0]
-        dataContent = self.content[1:]
-
-        for filedName in fieldNames:
-            print(filedName)
-            # find the order:
-            try:
-                order = [fieldNames.index('timestamp'), \
-                         fieldNames.index('wavelength'), \
-                         fieldNames.index('setting'), \
-                        fieldNames.index('power')]
-            except:
-                order = [fieldNames.index('timestamp'), \
-                         fieldNames.index('wavelength'), \
-                         fieldNames.index('setting'), \
-                        fieldNames.index('power')]                
-
-        # how many elements:
-        for row in dataContent:
-            timeStampFull.append(row[order[0]])
-            wavelengthFull.append(int(row[order[1]]))
-            powerSettingFull.append(int(row[order[2]]))
-            measuredPowerFull.append(float(row[order[3]].strip("[]")))
-
-        self.timeStamp     = sorted(list(set(timeStampFull)))
-        self.wavelength    = sorted(list(set(wavelengthFull)))
-        self.powerSetting  = sorted(list(set(powerSettingFull)))
-        self.measuredPower = measuredPowerFull
+        dataContent = [row for row in self.content[1:] if row]
+        order = self.findColumns(fieldNames, ['timestamp', 'wavelength', 'setting', 'power'])
+
+        # The file is parsed once into columns
+        columns = list(zip(*dataContent))
+        timeStampFull     = np.array(columns[order[0]])
+        wavelengthFull    = np.array(columns[order[1]]).astype(int)
+        powerSettingFull  = np.array(columns[order[2]]).astype(int)
+        measuredPowerFull = np.char.strip(np.array(columns[order[3]]), "[]").astype(float)
+
+        # Sorted distinct values and, for every row, their index among them
+        timeStamp, Tidx    = np.unique(timeStampFull, return_inverse=True)
+        wavelength, Lidx   = np.unique(wavelengthFull, return_inverse=True)
+        powerSetting, Pidx = np.unique(powerSettingFull, return_inverse=True)
+
+        self.timeStamp     = timeStamp.tolist()
+        self.wavelength    = wavelength.tolist()
+        self.powerSetting  = powerSetting.tolist()
+        self.measuredPower = measuredPowerFull.tolist()
 
         # number of different elements
         self.timeStampCount     = len(self.timeStamp)
@@ -141,31 +1113,53 @@ class DataObject:
         self.powerSettingCount  = len(self.powerSetting)        
         self.measuredPowerCount = len(self.measuredPower)
 
-        print("wavelengths: ",self.wavelength, "; ", self.wavelengthCount, " values")
-        print("power settings: ",self.powerSetting, "; ", self.powerSettingCount, " values")
+        log.debug("wavelengths: %s; %d values", self.wavelength, self.wavelengthCount)
+        log.debug("power settings: %s; %d values", self.powerSetting, self.powerSettingCount)
 
-        self.dataMap = np.zeros((self.timeStampCount, 3), dtype=int)
+        # One row per readout
+        self.dataMap = np.column_stack((Tidx, Lidx, Pidx)).astype(int)
 
-        for element in range(self.measuredPowerCount):
-            line = dataContent[element]
-            Tidx = self.timeStamp.index(line[0])
-            Lidx = self.wavelength.index(int(line[1]))
-            Pidx = self.powerSetting.index(int(line[2]))
-            self.dataMap[element, :] = [Tidx, Lidx, Pidx]
+        #setMetadata(self, lightSourceModel, lightSourceIdentifier)
 
 
-        #setMetadata(self, lightSourceModel, lightSourceIdentifier)
+        log.debug("%s, data map %s", self.fieldLabels, self.dataMap.shape)
+
+    def loadBinaryData(self):
+        # Same as loadDataByTag for binary data files. Nothing is parsed:
+        # the powers are a copy-on-write memory map of the file and the 
+        # timestamps are datetime64 values. The recipe and calibration
+        # stored with the data are available as metadata
+        from fileInterface import BinaryDataFile
+
+        header, records = BinaryDataFile.read(self.dataFile)
+        self.metadata = header.get('metadata', {})
+        self.content = records
+
+        timeStamp, Tidx    = np.unique(BinaryDataFile.timestamps(records), return_inverse=True)
+        wavelength, Lidx   = np.unique(records['wavelength'].astype(int), return_inverse=True)
+        powerSetting, Pidx = np.unique(records['setting'].astype(int), return_inverse=True)
+
+        self.timeStamp     = timeStamp
+        self.wavelength    = wavelength.tolist()
+        self.powerSetting  = powerSetting.tolist()
+        self.measuredPower = records['power']
+
+        self.timeStampCount     = len(self.timeStamp)
+        self.wavelengthCount    = len(self.wavelength)
+        self.powerSettingCount  = len(self.powerSetting)        
+        self.measuredPowerCount = len(self.measuredPower)
+
+        log.debug("wavelengths: %s; %d values", self.wavelength, self.wavelengthCount)
+        log.debug("power settings: %s; %d values", self.powerSetting, self.powerSettingCount)
 
+        self.dataMap = np.column_stack((Tidx, Lidx, Pidx)).astype(int)
 
-        print(self.fieldLabels)
-        print(self.dataMap.shape)
-        print(self.dataMap)
+        log.debug("%s, data map %s", self.fieldLabels, self.dataMap.shape)
 
     def reassignData(self, signatureString):
         self.setSignature(signatureString)
-        print(signatureString)
+        log.debug("Reassigning with signature %s", signatureString)
         if not self.content == []:
-            print("Reassigning...")
             # find all values above threshold
 
             if self.dataObjType == 'file':
@@ -182,7 +1176,7 @@ class DataObject:
             self.dataMap = np.zeros((len(self.content), 3), dtype=int)
             self.parseSignature()
 
-            print('new data map: ', self.dataMap.shape)
+            log.debug("new data map: %s", self.dataMap.shape)
 
             Tidx = self.fieldLabels.index('T')
             Lidx = self.fieldLabels.index('L')
@@ -191,17 +1185,17 @@ class DataObject:
             for element in range(len(self.content)):
                 self.dataMap[element, : ] = [Tidx, Lidx, Pidx]
         else:
-            print("Open data file or start acquisition")    
+            log.warning("Open data file or start acquisition")
 
     def applyThreshold(self):
-        print("Applying threshold")
-        for index in range(len(self.measuredPower)):
-            if self.measuredPower[index] < self.threshold:
-                self.measuredPower[index] = 0
+        log.debug("Applying threshold %s", self.threshold)
+        # In place, the measured powers can be a list or a view on the acquired data
+        power = np.asarray(self.measuredPower, dtype=float)
+        self.measuredPower[:] = np.where(power < self.threshold, 0, power).tolist()
             
     def setThreshold(self, threshold):
         self.threshold = threshold
-        print("threshold: ", self.threshold)
+        log.debug("threshold: %s", self.threshold)
 
     def loadDataBySignature(self):
         # Loads the contents of a file using a provided signature
@@ -224,9 +1218,7 @@ class DataObject:
         for element in range(len(self.content)):
             dataMap[element, : ] = [Tidx, Lidx, Pidx]
         
-        print(self.fieldLabels)
-        print(dataMap.shape)
-        print(dataMap)
+        log.debug("%s, data map %s", self.fieldLabels, dataMap.shape)
 
     def getFileContent(self):
         self.content = []
@@ -278,6 +1270,4 @@ class DataObject:
         self.fieldLabels = labels
         self.fieldElemCount = elemCount
         
-        print(self.signature)
-        print(self.fieldLabels)
-        print(self.fieldElemCount)
+        log.debug("signature %s: %s %s", self.signature, self.fieldLabels, self.fieldElemCount)
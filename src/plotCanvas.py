@@ -0,0 +1,267 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import logging, time
+import numpy as np
+from PySide6.QtCore import Signal
+from matplotlib.backends.backend_qt5agg import FigureCanvasQTAgg
+from matplotlib.figure import Figure
+
+log = logging.getLogger(__name__)
+
+class DataCanvas(FigureCanvasQTAgg):
+    newThresholdByClick = Signal(float)
+
+    def __init__(self, reactToScroll, parent=None, width=5, height=4, dpi=100):
+        fig = Figure(figsize=(width, height), dpi=dpi, layout='constrained')
+        self.axes = fig.add_subplot(111, facecolor='black')        
+        super(DataCanvas, self).__init__(fig)
+        self.dataMax = []
+        self.dataMin = []
+        self.reactToScroll = reactToScroll
+        # Streaming mode (live acquisition), see startStream()
+        self.streaming = False
+        self.background = None
+        self.draw_cid = self.mpl_connect('draw_event', self.onDraw)
+
+        if self.reactToScroll:
+            # Some mouse magic here on the plot
+            # we will connect mouse events for the data plot only
+            self.scroll_cid = self.mpl_connect('scroll_event', self.onScroll)
+            self.click_cid = self.mpl_connect('button_press_event', self.onClick)
+        else:
+            self.scroll_cid = None
+            self.click_cid = None
+
+
+    def linkSlider(self, sliderHandle):
+        self.slider = sliderHandle
+
+    # Streaming mode: during an acquisition the canvas owns one line for 
+    # the trace, one for the threshold and one per sorted (wavelength, power)
+    # series. New samples go into preallocated buffers, the lines are updated 
+    # with set_data and only the lines are redrawn over a cached background 
+    # (blitting). The whole figure is redrawn only when the axis limits grow.
+    # Frames are throttled to frameRate, samples arriving in between are 
+    # buffered and shown with the next frame.
+
+    def startStream(self, capacity, frameRate=10):
+        self.axes.clear()
+        capacity = max(int(capacity), 16)
+        self.streamX = np.zeros(capacity)
+        self.streamY = np.zeros(capacity)
+        self.streamCount = 0
+        # Running range of the trace, updated with every sample
+        self.dataMax = np.empty(0)
+        self.dataMin = np.empty(0)
+        self.sortedStreams = {}
+        self.frameInterval = 1 / frameRate
+        self.lastFrame = 0
+        self.limitsPending = True
+
+        self.traceLine, = self.axes.plot([], [], 'white', animated=True)
+        self.thresholdStream = self.axes.axhline(
+            0, color='gray', linestyle='dashed', animated=True)
+        self.streaming = True
+        self.background = None
+
+    def growStream(self, capacity):
+        streamX = np.zeros(capacity)
+        streamY = np.zeros(capacity)
+        streamX[:self.streamCount] = self.streamX[:self.streamCount]
+        streamY[:self.streamCount] = self.streamY[:self.streamCount]
+        self.streamX = streamX
+        self.streamY = streamY
+        
+    def appendStream(self, xValue, yValue):
+        if self.streamCount == self.streamX.size:
+            self.growStream(2 * self.streamX.size)
+        self.streamX[self.streamCount] = xValue
+        self.streamY[self.streamCount] = yValue
+        self.streamCount += 1
+
+        # The axes only grow, with some margin to keep full redraws rare
+        lowerX, upperX = self.axes.get_xlim()
+        lowerY, upperY = self.axes.get_ylim()
+        if self.streamCount == 1:
+            self.axes.set_xlim(0, max(xValue, 1))
+            self.axes.set_ylim(min(yValue, 0), max(yValue, 0) * 1.1 + 1e-12)
+            self.limitsPending = True
+        else:
+            if xValue > upperX:
+                self.axes.set_xlim(lowerX, xValue * 1.5)
+                self.limitsPending = True
+            if yValue > upperY or yValue < lowerY:
+                span = max(yValue, upperY) - min(yValue, lowerY)
+                self.axes.set_ylim(min(yValue, lowerY), max(yValue, upperY) + 0.1 * span)
+                self.limitsPending = True
+        if self.streamCount == 1:
+            self.dataMax = self.dataMin = np.float64(yValue)
+        else:
+            self.dataMax = max(self.dataMax, np.float64(yValue))
+            self.dataMin = min(self.dataMin, np.float64(yValue))
+
+    def setStreamThreshold(self, threshold):
+        self.thresholdStream.set_ydata([threshold, threshold])
+
+    def setSortedStream(self, key, points, yData, plotColor):
+        # One persistent line per key, points are indices in the trace
+        line = self.sortedStreams.get(key)
+        if line is None:
+            line, = self.axes.plot([], [], color=plotColor, animated=True)
+            self.sortedStreams[key] = line
+        line.set_data(self.streamX[points], yData)
+
+    def streamArtists(self):
+        return list(self.sortedStreams.values()) + [self.traceLine, self.thresholdStream]
+
+    def refreshStream(self, force=False):
+        if not self.streaming:
+            return
+        now = time.perf_counter()
+        if not force and now - self.lastFrame < self.frameInterval:
+            return
+        self.lastFrame = now
+
+        self.traceLine.set_data(self.streamX[:self.streamCount], self.streamY[:self.streamCount])
+        if self.limitsPending or self.background is None:
+            # onDraw caches the new background and draws the lines
+            self.limitsPending = False
+            self.draw()
+        else:
+            self.restore_region(self.background)
+            self.blitStream()
+
+    def blitStream(self):
+        for artist in self.streamArtists():
+            self.axes.draw_artist(artist)
+        self.blit(self.axes.bbox)
+
+    def onDraw(self, event):
+        # Any full redraw (limits, zoom, resize) refreshes the background
+        if self.streaming:
+            self.background = self.copy_from_bbox(self.axes.bbox)
+            for artist in self.streamArtists():
+                self.axes.draw_artist(artist)
+
+    def stopStream(self):
+        # The lines become regular artists, kept in the final figure
+        if not self.streaming:
+            return
+        self.traceLine.set_data(self.streamX[:self.streamCount], self.streamY[:self.streamCount])
+        for artist in self.streamArtists():
+            artist.set_animated(False)
+        self.streaming = False
+        self.background = None
+        self.draw()
+        
+    # Signature plot: the lines hold at most maxColumns points over the 
+    # visible readouts, rendered again from the pulse list when the 
+    # x limits change
+
+    def showSignature(self, signature, plotColors, maxColumns=2000):
+        self.axes.clear()
+        self.signatureSource = signature
+        self.signatureColumns = maxColumns
+        self.signatureLines = [self.axes.plot([], [], color=plotColor)[0] for plotColor in plotColors]
+        self.axes.set_xlim(0, max(signature.readoutCount - 1, 1))
+        self.renderSignature()
+        self.axes.relim()
+        self.axes.autoscale_view(scalex=False)
+        self.axes.callbacks.connect('xlim_changed', lambda axes: self.renderSignature())
+        self.draw()
+
+    def renderSignature(self):
+        lowerX, upperX = self.axes.get_xlim()
+        first = max(int(np.floor(lowerX)), 0)
+        last = min(int(np.ceil(upperX)) + 1, self.signatureSource.readoutCount)
+        step = max(-(-(last - first) // self.signatureColumns), 1)
+        profile = self.signatureSource.render(first, last, step)
+        xData = first + step * np.arange(profile.shape[1])
+        for wavelength, line in enumerate(self.signatureLines):
+            line.set_data(xData, profile[wavelength])
+
+    def redraw(self,xData,yData, clearBefore):
+        if clearBefore:
+            self.axes.clear()
+        for ind in range(len(yData)):
+            if ind == 0:
+                self.axes.plot(xData,yData[ind],'white')
+            else:
+                self.axes.plot(xData,yData[ind],color='gray', linestyle='dashed')
+        self.dataMax = max(yData[0][:])
+        self.dataMin = min(yData[0][:])
+        self.draw()
+
+    def drawOnTop(self,xData,yData, plotColor, connectedLines):
+        wavelengthCount = len(yData)
+        for wavelength in range(wavelengthCount):
+            if connectedLines:
+                self.axes.plot(xData,yData[wavelength],color=plotColor)
+            else:
+                self.axes.plot(xData,yData[wavelength],color=plotColor, marker='.')
+                #self.axes.plot(xData,yData[wavelength],color=plotColor, marker='.', linestyle='')
+
+        self.dataMax = max(yData)
+        self.dataMin = min(yData)            
+
+    def addSinglePlot(self,xData,yData, plotColor):
+        self.axes.plot(xData,yData,color=plotColor)        
+        self.draw()
+
+    def onScroll(self, event):
+        # Get current Y limits
+        currentYlim = self.axes.get_ylim()
+        lowerLimit, upperLimit = currentYlim
+
+        zoomFactor = 0.1 
+
+        # Check the direction of the scroll
+        if event.button == 'down':
+            # Zoom in
+            y_value = event.ydata
+            newLowerLimit = y_value - (y_value - lowerLimit) * (1 - zoomFactor)
+            newUpperLimit = y_value + (upperLimit - y_value) * (1 - zoomFactor)
+
+        elif event.button == 'up':
+            # Zoom out
+            y_value = event.ydata
+            newLowerLimit = y_value - (y_value - lowerLimit) * (1 + zoomFactor)
+            newUpperLimit = y_value + (upperLimit - y_value) * (1 + zoomFactor)
+
+        # Set new Y limits
+        self.axes.set_ylim(newLowerLimit, newUpperLimit)        
+        self.draw()
+
+    def onClick(self, event):
+        # Check if the click is within the axes        
+
+        if event.inaxes is not None:
+
+            if event.button == 1:  # Left mouse button
+                # Get the Y value at the clicked position
+                clickedValue = event.ydata
+                log.debug("Power value at clicked position: %s", clickedValue)
+                
+                self.newThresholdByClick.emit(clickedValue)
+
+            elif event.button == 3:  # Right mouse button
+                # Reset zoom
+                log.debug("Zoom reset to %s", self.dataMax)
+                if self.dataMax.size > 0:
+                    self.axes.set_ylim(0, self.dataMax)
+                    self.draw()
+        else:
+            log.debug("Clicked outside the axes")
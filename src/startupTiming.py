@@ -0,0 +1,46 @@
+"""    
+This program is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    This program is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import time
+
+class StartupTimer():
+    # Time taken by each startup phase: imports, window creation, plots.
+    # Phases are marked as they end, report() lists them in order.
+    # 'python SmartLPM.py test --timing' prints the report and exits.
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last = self.start
+        self.phases = []
+        self.onFinished = None
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases.append((phase, now - self.last))
+        self.last = now
+
+    def finish(self):
+        if self.onFinished is not None:
+            self.onFinished()
+
+    def report(self):
+        lines = ["Startup timing:"]
+        for phase, seconds in self.phases:
+            lines.append(f"  {phase:<26}{seconds * 1000:9.1f} ms")
+        lines.append(f"  {'total':<26}{(self.last - self.start) * 1000:9.1f} ms")
+        return '\n'.join(lines)
+
+# Shared by all the modules, started with the first import
+startupTimer = StartupTimer()